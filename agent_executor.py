@@ -0,0 +1,205 @@
+"""
+Pool de execução compartilhado para rodar o agente (support_agent.run)
+
+Substitui o ThreadPoolExecutor criado a cada mensagem por um único pool do
+processo, com número fixo de threads, limite de fila e métricas de espera
+na fila versus tempo de execução.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class AgentOverloadedError(Exception):
+    """Fila do agente cheia - a mensagem não pôde ser aceita a tempo"""
+
+
+class AgentExecutor:
+    """
+    Executor limitado para chamadas síncronas do agente
+
+    - AGENT_MAX_WORKERS: execuções simultâneas do agente
+    - AGENT_MAX_QUEUE: execuções aguardando thread livre
+    - AGENT_QUEUE_TIMEOUT: segundos que uma mensagem espera por vaga na fila
+      antes de ser rejeitada (backpressure)
+    """
+
+    def __init__(self, max_workers: int = None, max_queue: int = None, queue_timeout: float = None):
+        self.max_workers = max_workers or int(os.getenv("AGENT_MAX_WORKERS", "8"))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("AGENT_MAX_QUEUE", "100"))
+        self.queue_timeout = (
+            queue_timeout if queue_timeout is not None
+            else float(os.getenv("AGENT_QUEUE_TIMEOUT", "60"))
+        )
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="agent"
+        )
+        # Vagas = threads + fila; criado no primeiro uso (precisa do event loop)
+        self._slots = None
+        self._pending = 0
+
+        # Métricas (atualizadas também pelas threads do executor)
+        self._stats_lock = threading.Lock()
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._queue_wait_total = 0.0
+        self._queue_wait_max = 0.0
+        self._run_time_total = 0.0
+        self._run_time_max = 0.0
+
+    def _record_start(self, queue_wait: float):
+        with self._stats_lock:
+            self._running += 1
+            self._queue_wait_total += queue_wait
+            self._queue_wait_max = max(self._queue_wait_max, queue_wait)
+
+    def _record_end(self, run_time: float, failed: bool):
+        with self._stats_lock:
+            self._running -= 1
+            self._run_time_total += run_time
+            self._run_time_max = max(self._run_time_max, run_time)
+            if failed:
+                self._failed += 1
+            else:
+                self._completed += 1
+
+    async def _acquire(self):
+        """Reserva uma vaga (thread ou fila) ou rejeita após AGENT_QUEUE_TIMEOUT"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers + self.max_queue)
+
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            with self._stats_lock:
+                self._rejected += 1
+            logger.error(f"🚫 Fila do agente cheia ({self._pending} pendentes) - mensagem rejeitada")
+            raise AgentOverloadedError("Fila do agente cheia")
+
+        self._pending += 1
+
+    def _release(self):
+        self._pending -= 1
+        self._slots.release()
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Executa func(*args, **kwargs) no pool compartilhado
+
+        Aguarda vaga na fila por até AGENT_QUEUE_TIMEOUT segundos.
+
+        Raises:
+            AgentOverloadedError: se não houver vaga dentro do timeout
+        """
+        await self._acquire()
+        submitted = time.monotonic()
+
+        def job():
+            started = time.monotonic()
+            self._record_start(started - submitted)
+            failed = True
+            try:
+                result = func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                self._record_end(time.monotonic() - started, failed)
+
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, job)
+        finally:
+            self._release()
+
+    async def stream(self, func: Callable, *args, **kwargs) -> AsyncIterator[Any]:
+        """
+        Executa func(*args, **kwargs) - que devolve um iterador - no pool
+        compartilhado e entrega cada item ao event loop assim que é gerado
+
+        Usado com support_agent.run(..., stream=True). Mesma fila, limite e
+        métricas de run(); a vaga só é liberada quando o iterador termina.
+
+        Raises:
+            AgentOverloadedError: se não houver vaga dentro do timeout
+        """
+        await self._acquire()
+        submitted = time.monotonic()
+
+        loop = asyncio.get_running_loop()
+        items: asyncio.Queue = asyncio.Queue()
+        done = object()
+        stopped = threading.Event()
+
+        def job():
+            started = time.monotonic()
+            self._record_start(started - submitted)
+            failed = True
+            try:
+                iterator = func(*args, **kwargs)
+                try:
+                    for item in iterator:
+                        loop.call_soon_threadsafe(items.put_nowait, item)
+                        if stopped.is_set():
+                            break
+                finally:
+                    close = getattr(iterator, "close", None)
+                    if close is not None:
+                        close()
+                failed = False
+            except BaseException as e:
+                loop.call_soon_threadsafe(items.put_nowait, e)
+            finally:
+                self._record_end(time.monotonic() - started, failed)
+                loop.call_soon_threadsafe(items.put_nowait, done)
+
+        future = loop.run_in_executor(self._executor, job)
+        try:
+            while True:
+                item = await items.get()
+                if item is done:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # Consumidor parou antes do fim: a thread encerra o iterador no próximo item
+            stopped.set()
+            future.add_done_callback(lambda _: self._release())
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas de fila e execução do agente"""
+        with self._stats_lock:
+            started = self._completed + self._failed + self._running
+            finished = self._completed + self._failed
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": max(self._pending - self._running, 0),
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "queue_wait_avg_ms": round(self._queue_wait_total / started * 1000, 2) if started else 0.0,
+                "queue_wait_max_ms": round(self._queue_wait_max * 1000, 2),
+                "run_time_avg_ms": round(self._run_time_total / finished * 1000, 2) if finished else 0.0,
+                "run_time_max_ms": round(self._run_time_max * 1000, 2)
+            }
+
+    def shutdown(self):
+        """Encerra o pool sem aguardar execuções em andamento"""
+        self._executor.shutdown(wait=False)
+
+
+# Instância global
+agent_executor = AgentExecutor()
@@ -4,6 +4,7 @@ from agno.db.postgres import PostgresDb
 from dotenv import load_dotenv
 import sys
 import os
+from typing import Any, Dict, Optional
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
@@ -21,19 +22,20 @@ postgres_db = PostgresDb(
     db_url=database_url
 )
 
-support_agent = Agent(
-    name="Gabi",
-    model=OpenAIChat(id="gpt-4o-mini"),
-    description="Consultora de vendas SPDrop - natural, carismática e doce",
-    tools=[SPDropFAQTools(), SPDropMemoryTools(), ConversationScriptsTools(), TrialManagementTools(), DemoAccountTools()],
+# Runs anteriores da sessão repetidos no prompt pelo agno. O bloco de contexto
+# de cada rodada já traz as últimas trocas + o resumo das antigas dentro de
+# CONTEXT_TOKEN_BUDGET; 0 = só o bloco (prompt não cresce com a conversa)
+AGENT_HISTORY_RUNS = int(os.getenv("AGENT_HISTORY_RUNS", "0"))
 
-    # STORAGE: Usar PostgreSQL como storage persistente
-    db=postgres_db,
+# Cache de prompt da OpenAI: prefixos idênticos de 1024+ tokens são reaproveitados
+# (mais rápidos e com desconto). Tudo que é fixo vem primeiro e sempre igual -
+# lista de tools em ordem fixa, descrição e GABI_INSTRUCTIONS (com os planos e a
+# conta demo) - e o que muda fica no fim: a nota da etapa do funil
+# (additional_context, depois das instruções) e a mensagem do usuário com o bloco
+# [CONTEXTO DO CLIENTE]. Nada de data/hora ou dados do cliente nas instruções.
+GABI_DESCRIPTION = "Consultora de vendas SPDrop - natural, carismática e doce"
 
-    # MEMORY: Ativar memória de contexto
-    add_history_to_context=True,
-
-    instructions="""# GABI - Consultora SPDrop (Estrutura O.D.M.T)
+GABI_INSTRUCTIONS = """# GABI - Consultora SPDrop (Estrutura O.D.M.T)
 
 ## 1. OBJETIVO (Objective)
 Você é uma VENDEDORA CONSULTIVA. Seu objetivo é CONVERTER leads em assinantes pagos através de atendimento empático, proativo e direcionado ao fechamento.
@@ -78,9 +80,11 @@ Para: público qualificado que pode converter após teste
 
 ### 🚨 A CADA MENSAGEM (SEM EXCEÇÕES):
 
-**PASSO 1 - Buscar Contexto:**
+**PASSO 1 - Ler Contexto:**
+A mensagem já chega com o bloco [CONTEXTO DO CLIENTE] (nome, memórias,
+preferências, teste 7 dias e histórico recente). Use-o direto, SEM chamar tools.
 ```
-SEMPRE chamar (nessa ordem):
+Só chame (nessa ordem) se o bloco NÃO vier na mensagem:
 1. get_conversation_history(customer_id)
 2. get_important_memories(customer_id)
 ```
@@ -131,7 +135,7 @@ Cliente: "Gostaria de ver os produtos drop"
 **Exemplo 2 - Continuidade:**
 ```
 Cliente: "oi"
-→ Tools retornam: [histórico com Roberto sobre plano semestral]
+→ Contexto mostra: [histórico com Roberto sobre plano semestral]
 → "Oi Roberto! E aí, deu uma olhada na conta demo? Bora conversar sobre o semestral?"
 ```
 
@@ -144,10 +148,10 @@ Cliente: "quero ver os produtos"
 → CORRETO: Chamar fornecer_conta_demo() ✅
 ```
 
-**Erro 2 - Pular contexto:**
+**Erro 2 - Ignorar contexto:**
 ```
 Cliente: "oi"
-→ Pula tools ❌
+→ Ignora o bloco de contexto ❌
 → "Oi! Você já é assinante?" ❌ NUNCA FAÇA ISSO
 ```
 
@@ -158,14 +162,16 @@ Cliente: "oi"
   USE QUANDO: cliente quer ver produtos, catálogo, fornecedores, plataforma
   RETORNA: credenciais formatadas prontas para enviar
 
-**Memória (use sempre):**
-- `get_conversation_history(customer_id)`
-- `get_important_memories(customer_id)`
+**Memória:**
+- `get_conversation_history(customer_id)` - só se o bloco de contexto não vier
+- `get_important_memories(customer_id)` - só se o bloco de contexto não vier
 - `save_important_memory(customer_id, key, value)` - exemplos:
   • nome: `save_important_memory(id, 'nome_completo', 'Paulo')`
   • plano: `save_important_memory(id, 'plano_interesse', 'semestral')`
   • status: `save_important_memory(id, 'is_subscriber', 'sim/não')`
   • viu_demo: `save_important_memory(id, 'visualizou_demo', 'sim')`
+- `save_memories(customer_id, {key: value, ...})` - vários dados na mesma mensagem
+  (ex: nome + plano) em uma chamada só
 
 **FAQ (dúvidas técnicas):**
 - `buscar_faq(pergunta)` - para estoque, envio, integração, funcionalidades
@@ -234,11 +240,136 @@ Direcione ao suporte:
 3. SEMPRE seja proativa - conduza ao próximo passo
 4. Use FAQ para dúvidas técnicas
 5. Salve infos importantes na memória
-6. SEMPRE consulte histórico primeiro
+6. SEMPRE leia o contexto/histórico primeiro
 7. PRIORIDADE: Demo → Trial → Venda
-""",
-    markdown=True,
-)
+"""
+
+# Ferramentas compartilhadas pelos agentes de cada etapa
+# FAQ compartilhado: o índice é recarregado em segundo plano quando o CSV muda
+faq_tools = SPDropFAQTools()
+memory_tools = SPDropMemoryTools()
+demo_tools = DemoAccountTools()
+trial_tools = TrialManagementTools()
+scripts_tools = ConversationScriptsTools()
+
+# Etapas do funil (funnel_stage) com agente e tools próprios; false = um agente só
+AGENT_STAGE_TOOLS = os.getenv("AGENT_STAGE_TOOLS", "true").lower() in ("1", "true", "yes")
+
+# Tools de atendimento, em ordem fixa (o schema vai em toda chamada ao LLM).
+# Ficam de fora as de administração (get_trial_users, get_active_trials,
+# get_expired_trials, update_trial_status, convert_trial_to_paid - usadas pelo
+# painel em api/), as de sessão/histórico que o main.py já grava e as
+# duplicadas (verificar_se_deve_oferecer_demo, buscar_resposta_por_palavra_chave).
+BASE_TOOLS = [
+    demo_tools.fornecer_conta_demo,
+    faq_tools.buscar_faq,
+    faq_tools.listar_todas_perguntas,
+    memory_tools.save_important_memory,
+    memory_tools.save_memories,
+    scripts_tools.buscar_por_etapa,
+    scripts_tools.buscar_por_perfil,
+]
+
+# Só quando o bloco de contexto não vem na mensagem (chat.py, testes, falha no banco)
+CONTEXT_TOOLS = [
+    memory_tools.get_conversation_history,
+    memory_tools.get_important_memories,
+]
+
+# Extras de cada etapa vão no fim: a lista comum continua sendo o mesmo prefixo
+# create_trial_user fica em todas as etapas antes da assinatura: o cliente pode
+# pedir o teste a qualquer momento (a tool recusa um segundo teste ativo)
+PRE_SUBSCRIBER_TOOLS = BASE_TOOLS + [trial_tools.create_trial_user]
+
+STAGE_TOOLS = {
+    "curioso": PRE_SUBSCRIBER_TOOLS,
+    "interessado": PRE_SUBSCRIBER_TOOLS,
+    "em_teste": PRE_SUBSCRIBER_TOOLS,
+    "teste_encerrado": PRE_SUBSCRIBER_TOOLS,
+    "assinante": [faq_tools.buscar_faq, memory_tools.save_important_memory],
+}
+
+STAGE_NOTES = {
+    "curioso": "ETAPA DO FUNIL: CURIOSO (primeira conversa). Apresente-se e ofereça a conta demo; "
+               "se o cliente já pedir o teste 7 dias, colete os dados e crie o teste.",
+    "interessado": "ETAPA DO FUNIL: INTERESSADO. Destaque benefícios, quebre objeções e ofereça o teste 7 dias "
+                   "a quem quer usar de verdade.",
+    "em_teste": "ETAPA DO FUNIL: EM TESTE (cliente já tem teste 7 dias - não crie outro). "
+                "Acompanhe o teste, reforce a urgência e conduza ao plano semestral.",
+    "teste_encerrado": "ETAPA DO FUNIL: TESTE ENCERRADO (o teste 7 dias do cliente expirou ou foi cancelado). "
+                       "Pergunte como foi a experiência, quebre objeções e conduza ao plano semestral.",
+    "assinante": "ETAPA DO FUNIL: ASSINANTE. Direcione ao suporte técnico: WhatsApp (11) 93299-4698.",
+}
+
+
+def _build_agent(tools: list, additional_context: str = None) -> Agent:
+    return Agent(
+        name="Gabi",
+        model=OpenAIChat(id="gpt-4o-mini"),
+        description=GABI_DESCRIPTION,
+        tools=tools,
+
+        # STORAGE: Usar PostgreSQL como storage persistente
+        db=postgres_db,
+
+        # MEMORY: histórico da sessão do agno só quando AGENT_HISTORY_RUNS > 0
+        add_history_to_context=AGENT_HISTORY_RUNS > 0,
+        num_history_runs=max(AGENT_HISTORY_RUNS, 1),
+
+        instructions=GABI_INSTRUCTIONS,
+        additional_context=additional_context,
+        markdown=True,
+    )
+
+
+# Agente completo (sem bloco de contexto: busca histórico/memórias pelas tools)
+support_agent = _build_agent(BASE_TOOLS + [trial_tools.create_trial_user] + CONTEXT_TOOLS)
+
+stage_agents = {
+    stage: _build_agent(tools, STAGE_NOTES[stage])
+    for stage, tools in STAGE_TOOLS.items()
+} if AGENT_STAGE_TOOLS else {}
+
+
+def funnel_stage(context: Optional[Dict[str, Any]]) -> Optional[str]:
+    """
+    Etapa do funil do cliente a partir do contexto da rodada
+
+    Args:
+        context: Contexto da rodada (customer_repository.get_turn_context)
+
+    Returns:
+        'curioso', 'interessado', 'em_teste', 'teste_encerrado', 'assinante'
+        ou None sem contexto
+    """
+    if context is None:
+        return None
+
+    subscriber = (context.get("memories") or {}).get("is_subscriber")
+    if isinstance(subscriber, dict):
+        subscriber = subscriber.get("value")
+    if str(subscriber or "").strip().lower().startswith("sim"):
+        return "assinante"
+
+    # Etapa pelo último teste: status + validade (o status nem sempre é
+    # atualizado quando o prazo vence)
+    trial = context.get("trial")
+    if trial:
+        status = (trial.get("status") or "active").lower()
+        if status == "converted":
+            return "assinante"
+        if status == "active" and not trial.get("expired"):
+            return "em_teste"
+        return "teste_encerrado"
+    if context.get("history") or context.get("summary"):
+        return "interessado"
+    return "curioso"
+
+
+def agent_for_stage(stage: Optional[str]) -> Agent:
+    """Agente da etapa do funil (support_agent sem etapa ou com AGENT_STAGE_TOOLS=false)"""
+    return stage_agents.get(stage, support_agent)
+
 
 if __name__ == "__main__":
     support_agent.print_response(
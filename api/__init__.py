@@ -47,6 +47,19 @@ def create_app():
 
     @app.get("/health")
     def health():
-        return {"status": "healthy"}
+        from api.database import get_pool_stats
+        from whatsapp_integration import whatsapp_client
+        return {
+            "status": "healthy",
+            "db_pool": get_pool_stats(),
+            "whatsapp_http": whatsapp_client.stats()
+        }
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        from db_pool import db_pool
+        from whatsapp_integration import whatsapp_client
+        db_pool.closeall()
+        await whatsapp_client.close()
 
     return app
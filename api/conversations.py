@@ -8,6 +8,7 @@ from typing import Optional, List
 from datetime import datetime
 from api.database import get_db_cursor
 from api.auth import verify_token
+from customer_cache import customer_cache
 
 router = APIRouter()
 
@@ -424,6 +425,9 @@ def update_trial_status(
                     detail="Teste não encontrado"
                 )
 
+            # Bot (outros processos) descarta o contexto em cache após o commit
+            customer_cache.notify_invalidation(cur, trial['customer_id'], ("turn_context",))
+
             # Registrar auditoria
             cur.execute("""
                 INSERT INTO audit_log (admin_id, action, details)
@@ -434,11 +438,12 @@ def update_trial_status(
                 f"Trial ID {trial_id} status alterado para {request.status}"
             ))
 
-            return {
-                "success": True,
-                "message": f"Status atualizado para '{request.status}'",
-                "trial": dict(trial)
-            }
+        customer_cache.invalidate_customer(trial['customer_id'], ("turn_context",))
+        return {
+            "success": True,
+            "message": f"Status atualizado para '{request.status}'",
+            "trial": dict(trial)
+        }
 
     except HTTPException:
         raise
@@ -473,7 +478,7 @@ def convert_trial_to_paid(
                     conversion_date = CURRENT_TIMESTAMP,
                     updated_at = CURRENT_TIMESTAMP
                 WHERE id = %s
-                RETURNING id, full_name, converted_to_plan, conversion_date
+                RETURNING id, customer_id, full_name, converted_to_plan, conversion_date
             """, (request.plan_name, trial_id))
 
             trial = cur.fetchone()
@@ -484,6 +489,9 @@ def convert_trial_to_paid(
                     detail="Teste não encontrado"
                 )
 
+            # Bot (outros processos) descarta o contexto em cache após o commit
+            customer_cache.notify_invalidation(cur, trial['customer_id'], ("turn_context",))
+
             # Registrar auditoria
             cur.execute("""
                 INSERT INTO audit_log (admin_id, action, details)
@@ -494,11 +502,12 @@ def convert_trial_to_paid(
                 f"Trial ID {trial_id} convertido para plano {request.plan_name}"
             ))
 
-            return {
-                "success": True,
-                "message": f"🎉 {trial['full_name']} converteu para {request.plan_name}!",
-                "trial": dict(trial)
-            }
+        customer_cache.invalidate_customer(trial['customer_id'], ("turn_context",))
+        return {
+            "success": True,
+            "message": f"🎉 {trial['full_name']} converteu para {request.plan_name}!",
+            "trial": dict(trial)
+        }
 
     except HTTPException:
         raise
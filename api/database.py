@@ -5,19 +5,11 @@ Gerenciador de conexões com o banco de dados PostgreSQL
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from contextlib import contextmanager
-import os
 import logging
 
-logger = logging.getLogger(__name__)
+from db_pool import db_pool, DB_CONFIG
 
-# Configurações do banco
-DB_CONFIG = {
-    "host": os.getenv("DB_HOST", "postgres"),
-    "port": int(os.getenv("DB_PORT", "5432")),
-    "database": os.getenv("DB_NAME", "spdrop_db"),
-    "user": os.getenv("DB_USER", "spdrop_user"),
-    "password": os.getenv("DB_PASSWORD", "spdrop_password")
-}
+logger = logging.getLogger(__name__)
 
 
 @contextmanager
@@ -25,6 +17,8 @@ def get_db_connection():
     """
     Context manager para conexões com o banco de dados
 
+    A conexão vem do pool compartilhado (db_pool) e é devolvida ao final.
+
     Uso:
         with get_db_connection() as conn:
             with conn.cursor() as cur:
@@ -33,7 +27,7 @@ def get_db_connection():
     """
     conn = None
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
+        conn = db_pool.getconn()
         yield conn
         conn.commit()
     except psycopg2.Error as e:
@@ -74,3 +68,8 @@ def test_connection():
     except Exception as e:
         logger.error(f"Falha ao conectar no banco: {e}")
         return False
+
+
+def get_pool_stats():
+    """Métricas do pool de conexões compartilhado"""
+    return db_pool.stats()
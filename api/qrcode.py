@@ -5,19 +5,19 @@ Rotas de QR Code - Geração e Status de Conexão WhatsApp
 from fastapi import APIRouter, HTTPException, Depends
 from fastapi.responses import StreamingResponse
 from api.auth import verify_token
-import requests
+from whatsapp_integration import whatsapp_client
+import httpx
 import io
 import logging
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# URL do serviço WhatsApp
-WHATSAPP_SERVICE_URL = "http://whatsapp:3000"
+# Serviço WhatsApp: WHATSAPP_API_URL, pelo pool keep-alive de whatsapp_client
 
 
 @router.get("/generate")
-def generate_qr_code(token_data: dict = Depends(verify_token)):
+async def generate_qr_code(token_data: dict = Depends(verify_token)):
     """
     Gera QR Code para autenticação do WhatsApp
 
@@ -27,7 +27,7 @@ def generate_qr_code(token_data: dict = Depends(verify_token)):
     """
     try:
         # Fazer requisição ao serviço WhatsApp
-        response = requests.get(f"{WHATSAPP_SERVICE_URL}/qr", timeout=10)
+        response = await whatsapp_client.request("GET", "/qr", timeout=10)
 
         if response.status_code == 200:
             # Retornar imagem diretamente
@@ -48,12 +48,12 @@ def generate_qr_code(token_data: dict = Depends(verify_token)):
                 detail=f"Erro ao gerar QR Code: {response.text}"
             )
 
-    except requests.exceptions.ConnectionError:
+    except httpx.ConnectError:
         raise HTTPException(
             status_code=503,
             detail="Serviço WhatsApp não disponível. Verifique se o container está rodando."
         )
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         raise HTTPException(
             status_code=504,
             detail="Timeout ao conectar com serviço WhatsApp"
@@ -69,7 +69,7 @@ def generate_qr_code(token_data: dict = Depends(verify_token)):
 
 
 @router.get("/status")
-def get_whatsapp_status(token_data: dict = Depends(verify_token)):
+async def get_whatsapp_status(token_data: dict = Depends(verify_token)):
     """
     Verifica status da conexão WhatsApp
 
@@ -81,7 +81,7 @@ def get_whatsapp_status(token_data: dict = Depends(verify_token)):
         - phone: string (se conectado)
     """
     try:
-        response = requests.get(f"{WHATSAPP_SERVICE_URL}/status", timeout=5)
+        response = await whatsapp_client.request("GET", "/status", timeout=5)
 
         if response.status_code == 200:
             data = response.json()
@@ -95,14 +95,14 @@ def get_whatsapp_status(token_data: dict = Depends(verify_token)):
                 detail=f"Erro ao verificar status: {response.text}"
             )
 
-    except requests.exceptions.ConnectionError:
+    except httpx.ConnectError:
         return {
             "success": False,
             "connected": False,
             "ready": False,
             "error": "Serviço WhatsApp não disponível"
         }
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         return {
             "success": False,
             "connected": False,
@@ -120,14 +120,14 @@ def get_whatsapp_status(token_data: dict = Depends(verify_token)):
 
 
 @router.post("/disconnect")
-def disconnect_whatsapp(token_data: dict = Depends(verify_token)):
+async def disconnect_whatsapp(token_data: dict = Depends(verify_token)):
     """
     Desconecta o WhatsApp (logout)
 
     Requer autenticação JWT
     """
     try:
-        response = requests.post(f"{WHATSAPP_SERVICE_URL}/disconnect", timeout=10)
+        response = await whatsapp_client.request("POST", "/disconnect", timeout=10)
 
         if response.status_code == 200:
             data = response.json()
@@ -142,12 +142,12 @@ def disconnect_whatsapp(token_data: dict = Depends(verify_token)):
                 detail=f"Erro ao desconectar: {response.text}"
             )
 
-    except requests.exceptions.ConnectionError:
+    except httpx.ConnectError:
         raise HTTPException(
             status_code=503,
             detail="Serviço WhatsApp não disponível"
         )
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         raise HTTPException(
             status_code=504,
             detail="Timeout ao desconectar WhatsApp"
@@ -163,7 +163,7 @@ def disconnect_whatsapp(token_data: dict = Depends(verify_token)):
 
 
 @router.post("/restart")
-def restart_whatsapp_service(token_data: dict = Depends(verify_token)):
+async def restart_whatsapp_service(token_data: dict = Depends(verify_token)):
     """
     Reinicia o serviço WhatsApp
 
@@ -171,7 +171,7 @@ def restart_whatsapp_service(token_data: dict = Depends(verify_token)):
     Útil quando há problemas de conexão
     """
     try:
-        response = requests.post(f"{WHATSAPP_SERVICE_URL}/restart", timeout=15)
+        response = await whatsapp_client.request("POST", "/restart", timeout=15)
 
         if response.status_code == 200:
             data = response.json()
@@ -186,12 +186,12 @@ def restart_whatsapp_service(token_data: dict = Depends(verify_token)):
                 detail=f"Erro ao reiniciar: {response.text}"
             )
 
-    except requests.exceptions.ConnectionError:
+    except httpx.ConnectError:
         raise HTTPException(
             status_code=503,
             detail="Serviço WhatsApp não disponível"
         )
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         raise HTTPException(
             status_code=504,
             detail="Timeout ao reiniciar serviço"
@@ -207,14 +207,14 @@ def restart_whatsapp_service(token_data: dict = Depends(verify_token)):
 
 
 @router.get("/health")
-def whatsapp_health_check(token_data: dict = Depends(verify_token)):
+async def whatsapp_health_check(token_data: dict = Depends(verify_token)):
     """
     Health check do serviço WhatsApp
 
     Verifica se o serviço está respondendo
     """
     try:
-        response = requests.get(f"{WHATSAPP_SERVICE_URL}/health", timeout=3)
+        response = await whatsapp_client.request("GET", "/health", timeout=3)
 
         if response.status_code == 200:
             return {
@@ -230,7 +230,7 @@ def whatsapp_health_check(token_data: dict = Depends(verify_token)):
                 "status_code": response.status_code
             }
 
-    except requests.exceptions.ConnectionError:
+    except httpx.ConnectError:
         return {
             "success": False,
             "message": "Serviço WhatsApp não está respondendo",
@@ -0,0 +1,220 @@
+"""
+Resumo incremental das conversas longas
+
+O bloco de contexto da rodada leva só as últimas CONTEXT_HISTORY_LIMIT
+trocas literais. Tudo que é mais antigo que essa janela é condensado em um
+resumo por cliente (tabela customer_summaries), atualizado aos poucos:
+
+    - get_turn_context traz o resumo e quantas trocas ainda não entraram nele
+    - quando CONTEXT_SUMMARY_BATCH trocas já saíram da janela sem resumo,
+      uma Task em segundo plano junta o resumo anterior + essas trocas em um
+      resumo novo (uma chamada curta ao LLM) - a rodada não espera
+    - summarized_until marca a última troca resumida; cada atualização lê
+      no máximo CONTEXT_SUMMARY_MAX_TURNS trocas
+
+Assim o tamanho do prompt (e a latência) não cresce com a idade da conversa.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+
+import asyncpg
+
+from customer_repository import customer_repository
+from customer_cache import customer_cache
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS customer_summaries (
+        customer_id INTEGER PRIMARY KEY REFERENCES customers(id) ON DELETE CASCADE,
+        summary TEXT NOT NULL,
+        summarized_until TIMESTAMP NOT NULL,
+        turns_summarized INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_conversation_customer_timestamp
+        ON conversation_history(customer_id, timestamp);
+"""
+
+SUMMARY_PROMPT = """Você mantém o resumo de uma conversa de WhatsApp entre um cliente e a Gabi, \
+consultora de vendas da SPDrop (plataforma de dropshipping).
+
+Resumo atual (pode estar vazio):
+{summary}
+
+Trocas novas, mais antigas primeiro:
+{turns}
+
+Escreva o resumo atualizado em português, em no máximo 8 linhas curtas, juntando o resumo atual \
+com as trocas novas. Mantenha só o que ajuda a continuar o atendimento: nome e dados que o cliente \
+informou, interesses e dúvidas, objeções, planos/links/contas já enviados, teste 7 dias, combinados \
+e próximos passos. Não invente nada."""
+
+
+class ConversationSummarizer:
+    """Mantém o resumo das trocas que já saíram da janela de contexto"""
+
+    def __init__(self):
+        self.enabled = os.getenv("CONTEXT_SUMMARY_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.batch = int(os.getenv("CONTEXT_SUMMARY_BATCH", "6"))
+        self.max_turns = int(os.getenv("CONTEXT_SUMMARY_MAX_TURNS", "40"))
+        self.model = os.getenv("CONTEXT_SUMMARY_MODEL", "gpt-4o-mini")
+        self.max_tokens = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "300"))
+        self.text_limit = int(os.getenv("CONTEXT_SUMMARY_TEXT_LIMIT", "500"))
+
+        self._client = None
+        # Clientes com resumo sendo atualizado (uma atualização por vez)
+        self._running: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+        # Métricas
+        self._updates = 0
+        self._turns_summarized = 0
+        self._failures = 0
+        self._update_time_total = 0.0
+
+    async def ensure_schema(self):
+        """Cria a tabela de resumos (e o índice por cliente/data do histórico)"""
+        pool = await customer_repository.get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(SCHEMA_SQL)
+
+    def maybe_update(self, customer_id: int, context: Optional[Dict[str, Any]]):
+        """
+        Agenda a atualização do resumo se trocas suficientes saíram da janela
+
+        Args:
+            customer_id: ID do cliente
+            context: Contexto da rodada (customer_repository.get_turn_context)
+        """
+        if not self.enabled or context is None or customer_id in self._running:
+            return
+
+        outside_window = context.get("unsummarized", 0) - customer_repository.history_limit
+        if outside_window < self.batch:
+            return
+
+        self._running.add(customer_id)
+        task = asyncio.create_task(self._update(customer_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _complete(self, prompt: str) -> str:
+        if self._client is None:
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+        response = await self._client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=self.max_tokens,
+            temperature=0.2
+        )
+        return (response.choices[0].message.content or "").strip()
+
+    async def _update(self, customer_id: int):
+        """Junta ao resumo as trocas mais antigas que a janela de contexto"""
+        started = time.monotonic()
+        try:
+            pool = await customer_repository.get_pool()
+            async with pool.acquire(timeout=customer_repository.timeout) as conn:
+                current = await conn.fetchrow("""
+                    SELECT summary, summarized_until FROM customer_summaries WHERE customer_id = $1
+                """, customer_id)
+                turns = await conn.fetch("""
+                    WITH window_start AS (
+                        SELECT min(timestamp) AS ts FROM (
+                            SELECT timestamp FROM conversation_history
+                            WHERE customer_id = $1
+                            ORDER BY timestamp DESC
+                            LIMIT $2
+                        ) recent
+                    )
+                    SELECT user_message, agent_response, timestamp
+                    FROM conversation_history
+                    WHERE customer_id = $1
+                      AND timestamp > $3
+                      AND timestamp < (SELECT ts FROM window_start)
+                    ORDER BY timestamp
+                    LIMIT $4
+                """, customer_id, customer_repository.history_limit,
+                    current["summarized_until"] if current else datetime.min, self.max_turns)
+
+            if not turns:
+                return
+
+            summary = current["summary"] if current else ""
+            prompt = SUMMARY_PROMPT.format(summary=summary or "(vazio)", turns=self._render_turns(turns))
+            new_summary = await self._complete(prompt)
+            if not new_summary:
+                raise ValueError("resumo vazio")
+
+            summarized_until = turns[-1]["timestamp"]
+            async with pool.acquire(timeout=customer_repository.timeout) as conn:
+                await conn.execute("""
+                    INSERT INTO customer_summaries (customer_id, summary, summarized_until, turns_summarized)
+                    VALUES ($1, $2, $3, $4)
+                    ON CONFLICT (customer_id) DO UPDATE
+                    SET summary = EXCLUDED.summary,
+                        summarized_until = EXCLUDED.summarized_until,
+                        turns_summarized = customer_summaries.turns_summarized + EXCLUDED.turns_summarized,
+                        updated_at = CURRENT_TIMESTAMP
+                """, customer_id, new_summary, summarized_until, len(turns))
+
+            # Contexto em cache passa a usar o resumo novo
+            customer_cache.update(
+                "turn_context", customer_id,
+                lambda context: {
+                    **context,
+                    "summary": new_summary,
+                    "unsummarized": max(0, context.get("unsummarized", 0) - len(turns))
+                },
+                customer_id
+            )
+
+            elapsed = time.monotonic() - started
+            self._updates += 1
+            self._turns_summarized += len(turns)
+            self._update_time_total += elapsed
+            logger.info(f"🗜️ Resumo do cliente {customer_id} atualizado com {len(turns)} trocas em {elapsed * 1000:.0f}ms")
+
+        except (asyncpg.PostgresError, OSError, asyncio.TimeoutError) as e:
+            self._failures += 1
+            logger.error(f"Erro ao atualizar resumo do cliente {customer_id}: {e}")
+        except Exception as e:
+            self._failures += 1
+            logger.error(f"Erro ao gerar resumo do cliente {customer_id}: {e}")
+        finally:
+            self._running.discard(customer_id)
+
+    def _render_turns(self, turns: List[Any]) -> str:
+        lines = []
+        for turn in turns:
+            lines.append(f"Cliente: {(turn['user_message'] or '')[:self.text_limit]}")
+            lines.append(f"Gabi: {(turn['agent_response'] or '')[:self.text_limit]}")
+        return "\n".join(lines)
+
+    async def stop(self):
+        """Aguarda as atualizações em andamento (no desligamento)"""
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=10)
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas do resumo incremental"""
+        return {
+            "enabled": self.enabled,
+            "updates": self._updates,
+            "running": len(self._running),
+            "turns_summarized": self._turns_summarized,
+            "failures": self._failures,
+            "update_avg_ms": round(self._update_time_total / self._updates * 1000, 1) if self._updates else 0.0
+        }
+
+
+# Instância global
+conversation_summarizer = ConversationSummarizer()
@@ -0,0 +1,326 @@
+"""
+Cache por cliente (LRU + TTL) para leituras repetidas a cada rodada
+
+Clientes em conversa ativa leem as mesmas linhas a cada mensagem (cliente
+pelo telefone, contexto, memórias). As entradas ficam em memória, chaveadas
+por (tipo, chave) e agrupadas por customer_id:
+
+    - leituras consultam o cache antes do Postgres
+    - escritas (memórias, contexto, preferências, teste 7 dias) invalidam,
+      depois do commit, só os tipos de entrada do cliente que mudaram; novas
+      trocas de mensagem atualizam o contexto em cache (write-through) em vez
+      de invalidar
+
+Cada processo tem o próprio nível local. Para que uma escrita feita em outro
+processo (outro worker do bot, painel em api/) chegue a todos, quem escreve
+chama notify_invalidation() na mesma transação: é um NOTIFY no Postgres, que
+só é entregue no commit. Os processos do bot escutam o canal
+(customer_repository.start_cache_listener) e descartam as entradas locais
+do cliente; se a escuta cair, o nível local inteiro é descartado ao reconectar.
+
+Opcionalmente, com CUSTOMER_CACHE_REDIS_URL e o pacote redis instalado, um
+Redis é usado como segundo nível compartilhado entre workers/réplicas (a
+invalidação apaga as chaves do cliente no Redis também).
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - dependência opcional
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Retornado por get() quando a chave não está em cache (None é um valor válido)
+MISSING = object()
+
+REDIS_PREFIX = "spdrop:cache:"
+
+# Canal do LISTEN/NOTIFY com as invalidações (payload JSON: origin, customer_id, kinds)
+INVALIDATION_CHANNEL = "customer_cache_invalidation"
+
+
+class CustomerCache:
+    """Cache LRU/TTL em memória, com Redis opcional como segundo nível"""
+
+    def __init__(self, max_entries: int = None, ttl: float = None):
+        self.enabled = os.getenv("CUSTOMER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.max_entries = max_entries or int(os.getenv("CUSTOMER_CACHE_MAX_ENTRIES", "5000"))
+        self.ttl = ttl if ttl is not None else float(os.getenv("CUSTOMER_CACHE_TTL", "300"))
+
+        # (tipo, chave) -> (expira_em, valor, customer_id)
+        self._entries: "OrderedDict[Tuple[str, Hashable], Tuple[float, Any, Optional[int]]]" = OrderedDict()
+        # customer_id -> chaves do cliente (para invalidação)
+        self._by_customer: Dict[int, Set[Tuple[str, Hashable]]] = {}
+        self._lock = threading.Lock()
+        # Identifica este processo nas notificações (as próprias são ignoradas)
+        self.origin = uuid.uuid4().hex
+
+        self._redis = None
+        redis_url = os.getenv("CUSTOMER_CACHE_REDIS_URL")
+        if self.enabled and redis_url:
+            if redis is None:
+                logger.warning("⚠️ CUSTOMER_CACHE_REDIS_URL definido mas o pacote redis não está instalado")
+            else:
+                timeout = float(os.getenv("CUSTOMER_CACHE_REDIS_TIMEOUT", "0.1"))
+                self._redis = redis.Redis.from_url(
+                    redis_url, socket_timeout=timeout, socket_connect_timeout=timeout
+                )
+
+        # Métricas
+        self._hits = 0
+        self._shared_hits = 0
+        self._misses = 0
+        self._invalidations = 0
+        self._remote_invalidations = 0
+        self._evictions = 0
+        self._shared_errors = 0
+
+    @staticmethod
+    def _redis_key(kind: str, key: Hashable) -> str:
+        return f"{REDIS_PREFIX}{kind}:{key}"
+
+    def _shared(self, operation: Callable[[Any], Any]) -> Any:
+        """Executa uma operação no Redis; falhas não afetam o cache local"""
+        if self._redis is None:
+            return None
+        try:
+            return operation(self._redis)
+        except Exception as e:
+            self._shared_errors += 1
+            logger.warning(f"⚠️ Cache compartilhado indisponível: {e}")
+            return None
+
+    def _store(self, entry_key: Tuple[str, Hashable], value: Any, customer_id: Optional[int]):
+        """Grava no nível local (chamar com o lock)"""
+        self._remove(entry_key)
+        self._entries[entry_key] = (time.monotonic() + self.ttl, value, customer_id)
+        if customer_id is not None:
+            self._by_customer.setdefault(customer_id, set()).add(entry_key)
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self._evictions += 1
+
+    def _remove(self, entry_key: Tuple[str, Hashable]):
+        """Remove uma entrada local e a tira do índice por cliente (chamar com o lock)"""
+        entry = self._entries.pop(entry_key, None)
+        if entry is None or entry[2] is None:
+            return
+        keys = self._by_customer.get(entry[2])
+        if keys is not None:
+            keys.discard(entry_key)
+            if not keys:
+                del self._by_customer[entry[2]]
+
+    def _local(self, entry_key: Tuple[str, Hashable]) -> Any:
+        """Valor local válido ou MISSING (chamar com o lock)"""
+        entry = self._entries.get(entry_key)
+        if entry is None:
+            return MISSING
+        if entry[0] <= time.monotonic():
+            self._remove(entry_key)
+            return MISSING
+        return entry[1]
+
+    def get(self, kind: str, key: Hashable) -> Any:
+        """
+        Busca um valor em cache
+
+        Returns:
+            O valor, ou MISSING se não estiver em cache / expirado
+        """
+        if not self.enabled:
+            return MISSING
+
+        entry_key = (kind, key)
+        with self._lock:
+            value = self._local(entry_key)
+            if value is not MISSING:
+                self._entries.move_to_end(entry_key)
+                self._hits += 1
+                return value
+
+        raw = self._shared(lambda r: r.get(self._redis_key(kind, key)))
+        if raw is not None:
+            envelope = json.loads(raw)
+            with self._lock:
+                self._store(entry_key, envelope["value"], envelope.get("customer_id"))
+                self._shared_hits += 1
+            return envelope["value"]
+
+        with self._lock:
+            self._misses += 1
+        return MISSING
+
+    def set(self, kind: str, key: Hashable, value: Any, customer_id: Optional[int] = None):
+        """
+        Grava um valor em cache
+
+        Args:
+            kind: Tipo da entrada (ex: "turn_context", "memories")
+            key: Chave dentro do tipo (customer_id, telefone...)
+            value: Valor - não deve ser alterado depois (é compartilhado)
+            customer_id: Cliente dono da entrada, para invalidate_customer()
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._store((kind, key), value, customer_id)
+
+        if self._redis is not None:
+            redis_key = self._redis_key(kind, key)
+            payload = json.dumps(
+                {"customer_id": customer_id, "value": value}, ensure_ascii=False, default=str
+            )
+
+            def write(r):
+                pipe = r.pipeline()
+                pipe.setex(redis_key, int(self.ttl), payload)
+                if customer_id is not None:
+                    index_key = f"{REDIS_PREFIX}customer:{customer_id}"
+                    pipe.sadd(index_key, redis_key)
+                    pipe.expire(index_key, int(self.ttl))
+                pipe.execute()
+
+            self._shared(write)
+
+    def update(self, kind: str, key: Hashable, fn: Callable[[Any], Any], customer_id: Optional[int] = None) -> bool:
+        """
+        Write-through: substitui o valor em cache por fn(valor atual)
+
+        fn deve devolver um objeto novo (leitores podem estar usando o antigo).
+
+        Returns:
+            True se havia valor em cache para atualizar
+        """
+        if not self.enabled:
+            return False
+
+        with self._lock:
+            current = self._local((kind, key))
+
+        if current is MISSING:
+            # Sem cópia local: a cópia compartilhada (se houver) ficou velha
+            self._shared(lambda r: r.delete(self._redis_key(kind, key)))
+            return False
+
+        self.set(kind, key, fn(current), customer_id)
+        return True
+
+    def notify_invalidation(self, cursor, customer_id: Optional[int], kinds: Optional[Iterable[str]] = None):
+        """
+        Avisa os outros processos de uma escrita do cliente (NOTIFY no Postgres)
+
+        Chamar com o cursor da transação da escrita: a notificação só sai no
+        commit (e some no rollback). Depois do commit, chamar
+        invalidate_customer() para o cache deste processo.
+
+        Args:
+            cursor: Cursor psycopg2 da transação da escrita
+            customer_id: Cliente alterado
+            kinds: Tipos de entrada que a escrita alterou (None = todos)
+        """
+        if not self.enabled or customer_id is None:
+            return
+        payload = json.dumps({
+            "origin": self.origin,
+            "customer_id": customer_id,
+            "kinds": list(kinds) if kinds is not None else None
+        })
+        cursor.execute("SELECT pg_notify(%s, %s)", (INVALIDATION_CHANNEL, payload))
+
+    def apply_invalidation(self, payload: str):
+        """Aplica no nível local uma invalidação recebida pelo canal do Postgres"""
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            logger.warning(f"⚠️ Notificação de cache inválida: {payload[:200]}")
+            return
+        if message.get("origin") == self.origin:
+            return
+
+        self._invalidate_local(message.get("customer_id"), message.get("kinds"))
+        with self._lock:
+            self._remote_invalidations += 1
+
+    def clear_local(self):
+        """Descarta todo o nível local (notificações podem ter sido perdidas)"""
+        with self._lock:
+            self._entries.clear()
+            self._by_customer.clear()
+
+    def _invalidate_local(self, customer_id: Optional[int], kinds: Optional[Iterable[str]] = None):
+        if customer_id is None:
+            return
+        kinds = set(kinds) if kinds is not None else None
+        with self._lock:
+            for entry_key in list(self._by_customer.get(customer_id, ())):
+                if kinds is None or entry_key[0] in kinds:
+                    self._remove(entry_key)
+
+    def invalidate_customer(self, customer_id: Optional[int], kinds: Optional[Iterable[str]] = None):
+        """
+        Remove as entradas de um cliente (depois do commit da escrita)
+
+        Args:
+            customer_id: Cliente alterado
+            kinds: Só os tipos que a escrita alterou (ex: ("turn_context",));
+                   None remove todas as entradas do cliente
+        """
+        if not self.enabled or customer_id is None:
+            return
+
+        kinds = tuple(kinds) if kinds is not None else None
+        self._invalidate_local(customer_id, kinds)
+        with self._lock:
+            self._invalidations += 1
+
+        if self._redis is not None:
+            index_key = f"{REDIS_PREFIX}customer:{customer_id}"
+            prefixes = tuple(f"{REDIS_PREFIX}{kind}:" for kind in kinds) if kinds is not None else None
+
+            def drop(r):
+                keys = [key.decode() if isinstance(key, bytes) else key for key in r.smembers(index_key)]
+                if prefixes is None:
+                    r.delete(index_key, *keys)
+                    return
+                keys = [key for key in keys if key.startswith(prefixes)]
+                if keys:
+                    r.srem(index_key, *keys)
+                    r.delete(*keys)
+
+            self._shared(drop)
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas do cache"""
+        with self._lock:
+            lookups = self._hits + self._shared_hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "shared": self._redis is not None,
+                "entries": len(self._entries),
+                "customers": len(self._by_customer),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "shared_hits": self._shared_hits,
+                "misses": self._misses,
+                "hit_rate": round((self._hits + self._shared_hits) / lookups, 3) if lookups else 0.0,
+                "invalidations": self._invalidations,
+                "remote_invalidations": self._remote_invalidations,
+                "evictions": self._evictions,
+                "shared_errors": self._shared_errors
+            }
+
+
+# Instância global
+customer_cache = CustomerCache()
@@ -2,27 +2,73 @@ import psycopg2
 from psycopg2.extras import RealDictCursor
 from typing import Optional, Dict, Any
 import logging
-import re
 import os
+import re
+from db_pool import db_pool
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:  # pragma: no cover - dependência opcional
+    _encoding = None
 
 logger = logging.getLogger(__name__)
 
+# Tamanho máximo de cada texto no bloco de contexto (controle de tokens)
+CONTEXT_TEXT_LIMIT = 300
+# Teto de tokens do bloco de contexto de cada rodada (resumo + trocas recentes + dados)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Tokens do texto (tiktoken quando instalado; senão ~4 caracteres por token)"""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Corta o texto em até max_tokens tokens (mesma contagem de estimate_tokens)"""
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # Reserva um token para as reticências
+    if _encoding is not None:
+        cut = _encoding.decode(_encoding.encode(text)[:max_tokens - 1])
+    else:
+        cut = text[:max(max_tokens - 2, 0) * 4]
+    return cut.rstrip() + "..."
+
+CONTEXT_HEADER = "[CONTEXTO DO CLIENTE - já carregado, não chame tools de histórico/memória]\n"
+CONTEXT_FOOTER = "\n[FIM DO CONTEXTO]\n\n"
+
+# Busca ou cria o cliente em uma ida ao banco. O INSERT só roda quando o
+# telefone não existe (não consome a sequence a cada mensagem) e o ON CONFLICT
+# cobre webhooks simultâneos do mesmo número: quem perde a corrida recebe zero
+# linhas e repete a instrução, que então enxerga o cliente já gravado.
+GET_OR_CREATE_CUSTOMER_SQL = """
+    WITH existing AS (
+        SELECT id, name FROM customers WHERE phone = %(phone)s
+    ), inserted AS (
+        INSERT INTO customers (name, phone)
+        SELECT %(name)s, %(phone)s
+        WHERE NOT EXISTS (SELECT 1 FROM existing)
+        ON CONFLICT (phone) DO NOTHING
+        RETURNING id, name
+    )
+    SELECT id, name, FALSE AS created FROM existing
+    UNION ALL
+    SELECT id, name, TRUE AS created FROM inserted
+"""
+
 class CustomerManager:
     """Gerencia clientes e mapeia telefone → customer_id"""
 
-    def __init__(self):
-        self.conn_params = {
-            "host": os.getenv("DB_HOST", "postgres"),
-            "port": int(os.getenv("DB_PORT", "5432")),
-            "database": os.getenv("DB_NAME", "spdrop_db"),
-            "user": os.getenv("DB_USER", "spdrop_user"),
-            "password": os.getenv("DB_PASSWORD", "spdrop_password")
-        }
-
     def _get_connection(self):
-        """Criar conexão com o banco"""
+        """Obter conexão do pool compartilhado (close() devolve ao pool)"""
         try:
-            return psycopg2.connect(**self.conn_params)
+            return db_pool.getconn()
         except psycopg2.Error as e:
             logger.error(f"Erro ao conectar ao banco: {e}")
             return None
@@ -59,35 +105,27 @@ class CustomerManager:
         if not conn:
             return None
 
+        params = {"phone": phone_normalized, "name": name or f"Cliente {phone_normalized[-4:]}"}
+
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                # Buscar cliente existente
-                cur.execute("""
-                    SELECT id, name, phone
-                    FROM customers
-                    WHERE phone = %s
-                """, (phone_normalized,))
-
-                customer = cur.fetchone()
-
-                if customer:
+                # 2ª tentativa só quando outro webhook criou o cliente ao mesmo tempo
+                for _ in range(2):
+                    cur.execute(GET_OR_CREATE_CUSTOMER_SQL, params)
+                    customer = cur.fetchone()
+                    conn.commit()
+                    if customer:
+                        break
+
+                if not customer:
+                    logger.error(f"Cliente {phone_normalized} não encontrado nem criado")
+                    return None
+
+                if customer['created']:
+                    logger.info(f"Novo cliente criado: ID={customer['id']}, Nome={customer['name']}")
+                else:
                     logger.info(f"Cliente encontrado: ID={customer['id']}, Nome={customer['name']}")
-                    return customer['id']
-
-                # Cliente não existe, criar novo
-                customer_name = name or f"Cliente {phone_normalized[-4:]}"
-
-                cur.execute("""
-                    INSERT INTO customers (name, phone)
-                    VALUES (%s, %s)
-                    RETURNING id, name
-                """, (customer_name, phone_normalized))
-
-                conn.commit()
-                new_customer = cur.fetchone()
-
-                logger.info(f"Novo cliente criado: ID={new_customer['id']}, Nome={new_customer['name']}")
-                return new_customer['id']
+                return customer['id']
 
         except psycopg2.Error as e:
             logger.error(f"Erro ao buscar/criar cliente: {e}")
@@ -137,20 +175,120 @@ class CustomerManager:
         finally:
             conn.close()
 
-    def build_context_message(self, customer_id: int, user_message: str) -> str:
+    def build_context_message(self, customer_id: int, user_message: str,
+                              context: Optional[Dict[str, Any]] = None) -> str:
         """
         Constrói mensagem com contexto interno para o agente
 
         Args:
             customer_id: ID do cliente
             user_message: Mensagem original do usuário
+            context: Contexto já buscado (customer_repository.get_turn_context).
+                     Quando presente, é renderizado em um bloco compacto e o
+                     agente não precisa chamar as tools de histórico/memória.
 
         Returns:
             Mensagem com contexto
         """
         context_prefix = f"[CONTEXTO INTERNO: customer_id={customer_id}]\n"
+        if context is not None:
+            context_prefix += self._render_context(context)
         return context_prefix + user_message
 
+    def _render_context(self, context: Dict[str, Any]) -> str:
+        """
+        Bloco compacto com memórias, preferências, teste e histórico recente
+
+        O bloco inteiro (cabeçalho incluso) cabe em CONTEXT_TOKEN_BUDGET:
+        memórias, notas e preferências têm uma fatia máxima do orçamento, o
+        resumo usa até metade do que sobrar e as trocas recentes o restante.
+        Tudo é cortado por tokens com o mesmo contador (estimate_tokens).
+        """
+        # Cada linha custa seus tokens + 1 da quebra de linha
+        budget = CONTEXT_TOKEN_BUDGET - estimate_tokens(CONTEXT_HEADER + CONTEXT_FOOTER)
+        share = max(budget, 0)
+        lines = []
+
+        def add(line: str, limit: int = None) -> bool:
+            nonlocal budget
+            limit = budget - 1 if limit is None else min(limit, budget - 1)
+            line = truncate_tokens(line, limit)
+            if not line:
+                return False
+            lines.append(line)
+            budget -= estimate_tokens(line) + 1
+            return True
+
+        name = context.get("name")
+        if name and not name.startswith("Cliente "):
+            add(f"Nome: {name}", 30)
+
+        memories = context.get("memories") or {}
+        if memories:
+            # Mais recentes primeiro até a fatia das memórias acabar
+            def updated_at(item):
+                memory = item[1]
+                return str(memory.get("updated_at") or "") if isinstance(memory, dict) else ""
+
+            limit = min(share // 4, budget - 1) - estimate_tokens("Memórias: ")
+            items = []
+            for key, memory in sorted(memories.items(), key=updated_at, reverse=True):
+                value = memory.get("value") if isinstance(memory, dict) else memory
+                item = truncate_tokens(f"{key}={value}", limit)
+                cost = estimate_tokens(item) + 1
+                if not item or cost > limit:
+                    break
+                items.append(item)
+                limit -= cost
+            if items:
+                add("Memórias: " + "; ".join(items))
+        if context.get("notes"):
+            add(f"Notas: {context['notes']}", share // 8)
+
+        preferences = context.get("preferences")
+        if preferences:
+            items = [f"{key}={value}" for key, value in preferences.items() if value not in (None, "")]
+            if items:
+                add("Preferências: " + "; ".join(items), share // 8)
+
+        trial = context.get("trial")
+        if trial:
+            trial_info = f"Teste 7 dias: {trial.get('status')}"
+            if trial.get("trial_end_date"):
+                trial_info += f" (até {str(trial['trial_end_date'])[:10]})"
+            if trial.get("converted_to_plan"):
+                trial_info += f", convertido para {trial['converted_to_plan']}"
+            add(trial_info, 40)
+
+        # Resumo e trocas recentes ocupam o que sobrar do orçamento
+        history_title = "Histórico recente (mais antigo primeiro):"
+        budget -= estimate_tokens(history_title) + 1
+        summary = context.get("summary")
+        if summary and budget > 0:
+            # Resumo usa no máximo metade: não tira o lugar das trocas recentes
+            add(f"Resumo da conversa anterior: {summary}", budget // 2)
+
+        # Trocas mais recentes primeiro até o orçamento acabar
+        turns = []
+        for turn in reversed(context.get("history") or []):
+            turn_lines = (
+                f"- Cliente: {turn['user_message'][:CONTEXT_TEXT_LIMIT]}\n"
+                f"  Gabi: {turn['agent_response'][:CONTEXT_TEXT_LIMIT]}"
+            )
+            cost = estimate_tokens(turn_lines) + 1
+            if cost > budget:
+                break
+            turns.append(turn_lines)
+            budget -= cost
+
+        if turns:
+            lines.append(history_title)
+            lines.extend(reversed(turns))
+        elif not summary:
+            lines.append("Histórico: primeira conversa (cliente novo)")
+
+        return CONTEXT_HEADER + "\n".join(lines) + CONTEXT_FOOTER
+
     def get_or_create_session(self, session_id: str, customer_id: int) -> bool:
         """
         Busca ou cria uma sessão para o cliente
@@ -168,12 +306,6 @@ class CustomerManager:
 
         try:
             with conn.cursor() as cur:
-                # Verificar se sessão já existe
-                cur.execute("SELECT session_id FROM sessions WHERE session_id = %s", (session_id,))
-                if cur.fetchone():
-                    return True
-
-                # Criar nova sessão
                 cur.execute("""
                     INSERT INTO sessions (session_id, customer_id, status)
                     VALUES (%s, %s, %s)
@@ -181,7 +313,8 @@ class CustomerManager:
                 """, (session_id, customer_id, 'active'))
 
                 conn.commit()
-                logger.info(f"Nova sessão criada: {session_id}")
+                if cur.rowcount:
+                    logger.info(f"Nova sessão criada: {session_id}")
                 return True
 
         except psycopg2.Error as e:
@@ -209,11 +342,14 @@ class CustomerManager:
             return False
 
         try:
-            # Garantir que a sessão existe
-            self.get_or_create_session(session_id, customer_id)
-
             with conn.cursor() as cur:
-                # Inserir na tabela conversation_history
+                # Sessão e troca na mesma transação e na mesma conexão
+                cur.execute("""
+                    INSERT INTO sessions (session_id, customer_id, status)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (session_id) DO NOTHING
+                """, (session_id, customer_id, 'active'))
+
                 cur.execute("""
                     INSERT INTO conversation_history
                     (session_id, customer_id, user_message, agent_response, message_type)
@@ -0,0 +1,449 @@
+"""
+Camada de dados assíncrona para o caminho quente do webhook
+
+Versão asyncio (asyncpg) das operações de CustomerManager usadas a cada
+mensagem: clientes, sessões, conversation_history e o contexto do cliente
+(get_turn_context). Tem pool próprio, então consultas lentas no Postgres não
+travam o event loop do FastAPI.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional, Dict, Any, List
+
+import asyncpg
+
+from db_pool import DB_CONFIG
+from customer_manager import customer_manager
+from customer_cache import customer_cache, MISSING, INVALIDATION_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+# Busca ou cria o cliente em uma ida ao banco - mesma instrução do
+# customer_manager (versão psycopg2), com os placeholders posicionais do asyncpg
+GET_OR_CREATE_CUSTOMER_SQL = """
+    WITH existing AS (
+        SELECT id, name FROM customers WHERE phone = $1
+    ), inserted AS (
+        INSERT INTO customers (name, phone)
+        SELECT $2, $1
+        WHERE NOT EXISTS (SELECT 1 FROM existing)
+        ON CONFLICT (phone) DO NOTHING
+        RETURNING id, name
+    )
+    SELECT id, name, FALSE AS created FROM existing
+    UNION ALL
+    SELECT id, name, TRUE AS created FROM inserted
+"""
+
+
+class AsyncCustomerRepository:
+    """Repositório asyncio de clientes, sessões e histórico de conversa"""
+
+    def __init__(self, conn_params: Dict[str, Any] = None):
+        self.conn_params = conn_params or DB_CONFIG
+        self.min_size = int(os.getenv("ASYNC_DB_POOL_MIN", "1"))
+        self.max_size = int(os.getenv("ASYNC_DB_POOL_MAX", "10"))
+        self.timeout = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+        self.history_limit = int(os.getenv("CONTEXT_HISTORY_LIMIT", "6"))
+
+        self._pool: Optional[asyncpg.Pool] = None
+        self._pool_lock = asyncio.Lock()
+        self._listener_task: Optional[asyncio.Task] = None
+
+        # Métricas
+        self._queries = 0
+        self._errors = 0
+        self._query_time_total = 0.0
+
+    async def get_pool(self) -> asyncpg.Pool:
+        """Cria o pool asyncpg na primeira utilização"""
+        if self._pool is None:
+            async with self._pool_lock:
+                if self._pool is None:
+                    self._pool = await asyncpg.create_pool(
+                        host=self.conn_params["host"],
+                        port=self.conn_params["port"],
+                        database=self.conn_params["database"],
+                        user=self.conn_params["user"],
+                        password=self.conn_params["password"],
+                        min_size=self.min_size,
+                        max_size=self.max_size,
+                        command_timeout=self.timeout
+                    )
+                    logger.info(f"🔌 Pool asyncpg criado ({self.min_size}-{self.max_size} conexões)")
+        return self._pool
+
+    def _record(self, started: float, failed: bool = False):
+        """Atualiza métricas de consulta"""
+        self._queries += 1
+        self._query_time_total += time.monotonic() - started
+        if failed:
+            self._errors += 1
+
+    async def get_or_create_customer(self, phone: str, name: Optional[str] = None) -> Optional[int]:
+        """
+        Busca ou cria cliente pelo telefone
+
+        Args:
+            phone: Número de telefone
+            name: Nome do cliente (opcional)
+
+        Returns:
+            customer_id ou None
+        """
+        phone_normalized = customer_manager.normalize_phone(phone)
+
+        # telefone -> customer_id nunca muda: cliente ativo não consulta o banco
+        cached_id = customer_cache.get("customer_id", phone_normalized)
+        if cached_id is not MISSING:
+            return cached_id
+
+        started = time.monotonic()
+        customer_name = name or f"Cliente {phone_normalized[-4:]}"
+
+        try:
+            pool = await self.get_pool()
+            async with pool.acquire(timeout=self.timeout) as conn:
+                # Uma ida ao banco (GET_OR_CREATE_CUSTOMER_SQL acima);
+                # 2ª tentativa só quando outro webhook criou o cliente ao mesmo tempo
+                for _ in range(2):
+                    customer = await conn.fetchrow(GET_OR_CREATE_CUSTOMER_SQL, phone_normalized, customer_name)
+                    if customer:
+                        break
+
+            self._record(started)
+            if not customer:
+                logger.error(f"Cliente {phone_normalized} não encontrado nem criado")
+                return None
+
+            if customer['created']:
+                logger.info(f"Novo cliente criado: ID={customer['id']}, Nome={customer['name']}")
+            else:
+                logger.info(f"Cliente encontrado: ID={customer['id']}, Nome={customer['name']}")
+            customer_cache.set("customer_id", phone_normalized, customer['id'], customer['id'])
+            return customer['id']
+
+        except (asyncpg.PostgresError, OSError, asyncio.TimeoutError) as e:
+            logger.error(f"Erro ao buscar/criar cliente: {e}")
+            self._record(started, failed=True)
+            return None
+
+    async def get_or_create_session(self, session_id: str, customer_id: int) -> bool:
+        """
+        Busca ou cria uma sessão para o cliente
+
+        Args:
+            session_id: ID da sessão
+            customer_id: ID do cliente
+
+        Returns:
+            True se sessão existe ou foi criada, False caso contrário
+        """
+        started = time.monotonic()
+
+        try:
+            pool = await self.get_pool()
+            async with pool.acquire(timeout=self.timeout) as conn:
+                await conn.execute("""
+                    INSERT INTO sessions (session_id, customer_id, status)
+                    VALUES ($1, $2, $3)
+                    ON CONFLICT (session_id) DO NOTHING
+                """, session_id, customer_id, 'active')
+
+                self._record(started)
+                return True
+
+        except (asyncpg.PostgresError, OSError, asyncio.TimeoutError) as e:
+            logger.error(f"Erro ao criar sessão: {e}")
+            self._record(started, failed=True)
+            return False
+
+    async def save_conversation(self, session_id: str, customer_id: int, user_message: str, agent_response: str) -> bool:
+        """
+        Salva a conversa no histórico do PostgreSQL
+
+        Garante a sessão e insere o turno na mesma transação, usando uma
+        única conexão do pool.
+
+        Args:
+            session_id: ID da sessão (baseado no número WhatsApp)
+            customer_id: ID do cliente
+            user_message: Mensagem do usuário
+            agent_response: Resposta do agente
+
+        Returns:
+            True se salvou com sucesso, False caso contrário
+        """
+        started = time.monotonic()
+
+        try:
+            pool = await self.get_pool()
+            async with pool.acquire(timeout=self.timeout) as conn:
+                async with conn.transaction():
+                    await conn.execute("""
+                        INSERT INTO sessions (session_id, customer_id, status)
+                        VALUES ($1, $2, $3)
+                        ON CONFLICT (session_id) DO NOTHING
+                    """, session_id, customer_id, 'active')
+
+                    await conn.execute("""
+                        INSERT INTO conversation_history
+                        (session_id, customer_id, user_message, agent_response, message_type)
+                        VALUES ($1, $2, $3, $4, $5)
+                    """, session_id, customer_id, user_message, agent_response, 'chat')
+
+                logger.info(f"Conversa salva no histórico para session_id={session_id}")
+                self._record(started)
+
+            self.remember_turn(customer_id, user_message, agent_response)
+            return True
+
+        except (asyncpg.PostgresError, OSError, asyncio.TimeoutError) as e:
+            logger.error(f"Erro ao salvar conversa: {e}")
+            self._record(started, failed=True)
+            return False
+
+    def remember_turn(self, customer_id: int, user_message: str, agent_response: str,
+                      timestamp: Optional[datetime] = None):
+        """
+        Write-through: a troca nova entra no contexto em cache do cliente
+
+        Args:
+            customer_id: ID do cliente
+            user_message: Mensagem do usuário
+            agent_response: Resposta do agente
+            timestamp: Momento da troca (padrão: agora)
+        """
+        turn = {
+            "user_message": user_message,
+            "agent_response": agent_response,
+            "timestamp": (timestamp or datetime.now()).isoformat()
+        }
+        customer_cache.update(
+            "turn_context", customer_id,
+            lambda context: {
+                **context,
+                "history": (context["history"] + [turn])[-self.history_limit:],
+                "unsummarized": context.get("unsummarized", 0) + 1
+            },
+            customer_id
+        )
+
+    async def get_recent_history(self, customer_id: int, limit: int = 3) -> Optional[List[Dict[str, Any]]]:
+        """
+        Últimas trocas de mensagens do cliente (mais antigas primeiro)
+
+        Args:
+            customer_id: ID do cliente
+            limit: Quantidade máxima de trocas
+
+        Returns:
+            Lista de {user_message, agent_response, timestamp} ou None em caso de erro
+        """
+        started = time.monotonic()
+
+        try:
+            pool = await self.get_pool()
+            async with pool.acquire(timeout=self.timeout) as conn:
+                rows = await conn.fetch("""
+                    SELECT user_message, agent_response, timestamp
+                    FROM conversation_history
+                    WHERE customer_id = $1
+                    ORDER BY timestamp DESC
+                    LIMIT $2
+                """, customer_id, limit)
+
+            self._record(started)
+            return [dict(row) for row in reversed(rows)]
+
+        except (asyncpg.PostgresError, OSError, asyncio.TimeoutError) as e:
+            logger.error(f"Erro ao buscar histórico recente: {e}")
+            self._record(started, failed=True)
+            return None
+
+    async def get_turn_context(self, customer_id: int, history_limit: int = None) -> Optional[Dict[str, Any]]:
+        """
+        Busca todo o contexto do cliente para a rodada em uma única consulta
+
+        Args:
+            customer_id: ID do cliente
+            history_limit: Quantidade de trocas recentes (padrão CONTEXT_HISTORY_LIMIT)
+
+        Returns:
+            Dict com name, memories, notes, preferences, trial, history
+            (mais antigas primeiro), summary e unsummarized, ou None em caso de erro
+        """
+        if history_limit is None:
+            history_limit = self.history_limit
+
+        # Só o formato padrão fica em cache (é o que save_conversation atualiza)
+        cacheable = history_limit == self.history_limit
+        if cacheable:
+            cached = customer_cache.get("turn_context", customer_id)
+            if cached is not MISSING:
+                return cached
+
+        started = time.monotonic()
+
+        try:
+            pool = await self.get_pool()
+            async with pool.acquire(timeout=self.timeout) as conn:
+                row = await conn.fetchrow("""
+                    SELECT
+                        c.name,
+                        (SELECT cm.memories FROM customer_memories cm
+                         WHERE cm.customer_id = c.id) AS memories,
+                        (SELECT cc.notes FROM customer_context cc
+                         WHERE cc.customer_id = c.id ORDER BY cc.id LIMIT 1) AS notes,
+                        (SELECT row_to_json(p) FROM (
+                            SELECT interested_services, preferred_time_slot, conversation_count
+                            FROM user_preferences
+                            WHERE customer_id = c.id ORDER BY id LIMIT 1
+                        ) p) AS preferences,
+                        (SELECT row_to_json(t) FROM (
+                            SELECT status, trial_start_date, trial_end_date, converted_to_plan,
+                                   trial_end_date < CURRENT_TIMESTAMP AS expired
+                            FROM trial_users
+                            WHERE customer_id = c.id ORDER BY created_at DESC LIMIT 1
+                        ) t) AS trial,
+                        (SELECT json_agg(h ORDER BY h.timestamp) FROM (
+                            SELECT user_message, agent_response,
+                                   to_char(timestamp, 'YYYY-MM-DD"T"HH24:MI:SS.US') AS timestamp
+                            FROM conversation_history
+                            WHERE customer_id = c.id
+                            ORDER BY timestamp DESC
+                            LIMIT $2
+                        ) h) AS history,
+                        cs.summary,
+                        (SELECT count(*) FROM conversation_history
+                         WHERE customer_id = c.id
+                           AND timestamp > COALESCE(cs.summarized_until, '-infinity'::timestamp)
+                        ) AS unsummarized
+                    FROM customers c
+                    LEFT JOIN customer_summaries cs ON cs.customer_id = c.id
+                    WHERE c.id = $1
+                """, customer_id, history_limit)
+
+            self._record(started)
+
+        except (asyncpg.PostgresError, OSError, asyncio.TimeoutError) as e:
+            logger.error(f"Erro ao buscar contexto do cliente: {e}")
+            self._record(started, failed=True)
+            return None
+
+        if row is None:
+            return None
+
+        history = json.loads(row["history"]) if row["history"] else []
+        unsummarized = row["unsummarized"]
+
+        # Trocas ainda na fila de gravação (history_writer) não estão no banco
+        from history_writer import history_writer
+        recorded = {turn["timestamp"] for turn in history}
+        queued = [turn for turn in history_writer.pending_turns(customer_id) if turn["timestamp"] not in recorded]
+        if queued:
+            history = (history + queued)[-history_limit:]
+            unsummarized += len(queued)
+
+        context = {
+            "name": row["name"],
+            "memories": json.loads(row["memories"]) if row["memories"] else {},
+            "notes": row["notes"],
+            "preferences": json.loads(row["preferences"]) if row["preferences"] else None,
+            "trial": json.loads(row["trial"]) if row["trial"] else None,
+            "history": history,
+            # Resumo das trocas antigas (conversation_summarizer) e trocas ainda fora dele
+            "summary": row["summary"],
+            "unsummarized": unsummarized
+        }
+        if cacheable:
+            customer_cache.set("turn_context", customer_id, context, customer_id)
+        return context
+
+    def build_context_message(self, customer_id: int, user_message: str,
+                              context: Optional[Dict[str, Any]] = None) -> str:
+        """Constrói mensagem com contexto interno para o agente"""
+        return customer_manager.build_context_message(customer_id, user_message, context)
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas do pool asyncpg e das consultas"""
+        pool_stats = {}
+        if self._pool is not None:
+            pool_stats = {
+                "size": self._pool.get_size(),
+                "idle": self._pool.get_idle_size(),
+                "max": self.max_size
+            }
+
+        return {
+            "pool": pool_stats,
+            "queries": self._queries,
+            "errors": self._errors,
+            "query_avg_ms": round(self._query_time_total / self._queries * 1000, 2) if self._queries else 0.0
+        }
+
+    def start_cache_listener(self):
+        """Escuta as invalidações do cache feitas por outros processos (LISTEN/NOTIFY)"""
+        if customer_cache.enabled and self._listener_task is None:
+            self._listener_task = asyncio.create_task(self._listen_invalidations())
+
+    async def _listen_invalidations(self):
+        """Conexão dedicada ao canal de invalidação; reconecta se cair"""
+        connected_before = False
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(
+                    host=self.conn_params["host"],
+                    port=self.conn_params["port"],
+                    database=self.conn_params["database"],
+                    user=self.conn_params["user"],
+                    password=self.conn_params["password"],
+                    timeout=self.timeout
+                )
+                await conn.add_listener(
+                    INVALIDATION_CHANNEL,
+                    lambda _conn, _pid, _channel, payload: customer_cache.apply_invalidation(payload)
+                )
+                # Notificações enviadas enquanto a escuta estava fora se perderam
+                customer_cache.clear_local()
+                if connected_before:
+                    logger.info("🔔 Escuta de invalidação do cache reconectada (cache local descartado)")
+                connected_before = True
+
+                # Consulta periódica: detecta conexão morta (o NOTIFY não avisa)
+                while True:
+                    await asyncio.sleep(30)
+                    await conn.fetchval("SELECT 1", timeout=self.timeout)
+
+            except asyncio.CancelledError:
+                raise
+            except (asyncpg.PostgresError, OSError, asyncio.TimeoutError) as e:
+                logger.warning(f"⚠️ Escuta de invalidação do cache caiu: {e}")
+            finally:
+                if conn is not None:
+                    conn.terminate()
+            await asyncio.sleep(5)
+
+    async def close(self):
+        """Fecha o pool asyncpg (e a escuta de invalidação do cache)"""
+        if self._listener_task is not None:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+
+# Instância global
+customer_repository = AsyncCustomerRepository()
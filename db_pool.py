@@ -0,0 +1,330 @@
+"""
+Pool de conexões PostgreSQL compartilhado por todo o processo
+
+Toolkits, CustomerManager e a API administrativa pegam conexões daqui em vez
+de abrir um psycopg2.connect() novo a cada chamada.
+
+Uso:
+    from db_pool import db_pool
+
+    conn = db_pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+    finally:
+        conn.close()  # devolve ao pool
+
+    # ou: commit/rollback automático e devolução ao pool
+    with db_pool.getconn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("UPDATE ...")
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+logger = logging.getLogger(__name__)
+
+# Configurações do banco
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST", "postgres"),
+    "port": int(os.getenv("DB_PORT", "5432")),
+    "database": os.getenv("DB_NAME", "spdrop_db"),
+    "user": os.getenv("DB_USER", "spdrop_user"),
+    "password": os.getenv("DB_PASSWORD", "spdrop_password")
+}
+
+
+class PooledConnection:
+    """
+    Proxy de uma conexão do pool
+
+    Repassa tudo para a conexão psycopg2 real (leitura e escrita de atributos,
+    ex: conn.autocommit = True), mas close() devolve a conexão ao pool. Assim
+    o padrão `finally: conn.close()` dos toolkits continua funcionando sem
+    alterações.
+
+    Também funciona como context manager: `with db_pool.getconn() as conn:`
+    faz commit ao sair (rollback se houver exceção) e devolve a conexão ao
+    pool. Um proxy esquecido sem close() devolve a conexão quando é coletado.
+    """
+
+    def __init__(self, pool: "ConnectionPool", conn):
+        object.__setattr__(self, "_pool", pool)
+        object.__setattr__(self, "_conn", conn)
+
+    @property
+    def raw(self):
+        """Conexão psycopg2 real (para APIs que exigem o objeto original)"""
+        return self._conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise PoolError("conexão já devolvida ao pool")
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        if self._conn is None:
+            raise PoolError("conexão já devolvida ao pool")
+        setattr(self._conn, name, value)
+
+    def __enter__(self) -> "PooledConnection":
+        if self._conn is None:
+            raise PoolError("conexão já devolvida ao pool")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if self._conn is not None and not self._conn.closed:
+                if exc_type is None:
+                    self._conn.commit()
+                else:
+                    self._conn.rollback()
+        finally:
+            self.close()
+        return False
+
+    def close(self):
+        """Devolve a conexão ao pool (idempotente)"""
+        if self._conn is not None:
+            conn = self._conn
+            object.__setattr__(self, "_conn", None)
+            self._pool.putconn(conn)
+
+    def __del__(self):
+        # Proxy coletado sem close(): a conexão volta ao pool em vez de vazar
+        if self.__dict__.get("_conn") is None:
+            return
+        try:
+            with self._pool._cond:
+                self._pool._leaked += 1
+            logger.warning("⚠️ Conexão do pool coletada sem close() - devolvida ao pool")
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """
+    Pool de conexões thread-safe com limite de tamanho, health check e métricas
+
+    - Conexões são abertas sob demanda até DB_POOL_MAX
+    - Quando o pool está cheio, getconn() espera até DB_POOL_TIMEOUT segundos
+    - Conexões ociosas há mais de DB_POOL_HEALTH_CHECK_INTERVAL segundos
+      recebem um `SELECT 1` antes de serem reutilizadas
+    """
+
+    def __init__(self, minconn: int = None, maxconn: int = None, timeout: float = None,
+                 health_check_interval: float = None, conn_params: Dict[str, Any] = None):
+        self.minconn = minconn if minconn is not None else int(os.getenv("DB_POOL_MIN", "1"))
+        self.maxconn = maxconn if maxconn is not None else int(os.getenv("DB_POOL_MAX", "10"))
+        self.timeout = timeout if timeout is not None else float(os.getenv("DB_POOL_TIMEOUT", "10"))
+        self.health_check_interval = (
+            health_check_interval if health_check_interval is not None
+            else float(os.getenv("DB_POOL_HEALTH_CHECK_INTERVAL", "30"))
+        )
+        self.conn_params = conn_params or DB_CONFIG
+
+        # Conexões ociosas: (conexão, instante em que foi devolvida)
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        # Métricas
+        self._checkouts = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._leaked = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _connect(self):
+        """Abre uma conexão física nova"""
+        conn = psycopg2.connect(**self.conn_params)
+        logger.info(f"🔌 Nova conexão aberta no pool ({self._size}/{self.maxconn})")
+        return conn
+
+    def _is_healthy(self, conn, last_used: float) -> bool:
+        """Verifica se uma conexão ociosa ainda está utilizável"""
+        if conn.closed:
+            return False
+
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        """Fecha uma conexão sem devolvê-la ao pool"""
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self) -> PooledConnection:
+        """
+        Pega uma conexão do pool, aguardando se todas estiverem em uso
+
+        Returns:
+            PooledConnection (close() devolve ao pool)
+
+        Raises:
+            PoolError: se nenhuma conexão ficar livre dentro do timeout
+            psycopg2.Error: se não for possível abrir uma conexão nova
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout
+        conn = None
+        last_used = 0.0
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolError("pool de conexões fechado")
+
+                if self._idle:
+                    # LIFO: reaproveita a conexão mais recente (mais "quente")
+                    conn, last_used = self._idle.pop()
+                    break
+
+                if self._size < self.maxconn:
+                    # Reservar vaga e abrir conexão fora do lock
+                    self._size += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    logger.error(f"⏳ Timeout aguardando conexão do pool ({self.maxconn} em uso)")
+                    raise PoolError(f"Nenhuma conexão livre após {self.timeout}s")
+
+                self._cond.wait(remaining)
+
+        waited = time.monotonic() - start
+
+        try:
+            if conn is not None and not self._is_healthy(conn, last_used):
+                logger.warning("♻️ Conexão ociosa inválida descartada do pool")
+                self._discard(conn)
+                with self._cond:
+                    self._discarded += 1
+                conn = None
+
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            # Liberar a vaga reservada
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+
+        return PooledConnection(self, conn)
+
+    def putconn(self, conn):
+        """
+        Devolve uma conexão ao pool
+
+        Transações abertas são desfeitas; conexões quebradas são descartadas.
+        """
+        discard = bool(conn.closed)
+
+        if not discard:
+            try:
+                status = conn.info.transaction_status
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    discard = True
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        with self._cond:
+            if discard or self._closed:
+                self._discard(conn)
+                self._size -= 1
+                if discard:
+                    self._discarded += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager que pega e devolve uma conexão do pool
+
+        Uso:
+            with db_pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+        """
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def warmup(self):
+        """Abre DB_POOL_MIN conexões antecipadamente"""
+        conns = []
+        try:
+            for _ in range(self.minconn):
+                conns.append(self.getconn())
+        except psycopg2.Error as e:
+            logger.warning(f"Não foi possível pré-aquecer o pool: {e}")
+        finally:
+            for conn in conns:
+                conn.close()
+
+    def closeall(self):
+        """Fecha todas as conexões ociosas e impede novos checkouts"""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+                self._size -= 1
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas do pool (uso e tempo de espera por conexão)"""
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                "size": self._size,
+                "idle": idle,
+                "in_use": self._size - idle,
+                "max": self.maxconn,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+                "leaked": self._leaked,
+                "wait_avg_ms": round(self._wait_total / self._checkouts * 1000, 2) if self._checkouts else 0.0,
+                "wait_max_ms": round(self._wait_max * 1000, 2)
+            }
+
+
+# Instância global
+db_pool = ConnectionPool()
@@ -0,0 +1,358 @@
+"""
+Gravação em lote (write-behind) do histórico e do log de mensagens
+
+A rodada não espera mais o INSERT em conversation_history: as trocas, as
+linhas de message_logs (entrada/saída, usadas pelo dashboard) e os registros
+de entrega (outbound_deliveries) vão para uma fila em memória e são
+gravados em lote por uma Task em segundo plano:
+
+    - a cada HISTORY_FLUSH_INTERVAL segundos, ou antes ao juntar
+      HISTORY_BATCH_SIZE linhas
+    - um lote = uma transação: sessões (INSERT ... ON CONFLICT com unnest)
+      + um COPY por tabela
+
+Se o Postgres falhar (conexão, timeout), as linhas voltam para a fila e são
+regravadas na próxima tentativa. Se o lote for recusado por causa de uma
+linha (FK inexistente, texto maior que a coluna...), ele é regravado por
+tabela e depois linha a linha; as linhas que ainda falham vão para
+HISTORY_DEAD_LETTER_FILE (JSONL) e não travam as gravações seguintes. No desligamento, stop() grava o que falta; se o banco
+estiver fora, as linhas vão para HISTORY_SPILL_FILE (JSONL) e são
+reenfileiradas no próximo start().
+
+O contexto do cliente em cache (customer_cache) é atualizado na hora, então
+a próxima rodada já enxerga a troca mesmo antes do lote ser gravado; quando
+o contexto é recarregado do banco, pending_turns() completa o histórico com
+as trocas que ainda estão na fila.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+
+import asyncpg
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from customer_repository import customer_repository
+
+logger = logging.getLogger(__name__)
+
+HISTORY_COLUMNS = ("session_id", "customer_id", "user_message", "agent_response", "timestamp", "message_type")
+MESSAGE_LOG_COLUMNS = ("customer_id", "direction", "message", "from_number", "to_number", "timestamp")
+DELIVERY_COLUMNS = ("to_number", "message", "status", "attempts", "error", "queued_at", "sent_at")
+
+DATETIME_COLUMNS = ("timestamp", "queued_at", "sent_at")
+
+# Erros causados pelos dados de uma linha: repetir o mesmo lote nunca vai passar
+ROW_ERRORS = (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError)
+
+TABLE_COLUMNS = {
+    "conversation_history": HISTORY_COLUMNS,
+    "message_logs": MESSAGE_LOG_COLUMNS,
+    "outbound_deliveries": DELIVERY_COLUMNS,
+}
+
+
+class HistoryWriter:
+    """Fila write-behind para conversation_history e message_logs"""
+
+    def __init__(self):
+        self.batch_size = int(os.getenv("HISTORY_BATCH_SIZE", "200"))
+        self.flush_interval = float(os.getenv("HISTORY_FLUSH_INTERVAL", "1.0"))
+        self.max_pending = int(os.getenv("HISTORY_MAX_PENDING", "50000"))
+        self.spill_file = os.getenv(
+            "HISTORY_SPILL_FILE",
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "history_pending.jsonl")
+        )
+        self.dead_letter_file = os.getenv(
+            "HISTORY_DEAD_LETTER_FILE",
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "history_dead_letter.jsonl")
+        )
+
+        # (tabela, linha) na ordem de chegada
+        self._pending: Deque[Tuple[str, tuple]] = deque()
+        # Lote sendo gravado agora (fora de _pending até o fim da gravação)
+        self._inflight: List[Tuple[str, tuple]] = []
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        # Métricas
+        self._turns = 0
+        self._messages = 0
+        self._flushes = 0
+        self._rows_written = 0
+        self._failures = 0
+        self._dropped = 0
+        self._dead_lettered = 0
+        self._flush_time_total = 0.0
+
+    def _enqueue(self, table: str, row: tuple):
+        if len(self._pending) >= self.max_pending:
+            self._pending.popleft()
+            self._dropped += 1
+            logger.error("❌ Fila do histórico cheia - linha mais antiga descartada")
+
+        self._pending.append((table, row))
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def log_turn(self, session_id: str, customer_id: int, user_message: str,
+                 agent_response: str, message_type: str = "chat"):
+        """
+        Enfileira uma troca de mensagens para conversation_history
+
+        Args:
+            session_id: ID da sessão (baseado no número WhatsApp)
+            customer_id: ID do cliente
+            user_message: Mensagem do usuário
+            agent_response: Resposta enviada
+            message_type: Tipo da troca ('chat', ...)
+        """
+        now = datetime.now()
+        self._enqueue("conversation_history", (session_id, customer_id, user_message, agent_response, now, message_type))
+        self._turns += 1
+        customer_repository.remember_turn(customer_id, user_message, agent_response, now)
+
+    def log_message(self, customer_id: Optional[int], direction: str, message: str,
+                    from_number: str = None, to_number: str = None):
+        """
+        Enfileira uma linha de message_logs
+
+        Args:
+            customer_id: ID do cliente
+            direction: 'inbound' ou 'outbound'
+            message: Texto da mensagem
+            from_number: Remetente
+            to_number: Destinatário
+        """
+        self._enqueue("message_logs", (customer_id, direction, message, from_number, to_number, datetime.now()))
+        self._messages += 1
+
+    def log_delivery(self, to_number: str, message: str, status: str, attempts: int,
+                     error: Optional[str], queued_at: datetime, sent_at: Optional[datetime]):
+        """Enfileira o registro de entrega de uma mensagem enviada (outbound_dispatcher)"""
+        self._enqueue("outbound_deliveries", (to_number, message, status, attempts, error, queued_at, sent_at))
+
+    def pending_turns(self, customer_id: int) -> List[Dict[str, Any]]:
+        """
+        Trocas do cliente ainda não gravadas em conversation_history
+
+        Returns:
+            Trocas (mais antigas primeiro) no formato do histórico do contexto
+        """
+        turns: Dict[str, Dict[str, Any]] = {}
+        for table, row in list(self._inflight) + list(self._pending):
+            if table == "conversation_history" and row[1] == customer_id:
+                # Mesmo formato do histórico lido em get_turn_context (to_char ... .US)
+                timestamp = row[4].isoformat(timespec="microseconds")
+                turns[timestamp] = {"user_message": row[2], "agent_response": row[3], "timestamp": timestamp}
+        return [turns[timestamp] for timestamp in sorted(turns)]
+
+    async def flush(self) -> int:
+        """
+        Grava tudo o que está na fila
+
+        Returns:
+            Quantidade de linhas gravadas (as linhas voltam para a fila em caso
+            de erro de conexão; linhas recusadas pelo banco vão para o dead-letter)
+        """
+        async with self._flush_lock:
+            written = 0
+            while self._pending:
+                batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+                self._inflight = batch
+                try:
+                    await self._write(batch)
+                except ROW_ERRORS as e:
+                    self._failures += 1
+                    logger.warning(f"⚠️ Lote do histórico recusado ({len(batch)} linhas): {e} - isolando a linha inválida")
+                    written += await self._write_isolated(batch)
+                    continue
+                except BaseException as e:
+                    # Devolve o lote para o início da fila, na mesma ordem
+                    # (também no cancelamento: stop() ainda vai gravá-lo)
+                    self._pending.extendleft(reversed(batch))
+                    if not isinstance(e, asyncio.CancelledError):
+                        self._failures += 1
+                        logger.error(f"Erro ao gravar lote do histórico ({len(batch)} linhas): {e}")
+                    raise
+                finally:
+                    self._inflight = []
+                written += len(batch)
+            return written
+
+    async def _write_isolated(self, batch: List[Tuple[str, tuple]]) -> int:
+        """
+        Regrava um lote recusado por tabela e, na tabela que falhar, linha a linha
+
+        Linhas que o banco continua recusando vão para o dead-letter. Em erro
+        de conexão o que ainda não foi gravado volta para o início da fila.
+
+        Returns:
+            Quantidade de linhas gravadas
+        """
+        groups: Dict[str, List[Tuple[str, tuple]]] = {}
+        for item in batch:
+            groups.setdefault(item[0], []).append(item)
+        remaining = list(groups.values())
+
+        written = 0
+        try:
+            while remaining:
+                items = remaining[0]
+                try:
+                    await self._write(items)
+                    written += len(items)
+                    items.clear()
+                except ROW_ERRORS:
+                    while items:
+                        try:
+                            await self._write(items[:1])
+                            written += 1
+                        except ROW_ERRORS as e:
+                            self._dead_letter(items[0], e)
+                        items.pop(0)
+                remaining.pop(0)
+        except BaseException:
+            leftover = [item for items in remaining for item in items]
+            self._pending.extendleft(reversed(leftover))
+            raise
+        return written
+
+    def _dead_letter(self, item: Tuple[str, tuple], error: Exception):
+        """Separa uma linha que o banco recusa (registra no log e em HISTORY_DEAD_LETTER_FILE)"""
+        table, row = item
+        self._dead_lettered += 1
+        logger.error(f"❌ Linha de {table} descartada do histórico: {error} - {str(row)[:300]}")
+        try:
+            os.makedirs(os.path.dirname(self.dead_letter_file), exist_ok=True)
+            with open(self.dead_letter_file, "a", encoding="utf-8") as file:
+                file.write(json.dumps(
+                    {"table": table, "row": row, "error": str(error), "at": datetime.now()},
+                    ensure_ascii=False, default=str
+                ) + "\n")
+        except OSError as e:
+            logger.error(f"Erro ao salvar linha descartada em {self.dead_letter_file}: {e}")
+
+    async def _write(self, batch: List[Tuple[str, tuple]]):
+        """Grava um lote em uma única transação"""
+        rows: Dict[str, List[tuple]] = {}
+        for table, row in batch:
+            rows.setdefault(table, []).append(row)
+        history = rows.get("conversation_history", [])
+
+        started = time.monotonic()
+        pool = await customer_repository.get_pool()
+        async with pool.acquire(timeout=customer_repository.timeout) as conn:
+            async with conn.transaction():
+                if history:
+                    sessions = {row[0]: row[1] for row in history}
+                    await conn.execute("""
+                        INSERT INTO sessions (session_id, customer_id, status)
+                        SELECT session_id, customer_id, 'active'
+                        FROM unnest($1::varchar[], $2::int[]) AS s(session_id, customer_id)
+                        ON CONFLICT (session_id) DO NOTHING
+                    """, list(sessions), list(sessions.values()))
+                for table, records in rows.items():
+                    await conn.copy_records_to_table(table, records=records, columns=TABLE_COLUMNS[table])
+
+        elapsed = time.monotonic() - started
+        self._flushes += 1
+        self._rows_written += len(batch)
+        self._flush_time_total += elapsed
+        logger.info(
+            f"💾 Histórico gravado em lote: {len(history)} trocas, "
+            f"{len(rows.get('message_logs', []))} mensagens, "
+            f"{len(rows.get('outbound_deliveries', []))} entregas em {elapsed * 1000:.0f}ms"
+        )
+
+    async def _flush_loop(self):
+        """Grava a fila a cada intervalo ou quando o lote enche"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Já registrado em flush(); tenta de novo no próximo intervalo
+                await asyncio.sleep(self.flush_interval)
+
+    def _load_spill(self):
+        """Reenfileira linhas salvas em disco por um desligamento sem banco"""
+        if not os.path.exists(self.spill_file):
+            return
+
+        loaded = 0
+        with open(self.spill_file, encoding="utf-8") as file:
+            for line in file:
+                item = json.loads(line)
+                row = list(item["row"])
+                for index, column in enumerate(TABLE_COLUMNS[item["table"]]):
+                    if column in DATETIME_COLUMNS and row[index] is not None:
+                        row[index] = datetime.fromisoformat(row[index])
+                self._pending.append((item["table"], tuple(row)))
+                loaded += 1
+        os.remove(self.spill_file)
+        logger.info(f"🛟 {loaded} linhas de histórico recuperadas de {self.spill_file}")
+
+    def _spill(self):
+        """Salva em disco as linhas que não puderam ser gravadas no banco"""
+        os.makedirs(os.path.dirname(self.spill_file), exist_ok=True)
+        with open(self.spill_file, "a", encoding="utf-8") as file:
+            for table, row in self._pending:
+                file.write(json.dumps({"table": table, "row": row}, ensure_ascii=False, default=str) + "\n")
+        logger.warning(f"⚠️ {len(self._pending)} linhas de histórico salvas em {self.spill_file} (banco indisponível)")
+        self._pending.clear()
+
+    def start(self):
+        """Inicia a gravação em segundo plano (recupera linhas salvas em disco)"""
+        if self._task is None:
+            try:
+                self._load_spill()
+            except (OSError, ValueError) as e:
+                logger.error(f"Erro ao recuperar histórico salvo em disco: {e}")
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Para o loop e grava tudo o que falta (ou salva em disco)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        try:
+            await self.flush()
+        except Exception:
+            self._spill()
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas da gravação em lote"""
+        return {
+            "pending": len(self._pending),
+            "turns": self._turns,
+            "messages": self._messages,
+            "flushes": self._flushes,
+            "rows_written": self._rows_written,
+            "rows_per_flush": round(self._rows_written / self._flushes, 1) if self._flushes else 0.0,
+            "flush_avg_ms": round(self._flush_time_total / self._flushes * 1000, 1) if self._flushes else 0.0,
+            "failures": self._failures,
+            "dropped": self._dropped,
+            "dead_lettered": self._dead_lettered
+        }
+
+
+# Instância global
+history_writer = HistoryWriter()
@@ -1,13 +1,25 @@
 import os
+import time
 import base64
+import asyncio
 import logging
+from typing import Any, Dict
 from openai import OpenAI
 from dotenv import load_dotenv
 
+from media_cache import media_cache
+from image_preprocessor import prepare_image
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+IMAGE_MODEL = "gpt-4o-mini"
+# Incrementar ao mudar os prompts abaixo (ou o preparo da imagem): invalida as análises em cache
+IMAGE_PROMPT_VERSION = 2
+FAILED_ANALYSIS = "[Não foi possível analisar a imagem]"
+STICKER_DESCRIPTION = "Figurinha (sticker) do WhatsApp, sem conteúdo a analisar."
+
 class ImageAnalysisService:
     """Serviço de análise de imagem usando OpenAI Vision (GPT-4 Vision)"""
 
@@ -18,9 +30,27 @@ class ImageAnalysisService:
             raise ValueError("OPENAI_API_KEY não encontrada no .env")
 
         self.client = OpenAI(api_key=api_key)
+        # Limite de chamadas simultâneas à OpenAI (análises em paralelo)
+        self.concurrency = int(os.getenv("IMAGE_ANALYSIS_CONCURRENCY", "4"))
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.max_tokens = int(os.getenv("IMAGE_MAX_TOKENS", "500"))
+        # Análises em andamento por chave do cache (imagem repetida na mesma rajada)
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        # Métricas
+        self._analyses = 0
+        self._stickers = 0
+        self._duplicates = 0
+        self._bytes_in = 0
+        self._bytes_out = 0
+        self._prompt_tokens = 0
+        self._estimated_tokens_saved = 0
+        self._details: Dict[str, int] = {}
+        self._vision_time_total = 0.0
         logger.info("✅ ImageAnalysisService inicializado com OpenAI Vision")
 
-    def analyze_image(self, image_base64: str, mimetype: str = "image/jpeg", caption: str = None) -> str:
+    def analyze_image(self, image_base64: str, mimetype: str = "image/jpeg", caption: str = None,
+                      detail: str = "auto") -> str:
         """
         Analisa imagem base64 e retorna descrição detalhada em texto usando GPT-4 Vision
 
@@ -28,6 +58,7 @@ class ImageAnalysisService:
             image_base64: Imagem em formato base64
             mimetype: Tipo do arquivo (image/jpeg, image/png, etc.)
             caption: Legenda enviada com a imagem (opcional)
+            detail: Nível de detalhe da visão (auto, low ou high)
 
         Returns:
             Descrição textual da imagem
@@ -65,7 +96,7 @@ Responda em português de forma clara e direta."""
 
             # Chamar GPT-4 Vision
             response = self.client.chat.completions.create(
-                model="gpt-4o-mini",  # Usando gpt-4o-mini que suporta visão e é mais barato
+                model=IMAGE_MODEL,  # Usando gpt-4o-mini que suporta visão e é mais barato
                 messages=[
                     {
                         "role": "user",
@@ -78,25 +109,130 @@ Responda em português de forma clara e direta."""
                                 "type": "image_url",
                                 "image_url": {
                                     "url": data_uri,
-                                    "detail": "auto"  # auto, low, ou high
+                                    "detail": detail  # auto, low, ou high
                                 }
                             }
                         ]
                     }
                 ],
-                max_tokens=500,
+                max_tokens=self.max_tokens,
                 temperature=0.7
             )
 
             # Extrair descrição
             description = response.choices[0].message.content.strip()
+            if getattr(response, "usage", None) is not None:
+                self._prompt_tokens += response.usage.prompt_tokens
 
-            logger.info(f"✅ Análise concluída: '{description[:100]}...'")
+            logger.info(f"✅ Análise concluída ({detail}): '{description[:100]}...'")
             return description
 
         except Exception as e:
             logger.error(f"❌ Erro ao analisar imagem: {str(e)}", exc_info=True)
-            return "[Não foi possível analisar a imagem]"
+            return FAILED_ANALYSIS
+
+    def skip_sticker(self) -> str:
+        """Figurinha (type 'sticker' do WhatsApp): sem análise, só registra"""
+        self._stickers += 1
+        logger.info("🙂 Figurinha recebida - análise de imagem dispensada")
+        return STICKER_DESCRIPTION
+
+    async def analyze_image_async(self, image_base64: str = None, mimetype: str = "image/jpeg",
+                                  caption: str = None, image_bytes: bytes = None) -> str:
+        """
+        Analisa a imagem sem bloquear o event loop, com cache por conteúdo
+
+        A mesma imagem (SHA-256 dos bytes) com a mesma legenda e versão do
+        prompt é respondida pelo media_cache, sem chamar a OpenAI.
+
+        Args:
+            image_base64: Imagem em formato base64
+            mimetype: Tipo do arquivo (image/jpeg, image/png, etc.)
+            caption: Legenda enviada com a imagem (opcional)
+            image_bytes: Imagem já decodificada (dispensa image_base64)
+
+        Returns:
+            Descrição textual da imagem
+        """
+        try:
+            if image_bytes is None:
+                image_bytes = base64.b64decode(image_base64)
+        except (ValueError, TypeError) as e:
+            logger.error(f"❌ Imagem inválida ({mimetype}): {e}")
+            return FAILED_ANALYSIS
+
+        if caption == '[Imagem recebida]':
+            caption = None
+        cache_key = media_cache.key("image", image_bytes, IMAGE_MODEL, IMAGE_PROMPT_VERSION, caption or "")
+        cached = await media_cache.get("image", cache_key)
+        if cached is not None:
+            logger.info(f"⚡ Análise de imagem em cache ({len(image_bytes)} bytes)")
+            return cached
+
+        # Mesma imagem duas vezes na rajada: a segunda aguarda a primeira
+        pending = self._inflight.get(cache_key)
+        if pending is not None:
+            self._duplicates += 1
+            logger.info("⚡ Imagem repetida na rajada - aproveitando a análise em andamento")
+            return await asyncio.shield(pending)
+
+        task = asyncio.ensure_future(self._analyze_uncached(cache_key, image_bytes, mimetype, caption))
+        self._inflight[cache_key] = task
+        try:
+            return await task
+        finally:
+            self._inflight.pop(cache_key, None)
+
+    async def _analyze_uncached(self, cache_key: str, image_bytes: bytes, mimetype: str, caption: str) -> str:
+        """Prepara a imagem (redução, detail, figurinha) e chama a OpenAI"""
+        prepared = await asyncio.to_thread(prepare_image, image_bytes, mimetype, caption)
+        if prepared.skip_reason == "sticker":
+            self._stickers += 1
+            logger.info("🙂 Figurinha recebida - análise de imagem dispensada")
+            return STICKER_DESCRIPTION
+
+        # Data URI da chamada à OpenAI
+        image_base64 = base64.b64encode(prepared.data).decode("ascii")
+
+        async with self._semaphore:
+            started = time.monotonic()
+            description = await asyncio.to_thread(
+                self.analyze_image, image_base64, prepared.mimetype, caption, prepared.detail
+            )
+            elapsed = time.monotonic() - started
+
+        self._analyses += 1
+        self._vision_time_total += elapsed
+        self._bytes_in += prepared.original_size
+        self._bytes_out += len(prepared.data)
+        self._details[prepared.detail] = self._details.get(prepared.detail, 0) + 1
+        self._estimated_tokens_saved += max(0, prepared.original_tokens - prepared.estimated_tokens)
+
+        logger.info(
+            f"🖼️ Imagem {prepared.original_size // 1024}KB -> {len(prepared.data) // 1024}KB "
+            f"({prepared.width}x{prepared.height}, detail={prepared.detail}, "
+            f"~{prepared.estimated_tokens} tokens) analisada em {elapsed * 1000:.0f}ms"
+        )
+
+        if description != FAILED_ANALYSIS:
+            await media_cache.set("image", cache_key, description, len(image_bytes))
+        return description
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas das análises de imagem (bytes enviados, detail, tokens, latência)"""
+        analyses = self._analyses
+        return {
+            "analyses": analyses,
+            "stickers_skipped": self._stickers,
+            "duplicates": self._duplicates,
+            "by_detail": dict(self._details),
+            "bytes_in": self._bytes_in,
+            "bytes_sent": self._bytes_out,
+            "prompt_tokens": self._prompt_tokens,
+            "prompt_tokens_avg": round(self._prompt_tokens / analyses, 1) if analyses else 0.0,
+            "estimated_tokens_saved": self._estimated_tokens_saved,
+            "vision_avg_ms": round(self._vision_time_total / analyses * 1000, 1) if analyses else 0.0
+        }
 
 # Instância global
 image_analysis_service = ImageAnalysisService()
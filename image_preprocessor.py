@@ -0,0 +1,180 @@
+"""
+Preparação local das imagens antes da análise com OpenAI Vision
+
+As fotos do WhatsApp chegam em resolução cheia e iam inteiras para a API
+com detail "auto". Antes da chamada, a imagem é:
+
+    - reduzida e recomprimida em JPEG para o tamanho que a OpenAI usaria de
+      qualquer forma (low: cabe em 512x512; high: cabe em 2048x2048 com o
+      lado menor em até 768) - menos bytes no upload, mesmo resultado
+    - classificada em detail "low" (85 tokens fixos) ou "high" (tiles de
+      512px) pelo tamanho/formato e pela legenda: prints de tela, comprovantes
+      e pedidos para ler algo usam "high"; fotos comuns, "low"
+    - descartada quando é figurinha (WebP 512x512), sem chamar a API
+
+Sem o Pillow instalado a imagem segue como veio (detail "auto").
+"""
+
+import io
+import os
+import re
+import math
+import logging
+from typing import Optional
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - dependência opcional
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+LOW_MAX_SIDE = 512
+HIGH_MAX_SIDE = 2048
+HIGH_SHORT_SIDE = 768
+TILE_SIZE = 512
+BASE_TOKENS = 85
+TILE_TOKENS = 170
+
+STICKER_SIZE = (512, 512)
+
+# Legendas que pedem leitura de detalhes (texto, valores, erros na tela...)
+DETAIL_CAPTION_RE = re.compile(
+    r"\b(ler|leia|l[eê]|texto|escrito|print|tela|erro|mensagem|comprovante|pix|boleto|"
+    r"nota|fatura|c[oó]digo|valor|pre[cç]o|link|site|painel|configura[cç][aã]o|"
+    r"pedido|rastreio|etiqueta|cnpj|cpf)\b",
+    re.IGNORECASE
+)
+
+
+class PreparedImage:
+    """Imagem pronta para a chamada de visão"""
+
+    __slots__ = ("data", "mimetype", "detail", "width", "height", "original_size", "original_tokens",
+                 "skip_reason")
+
+    def __init__(self, data: bytes, mimetype: str, detail: str = "auto", width: int = 0, height: int = 0,
+                 original_size: int = 0, original_tokens: int = 0, skip_reason: Optional[str] = None):
+        self.data = data
+        self.mimetype = mimetype
+        self.detail = detail
+        self.width = width
+        self.height = height
+        self.original_size = original_size or len(data)
+        # Tokens da imagem original com detail "auto" (como era enviada antes)
+        self.original_tokens = original_tokens or self.estimated_tokens
+        self.skip_reason = skip_reason
+
+    @property
+    def estimated_tokens(self) -> int:
+        return estimate_tokens(self.width, self.height, self.detail)
+
+
+def _fit(width: int, height: int, max_side: int) -> tuple:
+    scale = min(1.0, max_side / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def high_detail_size(width: int, height: int) -> tuple:
+    """Tamanho que a OpenAI usa no detail "high": cabe em 2048 e lado menor até 768"""
+    width, height = _fit(width, height, HIGH_MAX_SIDE)
+    scale = min(1.0, HIGH_SHORT_SIDE / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def estimate_tokens(width: int, height: int, detail: str) -> int:
+    """
+    Tokens de entrada cobrados pela imagem (regra de tiles da OpenAI)
+
+    "auto" é estimado como "high", o pior caso.
+    """
+    if not width or not height:
+        return 0
+    if detail == "low":
+        return BASE_TOKENS
+    width, height = high_detail_size(width, height)
+    tiles = math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+    return BASE_TOKENS + TILE_TOKENS * tiles
+
+
+def choose_detail(width: int, height: int, mimetype: str, caption: Optional[str]) -> str:
+    """
+    Escolhe o detail da chamada de visão
+
+    Imagem que já cabe em 512x512 é sempre "low": a OpenAI vê os mesmos
+    pixels por 85 tokens em vez de 255. Acima disso, "high" para legendas
+    que pedem leitura (DETAIL_CAPTION_RE) e prints de tela (PNG ou proporção
+    de tela de celular); "low" para o resto (fotos, produtos, selfies).
+    """
+    if max(width, height) <= LOW_MAX_SIDE:
+        return "low"
+    if caption and DETAIL_CAPTION_RE.search(caption):
+        return "high"
+    if mimetype == "image/png":
+        return "high"
+    aspect = max(width, height) / max(1, min(width, height))
+    if aspect >= 1.9:
+        # Print de tela de celular ou conversa longa
+        return "high"
+    return "low"
+
+
+def prepare_image(image_bytes: bytes, mimetype: str = "image/jpeg", caption: Optional[str] = None,
+                  jpeg_quality: int = None) -> PreparedImage:
+    """
+    Reduz, recomprime e classifica a imagem para a chamada de visão
+
+    Args:
+        image_bytes: Imagem decodificada
+        mimetype: Tipo do arquivo (image/jpeg, image/png, image/webp...)
+        caption: Legenda enviada com a imagem (opcional)
+        jpeg_quality: Qualidade do JPEG recomprimido (padrão IMAGE_JPEG_QUALITY)
+
+    Returns:
+        PreparedImage (com skip_reason quando a chamada deve ser evitada)
+    """
+    mimetype = (mimetype or "image/jpeg").split(";")[0].strip().lower()
+    if Image is None:
+        return PreparedImage(image_bytes, mimetype)
+
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        width, height = image.size
+
+        if mimetype == "image/webp" and (image.size == STICKER_SIZE or getattr(image, "is_animated", False)):
+            return PreparedImage(image_bytes, mimetype, width=width, height=height, skip_reason="sticker")
+
+        # Foto do celular pode vir deitada com a orientação só no EXIF
+        image = ImageOps.exif_transpose(image)
+        width, height = image.size
+
+        original_tokens = estimate_tokens(width, height, "auto")
+        detail = choose_detail(width, height, mimetype, caption)
+        target = _fit(width, height, LOW_MAX_SIDE) if detail == "low" else high_detail_size(width, height)
+
+        if target != image.size:
+            image = image.resize(target, Image.LANCZOS)
+
+        if image.mode != "RGB":
+            # Transparência vira fundo branco (JPEG não tem canal alfa)
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            rgba = image.convert("RGBA")
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            image = background
+
+        quality = jpeg_quality or int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+        data = output.getvalue()
+
+        if len(data) >= len(image_bytes):
+            # Já era leve: recomprimir só aumentaria (a OpenAI reduz do mesmo jeito)
+            return PreparedImage(image_bytes, mimetype, detail, width, height, original_tokens=original_tokens)
+
+        return PreparedImage(data, "image/jpeg", detail, target[0], target[1],
+                             original_size=len(image_bytes), original_tokens=original_tokens)
+
+    except (OSError, ValueError) as e:
+        # Formato que o Pillow não abre: segue como veio
+        logger.warning(f"⚠️ Não foi possível preparar a imagem ({mimetype}): {e}")
+        return PreparedImage(image_bytes, mimetype)
@@ -0,0 +1,358 @@
+"""
+Fila durável de mensagens recebidas (tabela inbound_messages no PostgreSQL)
+
+O webhook grava cada mensagem na fila antes de responder, então um deploy ou
+crash não perde conversas pendentes. Fluxo:
+
+    1. enqueue(): INSERT com dedup pelo id da mensagem do WhatsApp. A linha já
+       nasce 'processing', reservada para o worker que recebeu o webhook.
+    2. O buffer local junta as mensagens e o agente responde.
+    3. mark_done(): marca as linhas como processadas - só depois que a
+       resposta foi entregue. Se o processamento falhar, release() devolve
+       as linhas para 'pending' e elas são entregues de novo.
+
+Um loop de recuperação (FOR UPDATE SKIP LOCKED) pega de volta mensagens
+'pending' ou 'processing' presas há mais de INBOUND_LOCK_TIMEOUT segundos
+(worker que morreu no meio) e as entrega de novo - processamento
+at-least-once, seguro com vários workers/réplicas.
+
+Com particionamento ativo (partition_manager.py), cada linha guarda a
+partição do remetente; quem recebe uma mensagem de partição alheia grava
+como 'pending' e avisa o dono via NOTIFY.
+"""
+
+import os
+import json
+import uuid
+import socket
+import asyncio
+import hashlib
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+from customer_repository import customer_repository
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "inbound_messages"
+
+SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS inbound_messages (
+        id BIGSERIAL PRIMARY KEY,
+        message_id VARCHAR(255) UNIQUE NOT NULL,
+        from_number VARCHAR(100) NOT NULL,
+        partition INTEGER NOT NULL DEFAULT 0,
+        payload JSONB NOT NULL,
+        status VARCHAR(20) NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        locked_by VARCHAR(255),
+        locked_at TIMESTAMP,
+        received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        processed_at TIMESTAMP
+    );
+    ALTER TABLE inbound_messages ADD COLUMN IF NOT EXISTS partition INTEGER NOT NULL DEFAULT 0;
+    CREATE INDEX IF NOT EXISTS idx_inbound_messages_status
+        ON inbound_messages(status, locked_at);
+    CREATE INDEX IF NOT EXISTS idx_inbound_messages_partition
+        ON inbound_messages(partition, status);
+"""
+
+
+class InboundQueue:
+    """Fila durável de mensagens recebidas com dedup e recuperação"""
+
+    def __init__(self):
+        # host:pid identifica o processo; o sufixo distingue reinícios
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}:"
+        self.worker_id = self.worker_prefix + uuid.uuid4().hex[:8]
+        self.lock_timeout = float(os.getenv("INBOUND_LOCK_TIMEOUT", "600"))
+        self.poll_interval = float(os.getenv("INBOUND_POLL_INTERVAL", "15"))
+        self.max_attempts = int(os.getenv("INBOUND_MAX_ATTEMPTS", "3"))
+        self.batch_size = int(os.getenv("INBOUND_BATCH_SIZE", "100"))
+
+        self._task: Optional[asyncio.Task] = None
+
+        # Métricas
+        self._enqueued = 0
+        self._duplicates = 0
+        self._done = 0
+        self._recovered = 0
+        self._dead = 0
+
+    @staticmethod
+    def message_key(payload: dict) -> str:
+        """
+        Chave de deduplicação da mensagem
+
+        Usa o id do WhatsApp quando presente; senão um hash de
+        remetente + timestamp + texto.
+        """
+        message_id = payload.get("id")
+        if message_id:
+            return str(message_id)
+
+        raw = f"{payload.get('from', '')}|{payload.get('timestamp', '')}|{payload.get('body', '')}"
+        return "sha1:" + hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    async def ensure_schema(self):
+        """Cria a tabela da fila caso não exista"""
+        pool = await customer_repository.get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(SCHEMA_SQL)
+
+    async def release_previous(self) -> int:
+        """
+        Libera mensagens presas por uma execução anterior deste mesmo processo
+
+        Em container o PID costuma se repetir após um restart; essas linhas
+        voltam para 'pending' na hora, sem esperar INBOUND_LOCK_TIMEOUT.
+
+        Returns:
+            Quantidade de mensagens liberadas
+        """
+        pool = await customer_repository.get_pool()
+        async with pool.acquire() as conn:
+            result = await conn.execute("""
+                UPDATE inbound_messages
+                SET status = 'pending', locked_by = NULL, locked_at = NULL
+                WHERE status = 'processing'
+                  AND left(locked_by, length($1)) = $1
+                  AND locked_by <> $2
+            """, self.worker_prefix, self.worker_id)
+
+        released = int(result.split()[-1])
+        if released:
+            logger.info(f"🛟 {released} mensagens de uma execução anterior voltaram para a fila")
+        return released
+
+    async def enqueue(self, payload: dict, partition: int = 0, claim: bool = True) -> Optional[int]:
+        """
+        Grava a mensagem na fila
+
+        Args:
+            payload: Payload completo do WhatsApp
+            partition: Partição do remetente
+            claim: True para já reservar a mensagem para este worker; False
+                   para deixá-la 'pending' e avisar o dono da partição
+
+        Returns:
+            id da linha na fila, ou None se a mensagem já foi recebida antes
+        """
+        pool = await customer_repository.get_pool()
+        async with pool.acquire() as conn:
+            if claim:
+                queue_id = await conn.fetchval("""
+                    INSERT INTO inbound_messages
+                    (message_id, from_number, partition, payload, status, attempts, locked_by, locked_at)
+                    VALUES ($1, $2, $3, $4::jsonb, 'processing', 1, $5, CURRENT_TIMESTAMP)
+                    ON CONFLICT (message_id) DO NOTHING
+                    RETURNING id
+                """, self.message_key(payload), payload.get("from", ""), partition,
+                    json.dumps(payload, ensure_ascii=False), self.worker_id)
+            else:
+                queue_id = await conn.fetchval("""
+                    INSERT INTO inbound_messages
+                    (message_id, from_number, partition, payload, status)
+                    VALUES ($1, $2, $3, $4::jsonb, 'pending')
+                    ON CONFLICT (message_id) DO NOTHING
+                    RETURNING id
+                """, self.message_key(payload), payload.get("from", ""), partition,
+                    json.dumps(payload, ensure_ascii=False))
+
+                if queue_id is not None:
+                    await conn.execute("SELECT pg_notify($1, $2)", NOTIFY_CHANNEL, str(partition))
+
+        if queue_id is None:
+            self._duplicates += 1
+            logger.info(f"♻️ Mensagem duplicada ignorada ({self.message_key(payload)})")
+        else:
+            self._enqueued += 1
+
+        return queue_id
+
+    async def mark_done(self, queue_ids: List[int]):
+        """Marca mensagens da fila como processadas"""
+        if not queue_ids:
+            return
+
+        try:
+            pool = await customer_repository.get_pool()
+            async with pool.acquire() as conn:
+                await conn.execute("""
+                    UPDATE inbound_messages
+                    SET status = 'done', processed_at = CURRENT_TIMESTAMP
+                    WHERE id = ANY($1::bigint[])
+                """, queue_ids)
+            self._done += len(queue_ids)
+        except Exception as e:
+            # A mensagem pode ser reprocessada depois (at-least-once)
+            logger.error(f"Erro ao marcar mensagens {queue_ids} como processadas: {e}")
+
+    async def release(self, queue_ids: List[int]):
+        """Devolve mensagens reservadas para 'pending' (processamento falhou)"""
+        if not queue_ids:
+            return
+
+        try:
+            pool = await customer_repository.get_pool()
+            async with pool.acquire() as conn:
+                await conn.execute("""
+                    UPDATE inbound_messages
+                    SET status = 'pending', locked_by = NULL, locked_at = NULL
+                    WHERE id = ANY($1::bigint[]) AND status = 'processing' AND locked_by = $2
+                """, queue_ids, self.worker_id)
+        except Exception as e:
+            # Continuam reservadas: voltam após INBOUND_LOCK_TIMEOUT
+            logger.error(f"Erro ao devolver mensagens {queue_ids} para a fila: {e}")
+
+    async def release_failed(self, queue_ids: List[int]) -> bool:
+        """
+        Devolve mensagens cujo processamento falhou, respeitando o limite de tentativas
+
+        Mensagens que já usaram INBOUND_MAX_ATTEMPTS tentativas viram 'failed'
+        na hora; as demais voltam para 'pending'.
+
+        Returns:
+            True se as mensagens serão entregues de novo (False = desistiu delas)
+        """
+        if not queue_ids:
+            return False
+
+        try:
+            pool = await customer_repository.get_pool()
+            async with pool.acquire() as conn:
+                rows = await conn.fetch("""
+                    UPDATE inbound_messages
+                    SET status = CASE WHEN attempts >= $3 THEN 'failed' ELSE 'pending' END,
+                        locked_by = NULL, locked_at = NULL
+                    WHERE id = ANY($1::bigint[]) AND status = 'processing' AND locked_by = $2
+                    RETURNING status
+                """, queue_ids, self.worker_id, self.max_attempts)
+        except Exception as e:
+            # Continuam reservadas: voltam após INBOUND_LOCK_TIMEOUT
+            logger.error(f"Erro ao devolver mensagens {queue_ids} para a fila: {e}")
+            return True
+
+        dead = sum(1 for row in rows if row["status"] == "failed")
+        self._dead += dead
+        # Nenhuma linha devolvida: já estão com outro worker/concluídas
+        return not rows or dead < len(rows)
+
+    async def claim_stale(self, partitions: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+        """
+        Reserva mensagens abandonadas (pendentes ou presas há mais de
+        INBOUND_LOCK_TIMEOUT segundos)
+
+        Args:
+            partitions: Partições deste worker. None = todas (sem
+                        particionamento). Mensagens 'processing' de outro
+                        worker só são retomadas após o lock timeout, mesmo em
+                        partições próprias: o dono anterior pode ainda estar
+                        respondendo (quem abandona uma partição devolve as
+                        mensagens para 'pending' com release()).
+
+        Returns:
+            Lista de {id, from_number, payload} em ordem de chegada
+        """
+        if partitions is not None and not partitions:
+            return []
+
+        # $1 = lock_timeout, $2 = partições (NULL = todas)
+        stale_filter = """
+            (status = 'pending'
+             OR (status = 'processing'
+                 AND locked_at < CURRENT_TIMESTAMP - make_interval(secs => $1)))
+            AND ($2::int[] IS NULL OR partition = ANY($2::int[]))
+        """
+
+        pool = await customer_repository.get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                # Mensagens que já estouraram o limite de tentativas viram 'failed'
+                dead = await conn.execute(f"""
+                    UPDATE inbound_messages
+                    SET status = 'failed'
+                    WHERE attempts >= $3
+                      AND id IN (
+                          SELECT id FROM inbound_messages
+                          WHERE {stale_filter}
+                          FOR UPDATE SKIP LOCKED
+                      )
+                """, self.lock_timeout, partitions, self.max_attempts)
+                self._dead += int(dead.split()[-1])
+
+                rows = await conn.fetch(f"""
+                    UPDATE inbound_messages
+                    SET status = 'processing',
+                        attempts = attempts + 1,
+                        locked_by = $3,
+                        locked_at = CURRENT_TIMESTAMP
+                    WHERE id IN (
+                        SELECT id FROM inbound_messages
+                        WHERE {stale_filter}
+                        ORDER BY id
+                        LIMIT $4
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, from_number, payload
+                """, self.lock_timeout, partitions, self.worker_id, self.batch_size)
+
+        claimed = [
+            {"id": row["id"], "from_number": row["from_number"], "payload": json.loads(row["payload"])}
+            for row in sorted(rows, key=lambda r: r["id"])
+        ]
+        self._recovered += len(claimed)
+        return claimed
+
+    def start(self, feed: Callable[[int, dict], None],
+              partitions: Callable[[], Optional[List[int]]] = lambda: None):
+        """
+        Inicia o loop de recuperação
+
+        Args:
+            feed: Função chamada com (queue_id, payload) para cada mensagem
+                  recuperada - normalmente adiciona ao buffer local
+            partitions: Retorna as partições deste worker (None = todas)
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._recovery_loop(feed, partitions))
+
+    async def stop(self):
+        """Para o loop de recuperação"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _recovery_loop(self, feed: Callable[[int, dict], None],
+                             partitions: Callable[[], Optional[List[int]]]):
+        """Busca periodicamente mensagens abandonadas e as reentrega"""
+        while True:
+            try:
+                for message in await self.claim_stale(partitions()):
+                    logger.info(f"🛟 Mensagem recuperada da fila: id={message['id']} de {message['from_number']}")
+                    feed(message["id"], message["payload"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Erro no loop de recuperação da fila: {e}")
+
+            await asyncio.sleep(self.poll_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas da fila"""
+        return {
+            "worker_id": self.worker_id,
+            "enqueued": self._enqueued,
+            "duplicates": self._duplicates,
+            "done": self._done,
+            "recovered": self._recovered,
+            "failed": self._dead
+        }
+
+
+# Instância global
+inbound_queue = InboundQueue()
@@ -83,7 +83,14 @@ CREATE TABLE customer_context (
     plans_purchased TEXT,
     last_purchase_date DATE,
     total_spent DECIMAL(10, 2) DEFAULT 0.00,
-    notes TEXT,
+    notes TEXT, -- observações em texto livre (memórias ficam em customer_memories)
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Memórias importantes do cliente (tools/memory_tools.py): {chave: {value, updated_at}}
+CREATE TABLE customer_memories (
+    customer_id INTEGER PRIMARY KEY REFERENCES customers(id) ON DELETE CASCADE,
+    memories JSONB NOT NULL DEFAULT '{}'::jsonb,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -218,6 +225,10 @@ CREATE INDEX idx_conversation_session_id ON conversation_history(session_id);
 CREATE INDEX idx_conversation_customer_id ON conversation_history(customer_id);
 CREATE INDEX idx_user_preferences_customer_id ON user_preferences(customer_id);
 CREATE INDEX idx_customer_context_customer_id ON customer_context(customer_id);
+-- Uma linha por cliente: upserts com ON CONFLICT (customer_id) em tools/memory_tools.py
+CREATE UNIQUE INDEX uq_customer_context_customer ON customer_context(customer_id);
+CREATE UNIQUE INDEX uq_user_preferences_customer ON user_preferences(customer_id);
+CREATE INDEX idx_customer_memories_memories ON customer_memories USING GIN (memories);
 CREATE INDEX idx_products_category ON products(category);
 CREATE INDEX idx_orders_customer ON orders(customer_id);
 CREATE INDEX idx_conversation_scripts_profile ON conversation_scripts(profile_name);
@@ -258,3 +269,64 @@ INSERT INTO products (name, category, supplier_id, cost_price, suggested_price,
 ('Kit Cozinha Completo', 'Utilidades', 3, 42.00, 99.90, 'Conjunto de utensílios de cozinha'),
 ('Mochila Notebook Premium', 'Acessórios', 4, 52.00, 119.90, 'Mochila impermeável para notebook 15.6"'),
 ('Kit Skincare Facial', 'Beleza', 5, 38.00, 89.90, 'Kit completo para cuidados faciais');
+
+-- Fila durável de mensagens recebidas (inbound_queue.py)
+CREATE TABLE IF NOT EXISTS inbound_messages (
+    id BIGSERIAL PRIMARY KEY,
+    message_id VARCHAR(255) UNIQUE NOT NULL, -- id da mensagem no WhatsApp (dedup)
+    from_number VARCHAR(100) NOT NULL,
+    partition INTEGER NOT NULL DEFAULT 0, -- partição do cliente (partition_manager.py)
+    payload JSONB NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending', -- 'pending', 'processing', 'done', 'failed'
+    attempts INTEGER NOT NULL DEFAULT 0,
+    locked_by VARCHAR(255),
+    locked_at TIMESTAMP,
+    received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    processed_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_inbound_messages_status ON inbound_messages(status, locked_at);
+CREATE INDEX IF NOT EXISTS idx_inbound_messages_partition ON inbound_messages(partition, status);
+
+-- Workers vivos do bot (partition_manager.py)
+CREATE TABLE IF NOT EXISTS bot_workers (
+    worker_id VARCHAR(255) PRIMARY KEY,
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Registro de entrega das mensagens enviadas (outbound_dispatcher.py)
+CREATE TABLE IF NOT EXISTS outbound_deliveries (
+    id BIGSERIAL PRIMARY KEY,
+    to_number VARCHAR(100) NOT NULL,
+    message TEXT,
+    status VARCHAR(20) NOT NULL, -- 'sent' ou 'failed'
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    queued_at TIMESTAMP,
+    sent_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_outbound_deliveries_to ON outbound_deliveries(to_number, queued_at);
+CREATE INDEX IF NOT EXISTS idx_outbound_deliveries_status ON outbound_deliveries(status);
+
+-- Cache de transcrições e análises de imagem por hash do conteúdo (media_cache.py)
+CREATE TABLE IF NOT EXISTS media_cache (
+    cache_key VARCHAR(96) PRIMARY KEY, -- tipo:sha256(mídia):sha256(variante)
+    kind VARCHAR(20) NOT NULL, -- 'audio' ou 'image'
+    media_hash CHAR(64) NOT NULL,
+    result TEXT NOT NULL,
+    media_bytes INTEGER,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_media_cache_last_used ON media_cache(last_used_at);
+
+-- Resumo incremental das trocas fora da janela de contexto (conversation_summarizer.py)
+CREATE TABLE IF NOT EXISTS customer_summaries (
+    customer_id INTEGER PRIMARY KEY REFERENCES customers(id) ON DELETE CASCADE,
+    summary TEXT NOT NULL,
+    summarized_until TIMESTAMP NOT NULL, -- última troca já incluída no resumo
+    turns_summarized INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_conversation_customer_timestamp ON conversation_history(customer_id, timestamp);
@@ -0,0 +1,316 @@
+"""
+Roteador de intenções antes do agente
+
+Mensagens simples não precisam passar pelo agente completo (que busca
+histórico e memórias via tools antes de responder - várias chamadas ao LLM):
+
+    - demo: verbo de ver/conhecer seguido do que ver ("quero ver os
+      produtos", "conhecer a plataforma"), em palavras inteiras e sem negação
+      -> mensagem pronta de fornecer_conta_demo()
+    - faq: pergunta com match de alta confiança no índice do FAQ -> resposta
+      do próprio FAQ
+    - saudação: "oi", "bom dia"... -> apresentação fixa para cliente novo, ou
+      uma única chamada curta ao LLM com as últimas mensagens para quem já
+      conversou antes
+
+Na dúvida (mensagem longa, mais de uma intenção, match fraco) a mensagem
+segue para o agente. As métricas comparam os desvios com o custo médio
+medido das rodadas do agente (chamadas ao LLM e latência).
+"""
+
+import os
+import re
+import time
+import logging
+from typing import Any, Dict, List, Optional
+
+from tools.faq_index import fold_accents
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Palavras que, sozinhas, formam uma saudação ("oi gabi, tudo bem?")
+GREETING_WORDS = frozenset("""
+    oi oie oii oiii ola opa eai eae ei hey hello salve
+    bom boa dia tarde noite tudo bem td tb blz beleza joia e ai gabi
+""".split())
+GREETING_CORE = frozenset("oi oie oii oiii ola opa eai eae ei hey hello salve dia tarde noite".split())
+
+# Artigos/preposições ignorados ao comparar com os gatilhos de demo
+# ("ver o catálogo" casa com o gatilho "ver catalogo")
+FILLER_WORDS = frozenset("o a os as um uma uns umas de da do das dos no na nos nas seu sua seus suas meu minha".split())
+
+# Pedido de demo = verbo de ver + o que ver logo em seguida (até 2 palavras de
+# distância: "ver todos os produtos"). Frases soltas como "como funciona" ou
+# "quero ver" sem objeto vão para o agente ("como funciona o frete?",
+# "quero ver o preço dos planos")
+DEMO_VERBS = frozenset("ver veja vejo olhar olhada conhecer mostrar mostra mostre acessar explorar".split())
+DEMO_OBJECTS = frozenset("""
+    produto produtos catalogo catalogos fornecedor fornecedores plataforma painel dentro demo demonstracao
+""".split())
+# Frases que já são o pedido inteiro
+DEMO_PHRASES = ("conta demo", "conta demonstracao", "conta de demonstracao")
+# Negação em qualquer ponto manda para o agente: "não quero ver produto",
+# "nem precisa mostrar a plataforma"
+NEGATION_WORDS = frozenset("nao nem nunca jamais".split())
+
+GREETING_NEW_CUSTOMER = (
+    "Oi! Eu sou a Gabi, consultora da SPDrop 😊\n\n"
+    "Você já é assinante ou quer conhecer a plataforma?"
+)
+
+GREETING_PROMPT = """Você é a Gabi, consultora de vendas da SPDrop (dropshipping), no WhatsApp.
+O cliente mandou só um cumprimento. Responda em português, em no máximo 2 frases curtas,
+de forma natural e calorosa. Use o nome do cliente se aparecer nas mensagens anteriores,
+retome o último assunto e conduza para a próxima ação (conta demo, teste ou plano).
+Não invente informações.
+
+Mensagens anteriores:
+{history}
+
+Cliente: {message}"""
+
+
+class Route:
+    """Intenção identificada para uma mensagem"""
+
+    __slots__ = ("intent", "reply", "detail")
+
+    def __init__(self, intent: str, reply: Optional[str] = None, detail: str = ""):
+        self.intent = intent
+        self.reply = reply
+        self.detail = detail
+
+
+class IntentRouter:
+    """Responde intenções simples sem passar pelo agente"""
+
+    def __init__(self):
+        self.enabled = os.getenv("ROUTER_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.max_words = int(os.getenv("ROUTER_MAX_WORDS", "10"))
+        self.faq_min_confidence = float(os.getenv("ROUTER_FAQ_MIN_CONFIDENCE", "0.8"))
+        self.llm_model = os.getenv("ROUTER_LLM_MODEL", "gpt-4o-mini")
+
+        self._llm_client = None
+
+        # Métricas
+        self._messages = 0
+        self._bypassed: Dict[str, int] = {}
+        self._fallbacks = 0
+        self._route_time_total = 0.0
+        self._llm_calls = 0
+        self._agent_turns = 0
+        self._agent_llm_calls = 0
+        self._agent_time_total = 0.0
+        self._agent_tokens = 0
+        # Tokens de entrada e quantos vieram do cache de prompt da OpenAI
+        self._agent_input_tokens = 0
+        self._agent_cached_tokens = 0
+        self._agent_turns_by_stage: Dict[str, int] = {}
+
+    def _tools(self):
+        # Import tardio: o módulo do agente carrega agno e o prompt inteiro
+        from agentes.agente_suporte import faq_tools, demo_tools
+        return faq_tools, demo_tools
+
+    @staticmethod
+    def match_demo(words: List[str]) -> Optional[str]:
+        """
+        Pedido de conta demo na mensagem (palavras já sem acento, sem negação)
+
+        Returns:
+            Trecho que casou ("ver produtos"), ou None
+        """
+        text = " ".join(words)
+        for phrase in DEMO_PHRASES:
+            if f" {phrase} " in f" {text} ":
+                return phrase
+
+        content = [w for w in words if w not in FILLER_WORDS]
+        for i, word in enumerate(content):
+            if word not in DEMO_VERBS:
+                continue
+            for obj in content[i + 1:i + 3]:
+                if obj in DEMO_OBJECTS:
+                    return f"{word} {obj}"
+        return None
+
+    @staticmethod
+    def _is_greeting(words: List[str]) -> bool:
+        return bool(words) and all(w in GREETING_WORDS for w in words) and any(w in GREETING_CORE for w in words)
+
+    def classify(self, message_text: str) -> Optional[Route]:
+        """
+        Identifica uma intenção simples na mensagem
+
+        Args:
+            message_text: Texto (já unificado) do cliente
+
+        Returns:
+            Route, ou None quando a mensagem deve ir para o agente
+        """
+        if not self.enabled or not message_text:
+            return None
+
+        folded = fold_accents(message_text)
+        words = WORD_RE.findall(folded)
+        if not words or len(words) > self.max_words:
+            return None
+
+        if self._is_greeting(words):
+            return Route("greeting")
+
+        if any(w in NEGATION_WORDS for w in words):
+            # "não quero ver produto": match de demo/FAQ seria o oposto do pedido
+            return None
+
+        faq_tools, demo_tools = self._tools()
+
+        trigger = self.match_demo(words)
+        if trigger:
+            reply = demo_tools.fornecer_conta_demo()["mensagem_formatada"]
+            return Route("demo", reply, trigger)
+
+        match = faq_tools.best_match(message_text)
+        # Match claro: cobre quase toda a pergunta e bem à frente do 2º lugar
+        if match and match["confidence"] >= self.faq_min_confidence and match["margin"] >= 1.5:
+            faq = match["faq"]
+            reply = faq["resposta"] or faq["resposta_recomendada"]
+            if reply:
+                return Route("faq", reply, faq["pergunta"])
+
+        return None
+
+    def _complete(self, prompt: str) -> str:
+        """Chamada única e curta ao LLM (síncrona - roda no pool do agente)"""
+        if self._llm_client is None:
+            from openai import OpenAI
+            self._llm_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+        response = self._llm_client.chat.completions.create(
+            model=self.llm_model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=150,
+            temperature=0.7
+        )
+        return (response.choices[0].message.content or "").strip()
+
+    async def respond(self, route: Route, customer_id: int, message_text: str,
+                      context: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """
+        Gera a resposta da rota
+
+        Args:
+            route: Intenção identificada por classify()
+            customer_id: ID do cliente
+            message_text: Texto do cliente
+            context: Contexto já carregado (customer_repository.get_turn_context)
+
+        Returns:
+            Texto da resposta, ou None para seguir com o agente
+        """
+        started = time.monotonic()
+        reply = route.reply
+
+        if route.intent == "greeting":
+            from customer_repository import customer_repository
+            from agent_executor import agent_executor
+
+            if context is not None:
+                history = context["history"][-3:]
+            else:
+                history = await customer_repository.get_recent_history(customer_id, limit=3)
+            if history is None:
+                reply = None
+            elif not history:
+                reply = GREETING_NEW_CUSTOMER
+            else:
+                lines = []
+                for turn in history:
+                    lines.append(f"Cliente: {turn['user_message']}")
+                    lines.append(f"Gabi: {turn['agent_response']}")
+                prompt = GREETING_PROMPT.format(history="\n".join(lines), message=message_text)
+                try:
+                    reply = await agent_executor.run(self._complete, prompt)
+                    self._llm_calls += 1
+                except Exception as e:
+                    logger.warning(f"⚠️ Resposta rápida de saudação falhou, usando o agente: {e}")
+                    reply = None
+
+        if not reply:
+            self._fallbacks += 1
+            return None
+
+        elapsed = time.monotonic() - started
+        self._route_time_total += elapsed
+        self._bypassed[route.intent] = self._bypassed.get(route.intent, 0) + 1
+        logger.info(f"⚡ Resposta direta ({route.intent}{': ' + route.detail if route.detail else ''}) em {elapsed * 1000:.0f}ms - agente não chamado")
+        return reply
+
+    def record_message(self):
+        """Conta uma mensagem que passou pelo roteador"""
+        self._messages += 1
+
+    def record_agent_turn(self, run_output: Any, elapsed: float, stage: Optional[str] = None):
+        """
+        Registra o custo de uma rodada completa do agente
+
+        Args:
+            run_output: Resultado do agente (ou evento final do streaming)
+            elapsed: Duração da rodada em segundos
+            stage: Etapa do funil usada na rodada (agentes.agente_suporte.funnel_stage)
+        """
+        messages = getattr(run_output, "messages", None) or []
+        llm_calls = sum(1 for m in messages if getattr(m, "role", None) == "assistant")
+        self._agent_turns += 1
+        self._agent_llm_calls += llm_calls or 1
+        self._agent_time_total += elapsed
+        stage = stage or "sem_contexto"
+        self._agent_turns_by_stage[stage] = self._agent_turns_by_stage.get(stage, 0) + 1
+
+        metrics = getattr(run_output, "metrics", None)
+        self._agent_tokens += getattr(metrics, "total_tokens", 0) or 0
+
+        # Uso do cache de prompt (prompt_tokens_details.cached_tokens da OpenAI)
+        input_tokens = getattr(metrics, "input_tokens", 0) or 0
+        cached_tokens = getattr(metrics, "cache_read_tokens", 0) or getattr(metrics, "cached_tokens", 0) or 0
+        if input_tokens:
+            self._agent_input_tokens += input_tokens
+            self._agent_cached_tokens += cached_tokens
+            logger.info(
+                f"🧊 Prompt ({stage}): {input_tokens} tokens de entrada, {cached_tokens} do cache "
+                f"({cached_tokens / input_tokens * 100:.0f}%)"
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas do roteador (taxa de desvio e custo economizado)"""
+        bypassed = sum(self._bypassed.values())
+        avg_agent_calls = self._agent_llm_calls / self._agent_turns if self._agent_turns else 0.0
+        avg_agent_time = self._agent_time_total / self._agent_turns if self._agent_turns else 0.0
+
+        return {
+            "enabled": self.enabled,
+            "messages": self._messages,
+            "bypassed": bypassed,
+            "bypassed_by_intent": dict(self._bypassed),
+            "bypass_rate": round(bypassed / self._messages, 3) if self._messages else 0.0,
+            "fallbacks": self._fallbacks,
+            "router_llm_calls": self._llm_calls,
+            "agent_turns": self._agent_turns,
+            "agent_llm_calls_avg": round(avg_agent_calls, 2),
+            "agent_time_avg_ms": round(avg_agent_time * 1000, 1),
+            "agent_tokens_avg": round(self._agent_tokens / self._agent_turns) if self._agent_turns else 0,
+            "agent_input_tokens": self._agent_input_tokens,
+            "agent_cached_tokens": self._agent_cached_tokens,
+            "agent_cache_hit_rate": (
+                round(self._agent_cached_tokens / self._agent_input_tokens, 3) if self._agent_input_tokens else 0.0
+            ),
+            "agent_turns_by_stage": dict(self._agent_turns_by_stage),
+            "saved_llm_calls": round(max(bypassed * avg_agent_calls - self._llm_calls, 0), 1),
+            "saved_time_s": round(max(bypassed * avg_agent_time - self._route_time_total, 0), 1)
+        }
+
+
+# Instância global
+intent_router = IntentRouter()
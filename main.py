@@ -6,8 +6,20 @@ from dotenv import load_dotenv
 import logging
 from datetime import datetime
 import asyncio
+import time
 import re
 
+from message_buffer import MessageBuffer, MEDIA_FIELDS, describe_payload
+from inbound_queue import inbound_queue
+from partition_manager import partition_manager
+from intent_router import intent_router
+from history_writer import history_writer
+from message_splitter import split_message, StreamingSplitter
+from outbound_dispatcher import outbound_dispatcher
+from media_preprocessor import media_preprocessor
+from conversation_summarizer import conversation_summarizer
+from whatsapp_integration import whatsapp_client
+
 load_dotenv()
 
 # Configurar logging
@@ -17,12 +29,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Vanlu WhatsApp Bot", version="1.0.0")
+# Envia cada parágrafo assim que o agente termina de gerá-lo
+AGENT_STREAMING = os.getenv("AGENT_STREAMING", "true").lower() in ("1", "true", "yes")
 
-# Sistema de buffer de mensagens para juntar mensagens fracionadas
-message_buffers = {}
-buffer_lock = asyncio.Lock()
-BUFFER_TIMEOUT = 13  # segundos para aguardar novas mensagens
+# Eventos do agno com pedaços do texto da resposta
+STREAM_CONTENT_EVENTS = ("RunContent", "RunResponseContent")
+
+app = FastAPI(title="Vanlu WhatsApp Bot", version="1.0.0")
 
 @app.get("/")
 async def root():
@@ -42,73 +55,103 @@ async def health():
         "timestamp": datetime.now().isoformat()
     }
 
-async def add_to_buffer_and_schedule(from_number: str, message_text: str, payload: dict):
-    """
-    Adiciona mensagem ao buffer e agenda processamento após BUFFER_TIMEOUT segundos
+@app.get("/metrics")
+async def metrics():
+    """Métricas internas de desempenho (pool de conexões, filas, etc.)"""
+    from db_pool import db_pool
+    from customer_repository import customer_repository
+    from agent_executor import agent_executor
+    from agentes.agente_suporte import faq_tools
+    from customer_cache import customer_cache
+    from transcription_service import transcription_service
+    from media_cache import media_cache
+    from image_analysis_service import image_analysis_service
 
-    Args:
-        from_number: Número do remetente
-        message_text: Texto da mensagem
-        payload: Payload completo do WhatsApp
-    """
-    async with buffer_lock:
-        # Criar buffer se não existir
-        if from_number not in message_buffers:
-            message_buffers[from_number] = {
-                "messages": [],
-                "task": None,
-                "payload": payload.copy()
-            }
-
-        # Adicionar mensagem ao buffer
-        message_buffers[from_number]["messages"].append(message_text)
-        logger.info(f"📝 Mensagem adicionada ao buffer de {from_number}. Total: {len(message_buffers[from_number]['messages'])} mensagens")
-
-        # Cancelar timer anterior se existir
-        if message_buffers[from_number]["task"]:
-            message_buffers[from_number]["task"].cancel()
-            logger.info(f"⏱️ Timer anterior cancelado para {from_number}")
-
-        # Agendar novo processamento
-        task = asyncio.create_task(process_buffered_messages(from_number))
-        message_buffers[from_number]["task"] = task
-        logger.info(f"⏳ Novo timer de {BUFFER_TIMEOUT}s iniciado para {from_number}")
-
-async def process_buffered_messages(from_number: str):
-    """
-    Aguarda BUFFER_TIMEOUT segundos e processa todas mensagens acumuladas
+    return {
+        "message_buffer": message_buffer.stats(),
+        "inbound_queue": inbound_queue.stats(),
+        "partitions": partition_manager.stats(),
+        "db_pool": db_pool.stats(),
+        "async_db": customer_repository.stats(),
+        "customer_cache": customer_cache.stats(),
+        "history_writer": history_writer.stats(),
+        "outbound": outbound_dispatcher.stats(),
+        "whatsapp_http": whatsapp_client.stats(),
+        "agent_executor": agent_executor.stats(),
+        "faq": faq_tools.stats(),
+        "intent_router": intent_router.stats(),
+        "transcription": transcription_service.stats(),
+        "media_cache": media_cache.stats(),
+        "image_analysis": image_analysis_service.stats(),
+        "media_preprocessor": media_preprocessor.stats(),
+        "conversation_summarizer": conversation_summarizer.stats(),
+        "timestamp": datetime.now().isoformat()
+    }
 
-    Args:
-        from_number: Número do remetente
-    """
+@app.on_event("startup")
+async def startup():
+    """Prepara a fila durável e recupera mensagens pendentes"""
     try:
-        await asyncio.sleep(BUFFER_TIMEOUT)
-
-        async with buffer_lock:
-            if from_number not in message_buffers:
-                return
-
-            buffer_data = message_buffers[from_number]
-            messages = buffer_data["messages"]
-            payload = buffer_data["payload"]
+        await inbound_queue.ensure_schema()
+        await inbound_queue.release_previous()
+    except Exception as e:
+        logger.error(f"Não foi possível preparar a fila durável: {e}")
 
-            # Unificar todas as mensagens com quebra de linha
-            unified_message = "\n".join(messages)
+    try:
+        await outbound_dispatcher.ensure_schema()
+    except Exception as e:
+        logger.error(f"Não foi possível preparar o registro de entregas: {e}")
 
-            logger.info(f"🔄 Processando {len(messages)} mensagens de {from_number}")
-            logger.info(f"📨 Mensagem unificada: {unified_message[:100]}...")
+    try:
+        await conversation_summarizer.ensure_schema()
+    except Exception as e:
+        logger.error(f"Não foi possível preparar a tabela de resumos: {e}")
 
-            # Limpar buffer
-            del message_buffers[from_number]
+    try:
+        from media_cache import media_cache
+        await media_cache.ensure_schema()
+    except Exception as e:
+        logger.error(f"Não foi possível preparar o cache de mídia: {e}")
 
-        # Processar mensagem unificada (fora do lock)
-        payload["body"] = unified_message
-        await handle_message(payload)
+    try:
+        from agentes.agente_suporte import memory_tools
+        await asyncio.to_thread(memory_tools.check_schema)
+    except Exception as e:
+        logger.error(f"Não foi possível verificar a tabela de memórias: {e}")
 
-    except asyncio.CancelledError:
-        logger.info(f"❌ Processamento cancelado para {from_number} (nova mensagem recebida)")
+    try:
+        await partition_manager.start(on_partitions_ready, partition_is_busy, on_partitions_lost)
     except Exception as e:
-        logger.error(f"Erro ao processar buffer de {from_number}: {str(e)}", exc_info=True)
+        logger.error(f"Não foi possível iniciar o particionamento: {e}")
+
+    inbound_queue.start(feed_recovered_message, partition_manager.owned_partitions)
+    history_writer.start()
+
+    # Escritas de outros processos (painel, outros workers) invalidam o cache local
+    from customer_repository import customer_repository
+    customer_repository.start_cache_listener()
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Libera recursos compartilhados ao encerrar o servidor"""
+    from db_pool import db_pool
+    from customer_repository import customer_repository
+    from agent_executor import agent_executor
+
+    await inbound_queue.stop()
+    await message_buffer.flush_all()
+    await outbound_dispatcher.stop()
+    if _pending_acks:
+        # Entregas já terminaram (ou foram canceladas): confirma o que saiu
+        await asyncio.wait(list(_pending_acks), timeout=5)
+    await conversation_summarizer.stop()
+    await history_writer.stop()
+    await partition_manager.stop()
+    agent_executor.shutdown()
+    await whatsapp_client.close()
+    await customer_repository.close()
+    db_pool.closeall()
+    logger.info("🔌 Pools de conexões fechados")
 
 @app.post("/webhook")
 async def webhook(request: Request):
@@ -122,7 +165,7 @@ async def webhook(request: Request):
         # Receber payload do WhatsApp Web.js
         payload = await request.json()
 
-        logger.info(f"Webhook recebido: {payload}")
+        logger.info(f"Webhook recebido: {describe_payload(payload)}")
 
         # Extrair dados
         from_number = payload.get("from", "")
@@ -136,85 +179,162 @@ async def webhook(request: Request):
             logger.info(f"Mensagem de grupo ignorada: {from_number}")
             return {"status": "ignored_group"}
 
-        # Ignorar mensagens vazias
-        if not message_text or not message_text.strip():
+        # Ignorar mensagens vazias (áudio/imagem sem legenda seguem para o buffer)
+        has_media_data = any(payload.get(field) for field in MEDIA_FIELDS)
+        if (not message_text or not message_text.strip()) and not has_media_data:
             logger.info("Mensagem vazia ignorada")
             return {"status": "ignored_empty"}
 
-        # Adicionar ao buffer ao invés de processar imediatamente
-        await add_to_buffer_and_schedule(from_number, message_text, payload)
+        # Partição do cliente: só o worker dono junta e responde as mensagens
+        partition = partition_manager.partition_of(from_number)
+        is_owner = partition_manager.owns(partition)
+        partition_manager.pin(partition)
 
-        return {"status": "buffered"}
+        try:
+            # Gravar na fila durável antes de confirmar o recebimento
+            try:
+                queue_id = await inbound_queue.enqueue(payload, partition=partition, claim=is_owner)
+                if queue_id is None:
+                    return {"status": "duplicate"}
+            except Exception as e:
+                logger.error(f"Fila durável indisponível, usando apenas o buffer em memória: {e}")
+                queue_id = None
+
+            if not is_owner and queue_id is not None:
+                # O worker dono da partição foi avisado via NOTIFY
+                return {"status": "queued"}
+
+            # Adicionar ao buffer ao invés de processar imediatamente
+            message_buffer.add(from_number, message_text, payload, queue_id=queue_id)
+
+            return {"status": "buffered"}
+        finally:
+            partition_manager.unpin(partition)
 
     except Exception as e:
         logger.error(f"Erro no webhook: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
-async def send_message_in_parts(to_number: str, message: str):
+def send_message_in_parts(to_number: str, message: str, sent_parts: list = None):
     """
-    Divide mensagem em partes MICRO (cada parágrafo separado) e envia com delays
+    Divide mensagem em partes MICRO (cada parágrafo separado) e enfileira o envio
+
+    As pausas entre as partes (3-6 segundos para parecer humano) ficam com o
+    outbound_dispatcher - o handler não espera o envio.
 
     Args:
         to_number: Número do destinatário
         message: Mensagem completa do agente
     """
-    from whatsapp_integration import whatsapp_client
-
-    # Dividir por quebras de linha duplas (parágrafos) - cada um vira mensagem separada
-    parts = re.split(r'\n\s*\n', message.strip())
-
-    # Se não houver quebras duplas, dividir por linha simples
-    if len(parts) == 1:
-        parts = message.split('\n')
-
-    # Filtrar partes vazias e preparar para envio
-    final_parts = []
-    for part in parts:
-        part = part.strip()
-        if part:
-            # Se uma parte for muito longa (>200 chars), dividir por frases
-            if len(part) > 200:
-                sentences = re.split(r'([.!?])\s+', part)
-                current = ""
-                for i in range(0, len(sentences), 2):
-                    sentence = sentences[i]
-                    punct = sentences[i+1] if i+1 < len(sentences) else ""
-
-                    if len(current) + len(sentence) > 200 and current:
-                        final_parts.append(current.strip())
-                        current = sentence + punct + " "
-                    else:
-                        current += sentence + punct + " "
-
-                if current.strip():
-                    final_parts.append(current.strip())
-            else:
-                final_parts.append(part)
+    final_parts = split_message(message)
+
+    for part in final_parts:
+        outbound_dispatcher.send(to_number, part)
+        if sent_parts is not None:
+            sent_parts.append(part)
+    logger.info(f"  📤 {len(final_parts)} partes enfileiradas para envio")
+
+async def stream_agent_response(to_number: str, message_with_context: str, session_id: str, agent=None,
+                                sent_parts: list = None):
+    """
+    Roda o agente em streaming e enfileira cada parte assim que fica completa
+
+    Mesmas regras de divisão de send_message_in_parts, mas a primeira
+    mensagem sai quando o primeiro parágrafo termina de ser gerado, não depois
+    da resposta inteira. As pausas entre partes (outbound_dispatcher) correm
+    em paralelo com a geração.
+
+    Args:
+        agent: Agente da etapa do funil (padrão: support_agent)
+        sent_parts: Lista que recebe cada parte enfileirada (mesmo se o
+                    agente falhar no meio)
 
-    # Enviar cada parte INDIVIDUALMENTE com delay
-    for i, part in enumerate(final_parts):
-        await whatsapp_client.send_text(to_number, part)
-        logger.info(f"  📤 Mensagem {i+1}/{len(final_parts)} enviada ({len(part)} chars)")
+    Returns:
+        (resposta completa, evento final do agente - para as métricas)
+    """
+    from agentes.agente_suporte import support_agent
+    from agent_executor import agent_executor
+
+    splitter = StreamingSplitter()
+    chunks = []
+    final_event = None
+    started = time.monotonic()
+    sent = 0
+
+    def send(part: str):
+        nonlocal sent
+        outbound_dispatcher.send(to_number, part)
+        if sent_parts is not None:
+            sent_parts.append(part)
+        sent += 1
+        if sent == 1:
+            logger.info(f"  ⚡ Primeira parte pronta em {(time.monotonic() - started) * 1000:.0f}ms")
+        logger.info(f"  📤 Parte {sent} enfileirada ({len(part)} chars)")
+
+    async for event in agent_executor.stream(
+        (agent or support_agent).run,
+        message_with_context,
+        session_id=session_id,
+        stream=True
+    ):
+        kind = getattr(event, "event", None)
+        content = getattr(event, "content", None)
+        if kind in STREAM_CONTENT_EVENTS and isinstance(content, str):
+            chunks.append(content)
+            for part in splitter.feed(content):
+                send(part)
+        elif kind == "RunCompleted":
+            final_event = event
+
+    response = "".join(chunks)
+    if not response.strip() and final_event is not None and isinstance(getattr(final_event, "content", None), str):
+        # Versão do agno que só entrega o texto no evento final
+        response = final_event.content
+        for part in splitter.feed(response):
+            send(part)
+
+    for part in splitter.finish():
+        send(part)
+
+    return response, final_event
+
+async def load_customer_context(from_number: str):
+    """
+    Busca (ou cria) o cliente e carrega o contexto da rodada
+
+    Returns:
+        (customer_id, contexto) - contexto é None se a consulta falhar e o
+        agente volta a buscar histórico/memórias pelas tools
+    """
+    from customer_repository import customer_repository
+
+    started = time.monotonic()
+    customer_id = await customer_repository.get_or_create_customer(from_number)
+    if not customer_id:
+        return None, None
 
-        # Delay entre mensagens (3-6 segundos para parecer humano)
-        if i < len(final_parts) - 1:
-            delay = min(3 + (len(part) / 100), 6)
-            logger.info(f"  ⏱️ Aguardando {delay:.1f}s antes da próxima...")
-            await asyncio.sleep(delay)
+    context = await customer_repository.get_turn_context(customer_id)
+    logger.info(f"📇 Contexto do cliente {customer_id} carregado em {(time.monotonic() - started) * 1000:.0f}ms")
+    return customer_id, context
 
-async def handle_message(payload: dict):
+async def handle_message(payload: dict) -> bool:
     """
     Processa mensagem recebida do WhatsApp
 
     Args:
         payload: Dados da mensagem do WhatsApp Web.js
+
+    Returns:
+        True se a mensagem foi tratada (resposta enfileirada ou mensagem
+        ignorada); False se falhou antes de qualquer parte da resposta ir
+        para o cliente e deve ser entregue de novo pela fila
     """
+    # Partes da resposta já enfileiradas: com alguma, a rodada não é repetida
+    sent_parts = []
     try:
-        from whatsapp_integration import whatsapp_client
-        from customer_manager import customer_manager
-        from agentes.agente_suporte import support_agent
-        from transcription_service import transcription_service
-        from image_analysis_service import image_analysis_service
+        from customer_repository import customer_repository
+        from agentes.agente_suporte import funnel_stage, agent_for_stage
+        from agent_executor import agent_executor, AgentOverloadedError
 
         # Extrair dados da mensagem (whatsapp-web.js format)
         from_number = payload.get("from", "")
@@ -223,64 +343,22 @@ async def handle_message(payload: dict):
         has_media = payload.get("hasMedia", False)
         message_type = payload.get("type", "")
 
-        # 🎤 TRANSCRIÇÃO DE ÁUDIO: Se houver áudio, transcrever para texto
-        if message_type in ['ptt', 'audio'] and 'audioData' in payload:
-            logger.info("🎤 Áudio detectado! Iniciando transcrição...")
-
-            audio_base64 = payload.get("audioData")
-            audio_mimetype = payload.get("audioMimetype", "audio/ogg")
-
-            # Transcrever áudio
-            transcribed_text = transcription_service.transcribe_audio(
-                audio_base64=audio_base64,
-                mimetype=audio_mimetype
-            )
-
-            # Substituir message_text pelo texto transcrito
-            message_text = transcribed_text
-            logger.info(f"✅ Áudio transcrito: '{transcribed_text[:100]}...'")
-        elif message_type in ['ptt', 'audio']:
-            logger.warning("⚠️ Áudio detectado mas sem audioData no payload")
-            message_text = "[Áudio não pôde ser processado]"
-
-        # 🖼️ ANÁLISE DE IMAGEM: Se houver imagem, analisar e descrever
-        if message_type == 'image' and 'imageData' in payload:
-            logger.info("🖼️ Imagem detectada! Iniciando análise...")
-
-            image_base64 = payload.get("imageData")
-            image_mimetype = payload.get("imageMimetype", "image/jpeg")
-            image_caption = payload.get("body", None)
-
-            # Analisar imagem
-            image_description = image_analysis_service.analyze_image(
-                image_base64=image_base64,
-                mimetype=image_mimetype,
-                caption=image_caption
-            )
-
-            # Criar mensagem combinando legenda (se houver) e descrição da imagem
-            if image_caption and image_caption != '[Imagem recebida]':
-                message_text = f"[Imagem enviada com legenda: '{image_caption}']\n\nAnálise da imagem: {image_description}"
-            else:
-                message_text = f"[Imagem enviada]\n\nAnálise da imagem: {image_description}"
-
-            logger.info(f"✅ Imagem analisada: '{image_description[:100]}...'")
-        elif message_type == 'image':
-            logger.warning("⚠️ Imagem detectada mas sem imageData no payload")
-            message_text = "[Imagem não pôde ser processada]"
-
-        # Determinar se é grupo (grupos têm @g.us no final)
-        is_group = "@g.us" in from_number
-
-        # Ignorar mensagens de grupos
-        if is_group:
+        # Ignorar mensagens de grupos (grupos têm @g.us no final)
+        if "@g.us" in from_number:
             logger.info(f"Mensagem de grupo ignorada: {from_number}")
-            return
+            return True
+
+        # 1. Cliente + contexto da rodada em paralelo com a transcrição/análise
+        #    de todas as mídias da rajada
+        (customer_id, context), message_text = await asyncio.gather(
+            load_customer_context(from_number),
+            media_preprocessor.render(payload)
+        )
 
         # Ignorar mensagens vazias
         if not message_text or not message_text.strip():
             logger.info("Mensagem vazia ignorada")
-            return
+            return True
 
         logger.info(f"""
         ═══════════════════════════════════════
@@ -292,98 +370,215 @@ async def handle_message(payload: dict):
         ═══════════════════════════════════════
         """)
 
-        # 1. Buscar ou criar cliente
-        customer_id = customer_manager.get_or_create_customer(from_number)
-
         if not customer_id:
+            # Sem aviso ao cliente: a fila tenta de novo (o aviso sai se desistir)
             logger.error("Falha ao obter customer_id")
-            await whatsapp_client.send_text(
-                from_number,
-                "Desculpe, ocorreu um erro. Tente novamente."
-            )
-            return
-
-        # 2. Construir mensagem com contexto
-        message_with_context = customer_manager.build_context_message(
-            customer_id,
-            message_text
-        )
-
-        logger.info(f"Customer ID: {customer_id}")
+            return False
 
-        # 3. Criar session_id baseado no número do WhatsApp (normalizado)
+        # Criar session_id baseado no número do WhatsApp (normalizado)
         # Remove caracteres especiais e usa só números para session_id
         normalized_phone = from_number.replace("@c.us", "").replace("@s.whatsapp.net", "")
         session_id = f"whatsapp_{normalized_phone}"
 
         logger.info(f"Session ID: {session_id}")
 
-        # 4. Processar com Agente Luciano
-        logger.info("Processando com Agente Luciano...")
+        history_writer.log_message(customer_id, 'inbound', message_text, from_number=normalized_phone)
+
+        # 2. Intenções simples (demo, FAQ, saudação) respondidas sem o agente
+        intent_router.record_message()
+        agent_response = None
+        streamed = False
+        route = intent_router.classify(message_text)
+        if route is not None:
+            agent_response = await intent_router.respond(route, customer_id, message_text, context)
+
+        if agent_response is None:
+            # 3. Construir mensagem com contexto
+            message_with_context = customer_repository.build_context_message(
+                customer_id,
+                message_text,
+                context
+            )
 
-        # Usar .run() que é síncrono, passando session_id para contexto
-        import asyncio
-        from concurrent.futures import ThreadPoolExecutor
+            logger.info(f"Customer ID: {customer_id}")
+
+            # Agente da etapa do funil: mesmo prefixo fixo, só as tools da etapa
+            stage = funnel_stage(context)
+            agent = agent_for_stage(stage)
+            logger.info(f"🧭 Etapa do funil: {stage or 'sem contexto'}")
+
+            # 4. Processar com Agente Luciano
+            logger.info("Processando com Agente Luciano...")
+
+            # Usar .run() (síncrono) no pool compartilhado do agente
+            agent_started = time.monotonic()
+            try:
+                if AGENT_STREAMING:
+                    agent_response, run_output = await stream_agent_response(
+                        from_number,
+                        message_with_context,
+                        session_id,
+                        agent,
+                        sent_parts
+                    )
+                    streamed = True
+                else:
+                    run_output = await agent_executor.run(
+                        agent.run,
+                        message_with_context,
+                        session_id=session_id
+                    )
+            except AgentOverloadedError:
+                logger.error(f"Agente sobrecarregado - mensagem de {from_number} não processada")
+                outbound_dispatcher.send(
+                    from_number,
+                    "Estou com muitas conversas agora 😅 Me manda sua mensagem de novo em alguns minutinhos?"
+                )
+                # Cliente já foi avisado para reenviar: não reprocessar depois
+                return True
+
+            intent_router.record_agent_turn(run_output, time.monotonic() - agent_started, stage)
+
+            # Extrair resposta
+            if streamed:
+                pass
+            elif hasattr(run_output, 'content'):
+                agent_response = run_output.content
+            elif hasattr(run_output, 'message'):
+                if hasattr(run_output.message, 'content'):
+                    agent_response = run_output.message.content
+                else:
+                    agent_response = str(run_output.message)
+            else:
+                agent_response = str(run_output)
 
-        executor = ThreadPoolExecutor(max_workers=1)
-        loop = asyncio.get_event_loop()
+        logger.info(f"Resposta do agente: {agent_response[:100]}...")
 
-        # Criar função parcial para passar session_id
-        from functools import partial
-        run_with_session = partial(support_agent.run, message_with_context, session_id=session_id)
+        # 5. Dividir e enviar resposta em partes (como humano) - no streaming já foi enviada
+        if not streamed:
+            send_message_in_parts(from_number, agent_response, sent_parts)
+        logger.info("✓ Resposta enfileirada para envio!")
 
-        run_output = await loop.run_in_executor(
-            executor,
-            run_with_session
-        )
+        # 6. Histórico e log de mensagens (gravados em lote em segundo plano)
+        history_writer.log_turn(session_id, customer_id, message_text, agent_response)
+        # Trocas que saíram da janela de contexto entram no resumo (em segundo plano)
+        conversation_summarizer.maybe_update(customer_id, context)
+        history_writer.log_message(customer_id, 'outbound', agent_response, to_number=normalized_phone)
+        return True
 
-        # Extrair resposta
-        if hasattr(run_output, 'content'):
-            agent_response = run_output.content
-        elif hasattr(run_output, 'message'):
-            if hasattr(run_output.message, 'content'):
-                agent_response = run_output.message.content
-            else:
-                agent_response = str(run_output.message)
-        else:
-            agent_response = str(run_output)
+    except Exception as e:
+        logger.error(f"Erro ao processar mensagem: {str(e)}", exc_info=True)
+        if sent_parts:
+            # Cliente já recebeu (parte da) resposta: repetir a rodada duplicaria
+            logger.warning(
+                f"⚠️ {len(sent_parts)} parte(s) já enfileirada(s) para {payload.get('from', '')} - "
+                f"rodada não será repetida"
+            )
+            return True
+        return False
 
-        logger.info(f"Resposta do agente: {agent_response[:100]}...")
+# Confirmações aguardando a entrega da resposta (referência evita coleta da Task)
+_pending_acks = set()
 
-        # 5. Salvar conversa no histórico
-        customer_manager.save_conversation(
-            session_id=session_id,
-            customer_id=customer_id,
-            user_message=message_text,
-            agent_response=agent_response
-        )
+async def confirm_after_delivery(from_number: str, queue_ids: list, deliveries: list):
+    """
+    Marca a rajada como processada só depois que a resposta foi entregue
 
-        # 6. Dividir e enviar resposta em partes (como humano)
-        await send_message_in_parts(from_number, agent_response)
+    Se alguma parte não for entregue (ou o processo cair antes), as linhas
+    continuam 'processing' e a fila as entrega de novo (at-least-once).
+    """
+    records = await asyncio.gather(*deliveries) if deliveries else []
+    failed = [record for record in records if record.get("status") != "sent"]
+    if failed:
+        logger.error(
+            f"❌ {len(failed)} parte(s) da resposta para {from_number} não entregue(s) - "
+            f"mensagens {queue_ids} ficam para nova tentativa da fila"
+        )
+        return
+    await inbound_queue.mark_done(queue_ids)
 
-        logger.info("✓ Mensagem enviada com sucesso!")
+async def process_buffered_messages(payload: dict):
+    """
+    Processa uma rajada de mensagens do buffer e confirma na fila durável
 
-    except Exception as e:
-        logger.error(f"Erro ao processar mensagem: {str(e)}", exc_info=True)
+    A confirmação (mark_done) só acontece se o processamento deu certo e
+    depois que as partes da resposta foram entregues pelo outbound_dispatcher;
+    a espera pela entrega corre em segundo plano (não atrasa a próxima rajada).
 
-        # Tentar enviar mensagem de erro ao cliente
-        try:
-            await whatsapp_client.send_text(
+    Args:
+        payload: Payload unificado pelo buffer (body + queue_ids)
+    """
+    queue_ids = payload.pop("queue_ids", [])
+    from_number = payload.get("from", "")
+
+    if not await handle_message(payload):
+        # Aviso ao cliente só quando a fila desiste (ou não há fila): sem
+        # repetir o pedido de desculpas a cada nova tentativa
+        if await inbound_queue.release_failed(queue_ids):
+            logger.warning(f"⚠️ Rajada de {from_number} falhou - mensagens {queue_ids} serão entregues de novo")
+            return
+        logger.error(f"❌ Rajada de {from_number} falhou sem novas tentativas - avisando o cliente")
+        if "@g.us" not in from_number:
+            outbound_dispatcher.send(
                 from_number,
                 "Desculpe, tive um problema ao processar sua mensagem. Pode tentar novamente?"
             )
-        except:
-            pass
+        return
+    if not queue_ids:
+        return
+
+    task = asyncio.create_task(
+        confirm_after_delivery(from_number, queue_ids, outbound_dispatcher.deliveries(from_number))
+    )
+    _pending_acks.add(task)
+    task.add_done_callback(_pending_acks.discard)
+
+def feed_recovered_message(queue_id: int, payload: dict):
+    """Devolve ao buffer uma mensagem recuperada da fila durável"""
+    message_buffer.add(payload.get("from", ""), payload.get("body", ""), payload, queue_id=queue_id)
+
+async def claim_partition_messages(partitions: list):
+    """Busca na fila as mensagens pendentes das partições deste worker"""
+    try:
+        for message in await inbound_queue.claim_stale(partitions):
+            feed_recovered_message(message["id"], message["payload"])
+    except Exception as e:
+        logger.error(f"Erro ao buscar mensagens das partições {partitions}: {e}")
+
+def on_partitions_ready(partitions: list):
+    """Partições recém-assumidas ou com mensagem nova (NOTIFY)"""
+    asyncio.create_task(claim_partition_messages(partitions))
+
+async def on_partitions_lost(partitions: list):
+    """Partições perdidas sem aviso: rajadas acumuladas voltam para a fila do novo dono"""
+    lost = set(partitions)
+    queue_ids = message_buffer.abandon(lambda sender: partition_manager.partition_of(sender) in lost)
+    await inbound_queue.release(queue_ids)
+
+def partition_is_busy(partition: int) -> bool:
+    """True se há mensagens da partição acumuladas ou em processamento"""
+    return any(
+        partition_manager.partition_of(sender) == partition
+        for sender in message_buffer.active_senders()
+    )
+
+# Sistema de buffer de mensagens para juntar mensagens fracionadas
+message_buffer = MessageBuffer(process_buffered_messages)
 
 if __name__ == "__main__":
     host = os.getenv("FASTAPI_HOST", "0.0.0.0")
     port = int(os.getenv("FASTAPI_PORT", 5000))
+    workers = int(os.getenv("BOT_WORKERS", 1))
+
+    logger.info(f"Iniciando servidor FastAPI em {host}:{port} ({workers} workers)")
 
-    logger.info(f"Iniciando servidor FastAPI em {host}:{port}")
+    if workers > 1 and not partition_manager.enabled:
+        logger.warning("⚠️ BOT_WORKERS > 1 sem WORKER_PARTITIONING=true: mensagens do mesmo cliente podem cair em workers diferentes")
 
     uvicorn.run(
-        app,
+        "main:app" if workers > 1 else app,
         host=host,
         port=port,
+        workers=workers,
         log_level="info"
     )
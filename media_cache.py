@@ -0,0 +1,199 @@
+"""
+Cache persistente de transcrições de áudio e análises de imagem
+
+O mesmo áudio encaminhado ou o mesmo print de produto chega de muitos leads;
+cada um custava uma chamada externa (Groq Whisper / OpenAI Vision). O
+resultado fica na tabela media_cache, chaveado pelo SHA-256 dos bytes
+decodificados da mídia mais uma "variante" (modelo, idioma, legenda e
+versão do prompt), então a mesma mídia com outra legenda ou outro prompt
+não reaproveita uma resposta que não se aplica.
+
+    - leitura e atualização de uso em uma única instrução (UPDATE ... RETURNING)
+    - tamanho limitado: a cada MEDIA_CACHE_EVICT_EVERY gravações as entradas
+      menos usadas recentemente além de MEDIA_CACHE_MAX_ENTRIES são apagadas
+    - falhas do banco nunca impedem o processamento da mídia (vira miss)
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from typing import Any, Dict, Optional
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS media_cache (
+        cache_key VARCHAR(96) PRIMARY KEY,
+        kind VARCHAR(20) NOT NULL,
+        media_hash CHAR(64) NOT NULL,
+        result TEXT NOT NULL,
+        media_bytes INTEGER,
+        hits INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_media_cache_last_used ON media_cache(last_used_at);
+"""
+
+
+def media_hash(media: bytes) -> str:
+    """SHA-256 (hex) dos bytes decodificados da mídia"""
+    return hashlib.sha256(media).hexdigest()
+
+
+class MediaCache:
+    """Cache de resultados por hash de conteúdo, guardado no Postgres"""
+
+    def __init__(self):
+        self.enabled = os.getenv("MEDIA_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.max_entries = int(os.getenv("MEDIA_CACHE_MAX_ENTRIES", "20000"))
+        self.evict_every = int(os.getenv("MEDIA_CACHE_EVICT_EVERY", "100"))
+
+        # Métricas por tipo de mídia
+        self._hits: Dict[str, int] = {}
+        self._misses: Dict[str, int] = {}
+        self._writes = 0
+        self._evicted = 0
+        self._errors = 0
+        self._lookup_time_total = 0.0
+        self._lookups = 0
+
+    @staticmethod
+    def key(kind: str, media: bytes, *variant: Any) -> str:
+        """
+        Chave do cache: tipo + hash da mídia + hash da variante
+
+        Args:
+            kind: 'audio' ou 'image'
+            media: Bytes decodificados da mídia
+            variant: Tudo que muda o resultado além da mídia (modelo, legenda,
+                     versão do prompt...)
+
+        Returns:
+            Chave de até 96 caracteres
+        """
+        variant_hash = hashlib.sha256("\x1f".join(str(v) for v in variant).encode("utf-8")).hexdigest()
+        return f"{kind}:{media_hash(media)}:{variant_hash[:24]}"
+
+    async def ensure_schema(self):
+        """Cria a tabela do cache caso não exista"""
+        from customer_repository import customer_repository
+
+        pool = await customer_repository.get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(SCHEMA_SQL)
+
+    async def get(self, kind: str, cache_key: str) -> Optional[str]:
+        """
+        Resultado salvo para a chave (e marca o uso para a evicção)
+
+        Returns:
+            Texto salvo ou None (miss, cache desligado ou erro no banco)
+        """
+        if not self.enabled:
+            return None
+
+        from customer_repository import customer_repository
+
+        started = time.monotonic()
+        try:
+            pool = await customer_repository.get_pool()
+            async with pool.acquire(timeout=customer_repository.timeout) as conn:
+                result = await conn.fetchval("""
+                    UPDATE media_cache
+                    SET hits = hits + 1, last_used_at = CURRENT_TIMESTAMP
+                    WHERE cache_key = $1
+                    RETURNING result
+                """, cache_key)
+        except (asyncpg.PostgresError, OSError, asyncio.TimeoutError) as e:
+            logger.error(f"Erro ao consultar cache de mídia: {e}")
+            self._errors += 1
+            return None
+        finally:
+            self._lookups += 1
+            self._lookup_time_total += time.monotonic() - started
+
+        counter = self._hits if result is not None else self._misses
+        counter[kind] = counter.get(kind, 0) + 1
+        return result
+
+    async def set(self, kind: str, cache_key: str, result: str, media_size: int = None):
+        """
+        Salva o resultado de uma mídia processada
+
+        Args:
+            kind: 'audio' ou 'image'
+            cache_key: Chave gerada por key()
+            result: Transcrição / descrição
+            media_size: Tamanho da mídia em bytes (informativo)
+        """
+        if not self.enabled:
+            return
+
+        from customer_repository import customer_repository
+
+        try:
+            pool = await customer_repository.get_pool()
+            async with pool.acquire(timeout=customer_repository.timeout) as conn:
+                await conn.execute("""
+                    INSERT INTO media_cache (cache_key, kind, media_hash, result, media_bytes)
+                    VALUES ($1, $2, $3, $4, $5)
+                    ON CONFLICT (cache_key) DO UPDATE
+                    SET result = EXCLUDED.result, last_used_at = CURRENT_TIMESTAMP
+                """, cache_key, kind, cache_key.split(":")[1], result, media_size)
+
+                self._writes += 1
+                if self._writes % self.evict_every == 0:
+                    await self._evict(conn)
+        except (asyncpg.PostgresError, OSError, asyncio.TimeoutError) as e:
+            logger.error(f"Erro ao salvar no cache de mídia: {e}")
+            self._errors += 1
+
+    async def _evict(self, conn):
+        """Apaga as entradas menos usadas recentemente além de MEDIA_CACHE_MAX_ENTRIES"""
+        status = await conn.execute("""
+            DELETE FROM media_cache
+            WHERE cache_key IN (
+                SELECT cache_key FROM media_cache
+                ORDER BY last_used_at DESC
+                OFFSET $1
+            )
+        """, self.max_entries)
+        evicted = int(status.split()[-1])
+        if evicted:
+            self._evicted += evicted
+            logger.info(f"🧹 Cache de mídia: {evicted} entradas antigas removidas")
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas do cache de mídia (taxa de acerto por tipo)"""
+        kinds = sorted(set(self._hits) | set(self._misses))
+        hits = sum(self._hits.values())
+        total = hits + sum(self._misses.values())
+        return {
+            "enabled": self.enabled,
+            "hits": hits,
+            "misses": total - hits,
+            "hit_rate": round(hits / total, 3) if total else 0.0,
+            "by_kind": {
+                kind: {
+                    "hits": self._hits.get(kind, 0),
+                    "misses": self._misses.get(kind, 0),
+                    "hit_rate": round(
+                        self._hits.get(kind, 0) / (self._hits.get(kind, 0) + self._misses.get(kind, 0)), 3
+                    )
+                }
+                for kind in kinds
+            },
+            "writes": self._writes,
+            "evicted": self._evicted,
+            "errors": self._errors,
+            "lookup_avg_ms": round(self._lookup_time_total / self._lookups * 1000, 2) if self._lookups else 0.0
+        }
+
+
+# Instância global
+media_cache = MediaCache()
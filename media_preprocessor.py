@@ -0,0 +1,127 @@
+"""
+Pré-processamento das mídias de uma rajada de mensagens
+
+O buffer entrega a rajada inteira como fragmentos tipados
+(payload["fragments"]: texto, áudio ou imagem com legenda, em ordem). Todas
+as mídias são processadas ao mesmo tempo - transcrições (Groq) e análises
+de imagem (OpenAI) - e o texto da rodada é montado com cada fragmento no seu
+lugar: uma única mensagem para o agente, com texto, áudios e imagens.
+
+Cada provedor tem o próprio limite de chamadas simultâneas
+(TRANSCRIPTION_CONCURRENCY em transcription_service e
+IMAGE_ANALYSIS_CONCURRENCY em image_analysis_service), então uma rajada com
+N mídias custa ~uma ida ao provedor, não N.
+"""
+
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List
+
+from message_buffer import Fragment
+
+logger = logging.getLogger(__name__)
+
+
+class MediaPreprocessor:
+    """Transcreve/analisa em paralelo as mídias de uma rajada"""
+
+    def __init__(self):
+        # Métricas
+        self._bursts = 0
+        self._items = 0
+        self._wall_time_total = 0.0
+        self._serial_time_total = 0.0
+
+    @staticmethod
+    def fragments_of(payload: dict) -> List[Fragment]:
+        """Fragmentos da rajada (fragmento único quando não veio do buffer)"""
+        return payload.get("fragments") or [Fragment.from_payload(payload)]
+
+    async def _timed(self, coro) -> tuple:
+        started = time.monotonic()
+        result = await coro
+        return result, time.monotonic() - started
+
+    async def _process(self, fragment: Fragment) -> str:
+        """Texto que representa um fragmento de mídia na rodada"""
+        from transcription_service import transcription_service
+        from image_analysis_service import image_analysis_service
+
+        if fragment.kind == Fragment.AUDIO:
+            if not fragment.data:
+                logger.warning("⚠️ Áudio detectado mas sem audioData no payload")
+                return "[Áudio não pôde ser processado]"
+            return await transcription_service.transcribe_audio_async(
+                mimetype=fragment.mimetype,
+                audio_bytes=fragment.data
+            )
+
+        if fragment.kind == Fragment.STICKER:
+            return f"[{image_analysis_service.skip_sticker()}]"
+
+        if not fragment.data:
+            logger.warning("⚠️ Imagem detectada mas sem imageData no payload")
+            return "[Imagem não pôde ser processada]"
+
+        caption = fragment.text or None
+        description = await image_analysis_service.analyze_image_async(
+            mimetype=fragment.mimetype,
+            caption=caption,
+            image_bytes=fragment.data
+        )
+
+        # Combinar legenda (se houver) e descrição da imagem
+        if caption:
+            return f"[Imagem enviada com legenda: '{caption}']\n\nAnálise da imagem: {description}"
+        return f"[Imagem enviada]\n\nAnálise da imagem: {description}"
+
+    async def render(self, payload: dict) -> str:
+        """
+        Texto da rodada com as mídias já transcritas/analisadas
+
+        Args:
+            payload: Payload unificado pelo buffer (ou payload único)
+
+        Returns:
+            Fragmentos da rajada, em ordem, separados por quebra de linha
+        """
+        fragments = self.fragments_of(payload)
+        texts = [fragment.text for fragment in fragments]
+        media = [(index, fragment) for index, fragment in enumerate(fragments) if fragment.is_media]
+        if not media:
+            return "\n".join(text for text in texts if text and text.strip())
+
+        started = time.monotonic()
+        logger.info(f"🎞️ Processando {len(media)} mídia(s) da rajada em paralelo...")
+        results = await asyncio.gather(*(self._timed(self._process(fragment)) for _, fragment in media))
+        wall_time = time.monotonic() - started
+        serial_time = sum(elapsed for _, elapsed in results)
+
+        for (index, _), (text, _) in zip(media, results):
+            texts[index] = text
+
+        self._bursts += 1
+        self._items += len(media)
+        self._wall_time_total += wall_time
+        self._serial_time_total += serial_time
+        logger.info(
+            f"✅ {len(media)} mídia(s) processada(s) em {wall_time * 1000:.0f}ms "
+            f"(soma das chamadas: {serial_time * 1000:.0f}ms)"
+        )
+
+        return "\n".join(text for text in texts if text and text.strip())
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas do pré-processamento (tempo real x soma das chamadas)"""
+        bursts = self._bursts
+        return {
+            "bursts": bursts,
+            "media_items": self._items,
+            "wall_avg_ms": round(self._wall_time_total / bursts * 1000, 1) if bursts else 0.0,
+            "serial_avg_ms": round(self._serial_time_total / bursts * 1000, 1) if bursts else 0.0
+        }
+
+
+# Instância global
+media_preprocessor = MediaPreprocessor()
@@ -0,0 +1,333 @@
+"""
+Buffer de mensagens por remetente para juntar mensagens fracionadas
+
+Cada remetente tem seu próprio buffer com um prazo (deadline). Uma nova
+mensagem só anexa o texto e move o prazo - trabalho O(1), sem lock global e
+sem cancelar/criar uma Task a cada fragmento. Uma única Task por rajada
+aguarda o prazo e dispara o processamento.
+
+Rajadas do mesmo remetente são processadas uma de cada vez: se a anterior
+ainda está em andamento, a próxima continua acumulando mensagens e só é
+processada quando a anterior termina (respostas nunca se intercalam).
+
+Debounce adaptativo:
+    - BUFFER_TIMEOUT: silêncio máximo aguardado após a última mensagem
+    - BUFFER_EARLY_TIMEOUT: silêncio menor quando a última mensagem termina
+      com pontuação final (. ! ?) - a frase parece completa
+    - BUFFER_MAX_MESSAGES: processa imediatamente ao atingir N mensagens
+    - BUFFER_MAX_WAIT: tempo máximo desde a primeira mensagem da rajada
+
+Cada mensagem vira um Fragment tipado (texto, áudio ou imagem com legenda,
+com os bytes já decodificados). A rajada inteira - texto e mídias, na ordem
+em que chegaram - é entregue ao handler como uma única rodada
+(payload["fragments"]), ou seja, uma única execução do agente.
+"""
+
+import os
+import re
+import time
+import base64
+import binascii
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Frase completa: termina com . ! ? (opcionalmente seguidos de emoji/espaços).
+# Reticências ("...") indicam que a pessoa ainda vai continuar.
+SENTENCE_END_RE = re.compile(r'(?<!\.)[.!?](?:\s*[^\w\s.])*\s*$')
+
+
+AUDIO_TYPES = ("ptt", "audio")
+IMAGE_PLACEHOLDER = "[Imagem recebida]"
+AUDIO_PLACEHOLDER = "[Áudio recebido]"
+STICKER_TYPE = "sticker"
+
+# Campos de mídia do payload: ficam só nos fragmentos
+MEDIA_FIELDS = ("audioData", "imageData")
+
+
+class Fragment:
+    """Uma mensagem da rajada: texto, áudio, imagem (com legenda) ou figurinha"""
+
+    TEXT = "text"
+    AUDIO = "audio"
+    IMAGE = "image"
+    STICKER = "sticker"
+
+    __slots__ = ("kind", "text", "data", "mimetype")
+
+    def __init__(self, kind: str, text: str = "", data: Optional[bytes] = None, mimetype: Optional[str] = None):
+        self.kind = kind
+        self.text = text
+        self.data = data
+        self.mimetype = mimetype
+
+    @staticmethod
+    def _decode(data: Optional[str]) -> Optional[bytes]:
+        if not data:
+            return None
+        try:
+            return base64.b64decode(data)
+        except (binascii.Error, ValueError, TypeError):
+            logger.error("❌ Mídia com base64 inválido ignorada")
+            return None
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> "Fragment":
+        """
+        Fragmento de um payload do whatsapp-service
+
+        Áudio: bytes decodificados de audioData. Imagem: bytes de imageData e
+        a legenda (sem o marcador "[Imagem recebida]"). Figurinha: sem bytes
+        (o whatsapp-service não baixa). Demais tipos: texto.
+        """
+        message_type = payload.get("type", "")
+        body = payload.get("body") or ""
+
+        if message_type in AUDIO_TYPES:
+            return cls(cls.AUDIO, "", cls._decode(payload.get("audioData")),
+                       payload.get("audioMimetype", "audio/ogg"))
+
+        if message_type == STICKER_TYPE:
+            return cls(cls.STICKER)
+
+        if message_type == "image":
+            caption = "" if body == IMAGE_PLACEHOLDER else body
+            return cls(cls.IMAGE, caption, cls._decode(payload.get("imageData")),
+                       payload.get("imageMimetype", "image/jpeg"))
+
+        return cls(cls.TEXT, body)
+
+    @property
+    def is_media(self) -> bool:
+        return self.kind != self.TEXT
+
+    def __repr__(self) -> str:
+        size = f", {len(self.data)} bytes" if self.data else ""
+        return f"Fragment({self.kind}{size}, {self.text[:30]!r})"
+
+
+def describe_payload(payload: dict) -> dict:
+    """Payload sem o base64 das mídias (para logs)"""
+    return {
+        key: (f"<{len(value)} chars base64>" if key in MEDIA_FIELDS and value else value)
+        for key, value in payload.items()
+    }
+
+
+class _SenderBuffer:
+    """Mensagens acumuladas de um remetente"""
+
+    __slots__ = ("messages", "fragments", "queue_ids", "payload", "first_at", "deadline", "early", "task")
+
+    def __init__(self, payload: dict, now: float):
+        self.messages: List[str] = []
+        self.fragments: List[Fragment] = []
+        self.queue_ids: List[int] = []
+        # Metadados da rodada (remetente etc.); as mídias ficam nos fragmentos
+        self.payload = {key: value for key, value in payload.items() if key not in MEDIA_FIELDS}
+        self.first_at = now
+        self.deadline = now
+        self.early = False
+        self.task: Optional[asyncio.Task] = None
+
+
+class MessageBuffer:
+    """Junta mensagens fracionadas de cada remetente antes de processar"""
+
+    def __init__(self, handler: Callable[[dict], Awaitable[None]], timeout: float = None,
+                 early_timeout: float = None, max_messages: int = None, max_wait: float = None):
+        self.handler = handler
+        self.timeout = timeout if timeout is not None else float(os.getenv("BUFFER_TIMEOUT", "13"))
+        self.early_timeout = (
+            early_timeout if early_timeout is not None
+            else float(os.getenv("BUFFER_EARLY_TIMEOUT", "4"))
+        )
+        self.max_messages = max_messages or int(os.getenv("BUFFER_MAX_MESSAGES", "10"))
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv("BUFFER_MAX_WAIT", "30"))
+
+        self._buffers: Dict[str, _SenderBuffer] = {}
+        # Rajada em processamento por remetente
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+        # Métricas
+        self._received = 0
+        self._flushes = 0
+        self._early_flushes = 0
+        self._wait_total = 0.0
+
+    def _quiet_window(self, message_text: str) -> float:
+        """Tempo de silêncio a aguardar após esta mensagem"""
+        if SENTENCE_END_RE.search(message_text.strip()):
+            return min(self.early_timeout, self.timeout)
+        return self.timeout
+
+    def add(self, from_number: str, message_text: str, payload: dict, queue_id: Optional[int] = None) -> int:
+        """
+        Adiciona mensagem ao buffer do remetente e ajusta o prazo
+
+        Args:
+            from_number: Número do remetente
+            message_text: Texto da mensagem
+            payload: Payload completo do WhatsApp
+            queue_id: id da mensagem na fila durável (inbound_queue), se houver
+
+        Returns:
+            Quantidade de mensagens no buffer do remetente
+        """
+        now = time.monotonic()
+        self._received += 1
+
+        buffer = self._buffers.get(from_number)
+        if buffer is None:
+            buffer = _SenderBuffer(payload, now)
+            self._buffers[from_number] = buffer
+
+        fragment = Fragment.from_payload(payload)
+        buffer.messages.append(message_text or f"[{fragment.kind}]")
+        buffer.fragments.append(fragment)
+        if queue_id is not None:
+            buffer.queue_ids.append(queue_id)
+        count = len(buffer.messages)
+
+        if count >= self.max_messages:
+            buffer.deadline = now
+            buffer.early = True
+        else:
+            quiet_window = self._quiet_window(message_text or "")
+            buffer.deadline = min(now + quiet_window, buffer.first_at + self.max_wait)
+            buffer.early = quiet_window < self.timeout
+
+        logger.info(
+            f"📝 Mensagem adicionada ao buffer de {from_number}. Total: {count} mensagens "
+            f"(processa em {buffer.deadline - now:.1f}s)"
+        )
+
+        # Uma única Task por rajada - novas mensagens só movem o prazo
+        if buffer.task is None:
+            buffer.task = asyncio.create_task(self._wait_and_flush(from_number, buffer))
+
+        return count
+
+    async def _wait_and_flush(self, from_number: str, buffer: _SenderBuffer):
+        """Aguarda o prazo do buffer (que pode ser adiado) e processa"""
+        current = asyncio.current_task()
+        try:
+            while True:
+                remaining = buffer.deadline - time.monotonic()
+                if remaining > 0:
+                    await asyncio.sleep(remaining)
+                    continue
+
+                # Rajada anterior do mesmo remetente ainda em andamento: esperar
+                previous = self._inflight.get(from_number)
+                if previous is not None and not previous.done():
+                    await asyncio.wait({previous})
+                    continue
+
+                break
+
+            # Retirar o buffer antes de processar: mensagens novas abrem outra rajada
+            if self._buffers.get(from_number) is buffer:
+                del self._buffers[from_number]
+            self._inflight[from_number] = current
+
+            await self._flush(from_number, buffer)
+
+        except asyncio.CancelledError:
+            logger.info(f"❌ Processamento cancelado para {from_number}")
+        except Exception as e:
+            logger.error(f"Erro ao processar buffer de {from_number}: {str(e)}", exc_info=True)
+        finally:
+            if self._inflight.get(from_number) is current:
+                del self._inflight[from_number]
+
+    async def _flush(self, from_number: str, buffer: _SenderBuffer):
+        """Unifica as mensagens e chama o handler"""
+        messages = buffer.messages
+        waited = time.monotonic() - buffer.first_at
+
+        self._flushes += 1
+        self._wait_total += waited
+        if buffer.early:
+            self._early_flushes += 1
+
+        # Unificar todas as mensagens com quebra de linha
+        unified_message = "\n".join(messages)
+
+        media_count = sum(1 for fragment in buffer.fragments if fragment.is_media)
+        logger.info(
+            f"🔄 Processando {len(messages)} mensagens de {from_number} "
+            f"({media_count} mídias, aguardou {waited:.1f}s)"
+        )
+        logger.info(f"📨 Mensagem unificada: {unified_message[:100]}...")
+
+        payload = buffer.payload
+        payload["body"] = unified_message
+        payload["queue_ids"] = buffer.queue_ids
+        payload["fragments"] = buffer.fragments
+        await self.handler(payload)
+
+    async def flush_all(self):
+        """Processa imediatamente todos os buffers pendentes (ex: no shutdown)"""
+        # Buffers ainda no dict estão só aguardando o prazo (sleep)
+        pending = list(self._buffers.items())
+        self._buffers.clear()
+
+        if pending:
+            logger.info(f"⏩ Processando {len(pending)} buffers pendentes antes de encerrar")
+
+        for from_number, buffer in pending:
+            if buffer.task:
+                buffer.task.cancel()
+            try:
+                previous = self._inflight.get(from_number)
+                if previous is not None and not previous.done():
+                    await asyncio.wait({previous})
+                await self._flush(from_number, buffer)
+            except Exception as e:
+                logger.error(f"Erro ao processar buffer de {from_number}: {str(e)}", exc_info=True)
+
+    def abandon(self, should_abandon: Callable[[str], bool]) -> List[int]:
+        """
+        Descarta as rajadas ainda aguardando o prazo dos remetentes escolhidos
+
+        Usado quando o worker perde a posse das partições: as mensagens não
+        são processadas aqui, e os ids da fila durável retornados devem voltar
+        para 'pending' (o novo dono as processa). Rajadas já em processamento
+        não são interrompidas.
+
+        Args:
+            should_abandon: Recebe o remetente e diz se a rajada dele é descartada
+
+        Returns:
+            ids da fila durável das mensagens descartadas
+        """
+        queue_ids = []
+        for from_number in [sender for sender in self._buffers if should_abandon(sender)]:
+            buffer = self._buffers.pop(from_number)
+            if buffer.task:
+                buffer.task.cancel()
+            queue_ids.extend(buffer.queue_ids)
+
+        if queue_ids:
+            logger.info(f"↩️ {len(queue_ids)} mensagens acumuladas devolvidas para a fila")
+        return queue_ids
+
+    def active_senders(self) -> List[str]:
+        """Remetentes com mensagens acumuladas ou em processamento"""
+        return list(self._buffers.keys() | self._inflight.keys())
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas do buffer"""
+        return {
+            "pending_senders": len(self._buffers),
+            "pending_messages": sum(len(b.messages) for b in self._buffers.values()),
+            "inflight_senders": len(self._inflight),
+            "received": self._received,
+            "flushes": self._flushes,
+            "early_flushes": self._early_flushes,
+            "avg_wait_s": round(self._wait_total / self._flushes, 2) if self._flushes else 0.0
+        }
@@ -0,0 +1,134 @@
+"""
+Divisão da resposta do agente em mensagens curtas de WhatsApp
+
+Regras (as mesmas de sempre do send_message_in_parts):
+    - cada parágrafo (separado por linha em branco) vira uma mensagem
+    - sem nenhuma linha em branco, cada linha vira uma mensagem
+    - partes com mais de MAX_PART_LENGTH caracteres são quebradas em frases,
+      agrupadas até o limite
+
+split_message() divide uma resposta completa. StreamingSplitter aplica as
+mesmas regras a uma resposta que chega aos pedaços (streaming do agente) e
+devolve cada parte assim que ela está completa.
+"""
+
+import re
+from typing import List
+
+MAX_PART_LENGTH = 200
+
+PARAGRAPH_RE = re.compile(r'\n\s*\n')
+# Quebra simples já confirmada: a próxima linha começou com texto
+LINE_BREAK_RE = re.compile(r'\n(?=[ \t]*\S)')
+SENTENCE_SPLIT_RE = re.compile(r'([.!?])\s+')
+
+
+def split_long_part(part: str, max_length: int = MAX_PART_LENGTH) -> List[str]:
+    """Quebra uma parte longa em grupos de frases de até max_length caracteres"""
+    if len(part) <= max_length:
+        return [part]
+
+    parts = []
+    sentences = SENTENCE_SPLIT_RE.split(part)
+    current = ""
+    for i in range(0, len(sentences), 2):
+        sentence = sentences[i]
+        punct = sentences[i + 1] if i + 1 < len(sentences) else ""
+
+        if len(current) + len(sentence) > max_length and current:
+            parts.append(current.strip())
+            current = sentence + punct + " "
+        else:
+            current += sentence + punct + " "
+
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def split_message(message: str, max_length: int = MAX_PART_LENGTH) -> List[str]:
+    """
+    Divide uma resposta completa em partes para envio
+
+    Args:
+        message: Resposta do agente
+        max_length: Tamanho máximo de cada parte antes de quebrar em frases
+
+    Returns:
+        Lista de partes (sem partes vazias)
+    """
+    # Dividir por quebras de linha duplas (parágrafos) - cada um vira mensagem separada
+    parts = PARAGRAPH_RE.split(message.strip())
+
+    # Se não houver quebras duplas, dividir por linha simples
+    if len(parts) == 1:
+        parts = message.split('\n')
+
+    final_parts = []
+    for part in parts:
+        part = part.strip()
+        if part:
+            final_parts.extend(split_long_part(part, max_length))
+    return final_parts
+
+
+class StreamingSplitter:
+    """
+    Divide incrementalmente uma resposta recebida em pedaços
+
+    Diferença em relação a split_message(): antes da primeira linha em branco
+    não dá para saber se a resposta terá parágrafos, então cada linha simples
+    já é enviada como mensagem própria.
+    """
+
+    def __init__(self, max_length: int = MAX_PART_LENGTH):
+        self.max_length = max_length
+        self._buffer = ""
+        self._has_paragraphs = False
+
+    def _emit(self, text: str) -> List[str]:
+        text = text.strip()
+        return split_long_part(text, self.max_length) if text else []
+
+    def feed(self, chunk: str) -> List[str]:
+        """
+        Acrescenta um pedaço da resposta
+
+        Returns:
+            Partes que ficaram completas com este pedaço
+        """
+        self._buffer += chunk
+        parts = []
+
+        while True:
+            match = PARAGRAPH_RE.search(self._buffer)
+            if match:
+                self._has_paragraphs = True
+            elif not self._has_paragraphs:
+                match = LINE_BREAK_RE.search(self._buffer)
+            if not match:
+                break
+            parts.extend(self._emit(self._buffer[:match.start()]))
+            self._buffer = self._buffer[match.end():]
+
+        # Parágrafo longo ainda sem fim: envia os grupos de frases já fechados
+        if len(self._buffer.strip()) > self.max_length:
+            # Só frases já seguidas de texto: espaço no fim ainda pode virar parágrafo
+            complete_end = 0
+            for match in SENTENCE_SPLIT_RE.finditer(self._buffer):
+                if match.end() < len(self._buffer):
+                    complete_end = match.end()
+            if complete_end:
+                groups = split_long_part(self._buffer[:complete_end].strip(), self.max_length)
+                if len(groups) > 1:
+                    # O último grupo ainda pode receber as próximas frases
+                    parts.extend(groups[:-1])
+                    self._buffer = groups[-1] + " " + self._buffer[complete_end:]
+
+        return parts
+
+    def finish(self) -> List[str]:
+        """Partes restantes no fim da resposta"""
+        parts = self._emit(self._buffer)
+        self._buffer = ""
+        return parts
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Migrações únicas do banco (bancos criados antes do init.sql atual)
+
+Bancos novos já nascem com tudo isso pelo init.sql. Em bancos antigos as
+migrações abaixo precisam rodar UMA vez - algumas são destrutivas (remoção
+de linhas duplicadas) e não devem rodar a cada startup de cada worker:
+
+    - 001: tabela customer_memories
+    - 002: uma linha por cliente em user_preferences/customer_context
+           (remove duplicatas e cria os índices únicos dos upserts)
+    - 003: FK de customer_memories com ON DELETE CASCADE
+    - 004: memórias antigas em customer_context.notes -> customer_memories
+
+As migrações aplicadas ficam em schema_migrations e a execução inteira é
+serializada por pg_advisory_lock: rodar o script em paralelo (ou de novo)
+não repete nada.
+
+Uso:
+    python migrar_banco.py
+"""
+import sys
+import json
+import logging
+from typing import Any, Dict, List
+
+import psycopg2
+from psycopg2.extras import Json, execute_values
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from db_pool import DB_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Chave do advisory lock das migrações (mesmo valor em todos os processos)
+MIGRATIONS_LOCK_KEY = 5351
+
+MIGRATIONS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version VARCHAR(100) PRIMARY KEY,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+# Memórias importantes: um objeto JSONB por cliente ({chave: {value, updated_at}})
+MEMORY_SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS customer_memories (
+        customer_id INTEGER PRIMARY KEY REFERENCES customers(id) ON DELETE CASCADE,
+        memories JSONB NOT NULL DEFAULT '{}'::jsonb,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_customer_memories_memories
+        ON customer_memories USING GIN (memories);
+"""
+
+# Uma linha por cliente em user_preferences/customer_context: permite os
+# upserts de uma instrução (ON CONFLICT (customer_id)). Duplicatas antigas
+# são removidas antes, mantendo a linha mais antiga (a que as leituras usam).
+UNIQUE_CUSTOMER_ROWS_SQL = """
+    DELETE FROM user_preferences a
+    USING user_preferences b
+    WHERE a.customer_id = b.customer_id AND a.id > b.id;
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_user_preferences_customer
+        ON user_preferences(customer_id);
+
+    DELETE FROM customer_context a
+    USING customer_context b
+    WHERE a.customer_id = b.customer_id AND a.id > b.id;
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_customer_context_customer
+        ON customer_context(customer_id);
+"""
+
+# Tabelas criadas por versões anteriores não tinham o ON DELETE CASCADE
+MEMORIES_CASCADE_SQL = """
+    ALTER TABLE customer_memories
+        DROP CONSTRAINT IF EXISTS customer_memories_customer_id_fkey;
+    ALTER TABLE customer_memories
+        ADD CONSTRAINT customer_memories_customer_id_fkey
+        FOREIGN KEY (customer_id) REFERENCES customers(id) ON DELETE CASCADE;
+"""
+
+
+def migrate_legacy_notes(cur) -> int:
+    """
+    Move as memórias guardadas como JSON em customer_context.notes
+
+    Versões anteriores guardavam as memórias em notes (o mesmo campo que
+    update_customer_context sobrescreve com texto livre). Esses JSONs são
+    mesclados em customer_memories e notes volta a ser só texto livre.
+
+    Args:
+        cur: Cursor da transação da migração
+
+    Returns:
+        Quantidade de clientes com memórias migradas
+    """
+    cur.execute("SELECT id, customer_id, notes FROM customer_context WHERE notes LIKE '{%'")
+
+    legacy: Dict[int, Dict[str, Any]] = {}
+    migrated_ids = []
+    for row_id, customer_id, notes in cur.fetchall():
+        try:
+            memories = json.loads(notes)
+        except ValueError:
+            continue
+        if isinstance(memories, dict) and customer_id is not None:
+            legacy.setdefault(customer_id, {}).update(memories)
+            migrated_ids.append(row_id)
+
+    if legacy:
+        # Memórias já gravadas na tabela nova prevalecem sobre as antigas
+        execute_values(cur, """
+            INSERT INTO customer_memories (customer_id, memories)
+            VALUES %s
+            ON CONFLICT (customer_id) DO UPDATE
+            SET memories = EXCLUDED.memories || customer_memories.memories
+        """, [(customer_id, Json(memories)) for customer_id, memories in legacy.items()])
+        cur.execute("UPDATE customer_context SET notes = NULL WHERE id = ANY(%s)", (migrated_ids,))
+        logger.info(f"🧠 Memórias de {len(legacy)} clientes migradas para customer_memories")
+    return len(legacy)
+
+
+# (versão, SQL ou função que recebe o cursor) - sempre acrescentar no final
+MIGRATIONS = [
+    ("001_customer_memories", MEMORY_SCHEMA_SQL),
+    ("002_unique_customer_rows", UNIQUE_CUSTOMER_ROWS_SQL),
+    ("003_customer_memories_cascade", MEMORIES_CASCADE_SQL),
+    ("004_legacy_notes_memories", migrate_legacy_notes),
+]
+
+
+def run_migrations(conn_params: Dict[str, Any] = None) -> List[str]:
+    """
+    Aplica as migrações pendentes (cada uma em sua transação)
+
+    Args:
+        conn_params: Parâmetros de conexão (padrão: DB_CONFIG)
+
+    Returns:
+        Versões aplicadas nesta execução
+    """
+    conn = psycopg2.connect(**(conn_params or DB_CONFIG))
+    applied = []
+    try:
+        with conn.cursor() as cur:
+            # Lock de sessão: outro processo migrando espera aqui
+            cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_KEY,))
+            cur.execute(MIGRATIONS_TABLE_SQL)
+            conn.commit()
+
+            for version, migration in MIGRATIONS:
+                cur.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (version,))
+                if cur.fetchone():
+                    continue
+                try:
+                    if callable(migration):
+                        migration(cur)
+                    else:
+                        cur.execute(migration)
+                    cur.execute("INSERT INTO schema_migrations (version) VALUES (%s)", (version,))
+                    conn.commit()
+                except psycopg2.Error:
+                    conn.rollback()
+                    logger.error(f"❌ Migração {version} falhou")
+                    raise
+                applied.append(version)
+                logger.info(f"✅ Migração aplicada: {version}")
+
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_KEY,))
+            conn.commit()
+    finally:
+        # Fechar a conexão também libera o advisory lock
+        conn.close()
+    return applied
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    try:
+        applied = run_migrations()
+    except psycopg2.Error as e:
+        print(f"❌ Erro ao migrar o banco: {e}")
+        return 1
+    if applied:
+        print(f"✅ {len(applied)} migrações aplicadas: {', '.join(applied)}")
+    else:
+        print("✅ Banco já está atualizado")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
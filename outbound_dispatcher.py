@@ -0,0 +1,387 @@
+"""
+Despacho das mensagens enviadas ao WhatsApp
+
+O handler da mensagem só enfileira as partes da resposta e segue em frente;
+o envio fica com este despachante:
+
+    - fila FIFO por destinatário: partes de rodadas diferentes do mesmo
+      cliente nunca se intercalam
+    - pausa "humana" entre partes do mesmo destinatário (3-6 s conforme o
+      tamanho) imposta pelo despachante, sem bloquear o handler
+    - token bucket global (OUTBOUND_RATE mensagens/s, rajada OUTBOUND_BURST)
+      contra o whatsapp-service - um lote consome um token por parte
+    - partes que se acumularam na fila do destinatário vão juntas em uma
+      requisição /send-batch (até OUTBOUND_BATCH_MAX), com as pausas entre
+      elas feitas pelo próprio whatsapp-service
+    - novas tentativas com backoff exponencial em erros de rede, 429 e 5xx;
+      cada parte leva uma chave de idempotência fixa entre tentativas, e o
+      whatsapp-service não reenvia uma chave que já saiu (timeout do nosso
+      lado com o envio concluído do lado dele não duplica a mensagem)
+    - registro de entrega (status, tentativas, erro) em outbound_deliveries,
+      gravado em lote pelo history_writer
+"""
+
+import os
+import time
+import uuid
+import random
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+import httpx
+
+from history_writer import history_writer
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS outbound_deliveries (
+        id BIGSERIAL PRIMARY KEY,
+        to_number VARCHAR(100) NOT NULL,
+        message TEXT,
+        status VARCHAR(20) NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        queued_at TIMESTAMP,
+        sent_at TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_outbound_deliveries_to
+        ON outbound_deliveries(to_number, queued_at);
+    CREATE INDEX IF NOT EXISTS idx_outbound_deliveries_status
+        ON outbound_deliveries(status);
+"""
+
+
+def human_delay(part: str) -> float:
+    """Pausa depois de enviar uma parte (3-6 segundos para parecer humano)"""
+    return min(3 + (len(part) / 100), 6)
+
+
+class TokenBucket:
+    """Limite global de envios: `rate` por segundo com rajada de até `burst`"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int = 1) -> float:
+        """
+        Aguarda `tokens` tokens (um por mensagem enviada)
+
+        Pedidos maiores que a rajada esperam o balde encher e deixam o saldo
+        negativo - quem vem depois espera a diferença.
+
+        Returns:
+            Segundos esperados
+        """
+        needed = min(tokens, self.burst)
+        waited = 0.0
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= needed:
+                    self._tokens -= tokens
+                    return waited
+                wait = (needed - self._tokens) / self.rate
+                waited += wait
+                await asyncio.sleep(wait)
+
+
+class _Outgoing:
+    """Parte de resposta aguardando envio"""
+
+    __slots__ = ("to", "text", "delay_after", "key", "queued_at", "queued_wall", "future")
+
+    def __init__(self, to: str, text: str, delay_after: float, future: asyncio.Future):
+        self.to = to
+        self.text = text
+        self.delay_after = delay_after
+        # Chave de idempotência: a mesma em todas as tentativas desta parte
+        self.key = uuid.uuid4().hex
+        self.queued_at = time.monotonic()
+        self.queued_wall = datetime.now()
+        self.future = future
+
+
+class OutboundDispatcher:
+    """Fila de envio por destinatário com limite global e novas tentativas"""
+
+    def __init__(self):
+        self.rate = float(os.getenv("OUTBOUND_RATE", "5"))
+        self.burst = int(os.getenv("OUTBOUND_BURST", "10"))
+        self.max_attempts = int(os.getenv("OUTBOUND_MAX_ATTEMPTS", "4"))
+        self.retry_base = float(os.getenv("OUTBOUND_RETRY_BASE", "1.0"))
+        self.drain_timeout = float(os.getenv("OUTBOUND_DRAIN_TIMEOUT", "30"))
+        self.batch_enabled = os.getenv("OUTBOUND_BATCH", "true").lower() == "true"
+        self.batch_max = int(os.getenv("OUTBOUND_BATCH_MAX", "10"))
+
+        self._bucket = TokenBucket(self.rate, self.burst)
+        self._queues: Dict[str, Deque[_Outgoing]] = {}
+        # Partes retiradas da fila e sendo enviadas agora, por destinatário
+        self._sending: Dict[str, List[_Outgoing]] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._draining = False
+
+        # Métricas
+        self._queued = 0
+        self._sent = 0
+        self._failed = 0
+        self._retries = 0
+        self._batches = 0
+        self._duplicates = 0
+        self._rate_wait_total = 0.0
+        self._queue_time_total = 0.0
+
+    async def ensure_schema(self):
+        """Cria a tabela de registro de entregas caso não exista"""
+        from customer_repository import customer_repository
+
+        pool = await customer_repository.get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(SCHEMA_SQL)
+
+    @staticmethod
+    def _recipient(to: str) -> str:
+        return to.replace("@c.us", "").replace("@s.whatsapp.net", "")
+
+    def send(self, to: str, text: str, delay_after: float = None) -> asyncio.Future:
+        """
+        Enfileira uma mensagem para o destinatário
+
+        Args:
+            to: Número do destinatário
+            text: Texto da mensagem
+            delay_after: Pausa antes da próxima mensagem ao mesmo destinatário
+                         (padrão: human_delay(text))
+
+        Returns:
+            Future com o registro de entrega ({status, attempts, error, ...}) -
+            nunca termina com exceção; aguardar é opcional
+        """
+        recipient = self._recipient(to)
+        future = asyncio.get_running_loop().create_future()
+        item = _Outgoing(recipient, text, human_delay(text) if delay_after is None else delay_after, future)
+
+        self._queues.setdefault(recipient, deque()).append(item)
+        self._queued += 1
+        if recipient not in self._workers:
+            self._workers[recipient] = asyncio.create_task(self._drain(recipient))
+        return future
+
+    async def _drain(self, recipient: str):
+        """Envia a fila de um destinatário, em ordem, respeitando as pausas"""
+        queue = self._queues[recipient]
+        ready_at = 0.0
+
+        try:
+            while True:
+                if not queue:
+                    # Mantém a pausa da última parte para a próxima rodada do cliente
+                    wait = ready_at - time.monotonic()
+                    if wait > 0 and not self._draining:
+                        await asyncio.sleep(min(wait, 0.5))
+                        continue
+                    break
+
+                wait = ready_at - time.monotonic()
+                if wait > 0 and not self._draining:
+                    await asyncio.sleep(wait)
+
+                if self.batch_enabled and len(queue) > 1:
+                    items = [queue.popleft() for _ in range(min(self.batch_max, len(queue)))]
+                    self._sending[recipient] = items
+                    await self._deliver_batch(list(items))
+                else:
+                    items = [queue.popleft()]
+                    self._sending[recipient] = items
+                    await self._deliver(items[0])
+                self._sending.pop(recipient, None)
+                ready_at = time.monotonic() + items[-1].delay_after
+        finally:
+            self._workers.pop(recipient, None)
+            for item in self._sending.pop(recipient, []):
+                if not item.future.done():
+                    self._record(item, "failed", 0, "cancelado no desligamento")
+            if not queue:
+                self._queues.pop(recipient, None)
+            else:
+                # Cancelado com itens pendentes (desligamento): registra como não enviados
+                while queue:
+                    item = queue.popleft()
+                    self._record(item, "failed", 0, "cancelado no desligamento")
+
+    async def _deliver(self, item: _Outgoing) -> Dict[str, Any]:
+        """Envia uma mensagem com novas tentativas e registra a entrega"""
+        from whatsapp_integration import whatsapp_client
+
+        self._queue_time_total += time.monotonic() - item.queued_at
+        error = None
+
+        for attempt in range(1, self.max_attempts + 1):
+            self._rate_wait_total += await self._bucket.acquire()
+            try:
+                result = await whatsapp_client.send_text(item.to, item.text, idempotency_key=item.key)
+                if result.get("duplicate"):
+                    # Tentativa anterior já tinha saído (ex: timeout na resposta)
+                    self._duplicates += 1
+                self._sent += 1
+                return self._record(item, "sent", attempt)
+            except httpx.HTTPStatusError as e:
+                error = f"HTTP {e.response.status_code}"
+                status_code = e.response.status_code
+                if status_code < 500 and status_code != 429:
+                    break
+            except httpx.HTTPError as e:
+                error = f"{type(e).__name__}: {e}"
+            except Exception as e:
+                # Resposta inesperada do serviço: não adianta repetir
+                error = f"{type(e).__name__}: {e}"
+                break
+
+            if attempt < self.max_attempts:
+                self._retries += 1
+                backoff = self.retry_base * (2 ** (attempt - 1)) * (0.5 + random.random())
+                logger.warning(f"🔁 Envio para {item.to} falhou ({error}) - nova tentativa em {backoff:.1f}s")
+                await asyncio.sleep(backoff)
+
+        self._failed += 1
+        logger.error(f"❌ Mensagem para {item.to} não entregue após {attempt} tentativa(s): {error}")
+        return self._record(item, "failed", attempt, error)
+
+    async def _deliver_batch(self, items: List[_Outgoing]):
+        """
+        Envia várias partes do mesmo destinatário em uma requisição
+
+        O whatsapp-service para na primeira parte que falhar e informa quantas
+        foram enviadas; só as restantes são repetidas. Cada parte consome um
+        token e leva sua chave de idempotência: repetir um lote cuja resposta
+        se perdeu não reenvia as partes que já saíram.
+        """
+        from whatsapp_integration import whatsapp_client
+
+        now = time.monotonic()
+        for item in items:
+            self._queue_time_total += now - item.queued_at
+        error = None
+
+        for attempt in range(1, self.max_attempts + 1):
+            self._rate_wait_total += await self._bucket.acquire(len(items))
+            try:
+                # No desligamento a fila é esvaziada sem as pausas
+                delays = [0.0 if self._draining else item.delay_after for item in items]
+                result = await whatsapp_client.send_batch(
+                    items[0].to, [item.text for item in items], delays, keys=[item.key for item in items]
+                )
+                self._batches += 1
+                self._duplicates += int(result.get("duplicates", 0))
+
+                sent = min(int(result.get("sent", 0)), len(items))
+                for item in items[:sent]:
+                    self._sent += 1
+                    self._record(item, "sent", attempt)
+                items = items[sent:]
+                if not items:
+                    return
+                error = result.get("error") or "lote enviado parcialmente"
+            except httpx.HTTPStatusError as e:
+                error = f"HTTP {e.response.status_code}"
+                status_code = e.response.status_code
+                if status_code < 500 and status_code != 429:
+                    break
+            except httpx.HTTPError as e:
+                error = f"{type(e).__name__}: {e}"
+            except Exception as e:
+                # Resposta inesperada do serviço: não adianta repetir
+                error = f"{type(e).__name__}: {e}"
+                break
+
+            if attempt < self.max_attempts:
+                self._retries += 1
+                backoff = self.retry_base * (2 ** (attempt - 1)) * (0.5 + random.random())
+                logger.warning(
+                    f"🔁 Lote para {items[0].to} falhou ({error}) - "
+                    f"{len(items)} partes em nova tentativa em {backoff:.1f}s"
+                )
+                await asyncio.sleep(backoff)
+
+        logger.error(f"❌ {len(items)} mensagens para {items[0].to} não entregues após {attempt} tentativa(s): {error}")
+        for item in items:
+            self._failed += 1
+            self._record(item, "failed", attempt, error)
+
+    def _record(self, item: _Outgoing, status: str, attempts: int, error: str = None) -> Dict[str, Any]:
+        """Registro de entrega (memória + outbound_deliveries via history_writer)"""
+        sent_at = datetime.now() if status == "sent" else None
+        history_writer.log_delivery(item.to, item.text, status, attempts, error, item.queued_wall, sent_at)
+        record = {
+            "to": item.to,
+            "status": status,
+            "attempts": attempts,
+            "error": error,
+            "queued_at": item.queued_wall.isoformat(),
+            "sent_at": sent_at.isoformat() if sent_at else None
+        }
+        if not item.future.done():
+            item.future.set_result(record)
+        return record
+
+    def deliveries(self, to: str) -> List[asyncio.Future]:
+        """
+        Futures de entrega de tudo que está na fila ou sendo enviado ao destinatário
+
+        Usado para confirmar a mensagem recebida (inbound_queue) só depois
+        que a resposta saiu.
+        """
+        recipient = self._recipient(to)
+        items = list(self._sending.get(recipient, ())) + list(self._queues.get(recipient, ()))
+        return [item.future for item in items]
+
+    def pending(self, to: str = None) -> int:
+        """Mensagens aguardando envio (de um destinatário ou de todos)"""
+        if to is not None:
+            return len(self._queues.get(self._recipient(to), ()))
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def stop(self):
+        """Envia o que está na fila sem as pausas (até OUTBOUND_DRAIN_TIMEOUT)"""
+        self._draining = True
+        workers = list(self._workers.values())
+        if not workers:
+            return
+
+        done, pending = await asyncio.wait(workers, timeout=self.drain_timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.warning(f"⚠️ {len(pending)} filas de envio canceladas no desligamento")
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas de envio"""
+        delivered = self._sent + self._failed
+        return {
+            "rate_per_s": self.rate,
+            "burst": self.burst,
+            "queued": self._queued,
+            "pending": self.pending(),
+            "active_recipients": len(self._workers),
+            "sent": self._sent,
+            "failed": self._failed,
+            "retries": self._retries,
+            "batches": self._batches,
+            "duplicates_skipped": self._duplicates,
+            "queue_time_avg_ms": round(self._queue_time_total / delivered * 1000, 1) if delivered else 0.0,
+            "rate_wait_total_s": round(self._rate_wait_total, 2)
+        }
+
+
+# Instância global
+outbound_dispatcher = OutboundDispatcher()
@@ -0,0 +1,284 @@
+"""
+Particionamento de clientes entre workers/réplicas do bot
+
+Cada mensagem recebida cai em uma partição fixa (hash do telefone). Cada
+partição tem um único dono por vez, então todas as mensagens de um cliente
+são juntadas, respondidas e enviadas pelo mesmo worker, em ordem.
+
+- Workers registram heartbeat na tabela bot_workers
+- O dono de cada partição é escolhido por rendezvous hashing entre os
+  workers vivos - quando um worker entra ou sai, só as partições dele mudam
+- A posse é garantida por advisory locks do PostgreSQL em uma conexão
+  dedicada: se o worker morrer, a conexão cai e os locks são liberados
+- Um worker só solta uma partição quando não há mensagens dela em andamento
+- Se a conexão cai, os locks já foram perdidos: as rajadas acumuladas dessas
+  partições são abandonadas (voltam para 'pending') antes de reconectar
+- Mensagens recebidas por quem não é dono ficam 'pending' na fila durável e
+  o dono é avisado via NOTIFY (ver inbound_queue.enqueue)
+
+Desativado por padrão (WORKER_PARTITIONING=false): um único processo é dono
+de tudo.
+"""
+
+import os
+import zlib
+import hashlib
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+import asyncpg
+
+from db_pool import DB_CONFIG
+from customer_manager import customer_manager
+from inbound_queue import inbound_queue, NOTIFY_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+# Namespace dos advisory locks (pg_try_advisory_lock(namespace, partição))
+LOCK_NAMESPACE = 5350
+
+SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS bot_workers (
+        worker_id VARCHAR(255) PRIMARY KEY,
+        started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+
+class PartitionManager:
+    """Distribui partições de clientes entre os workers vivos"""
+
+    def __init__(self):
+        self.enabled = os.getenv("WORKER_PARTITIONING", "false").lower() in ("1", "true", "yes")
+        self.partitions = int(os.getenv("WORKER_PARTITIONS", "64"))
+        self.heartbeat_interval = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", "5"))
+        self.worker_ttl = float(os.getenv("WORKER_TTL", "20"))
+        self.worker_id = inbound_queue.worker_id
+
+        # Conexão dedicada: segura os advisory locks e escuta NOTIFY
+        self._conn: Optional[asyncpg.Connection] = None
+        self._owned: Set[int] = set()
+        self._pins: Dict[int, int] = {}
+        self._live_workers: List[str] = [self.worker_id]
+        self._task: Optional[asyncio.Task] = None
+
+        self._on_ready: Optional[Callable[[List[int]], None]] = None
+        self._is_busy: Optional[Callable[[int], bool]] = None
+        self._on_lost: Optional[Callable[[List[int]], Awaitable[None]]] = None
+
+        # Métricas
+        self._rebalances = 0
+        self._acquired = 0
+        self._released = 0
+        self._lost = 0
+
+    def partition_of(self, from_number: str) -> int:
+        """Partição fixa de um remetente (estável entre processos)"""
+        phone = customer_manager.normalize_phone(from_number) or from_number
+        return zlib.crc32(phone.encode("utf-8")) % self.partitions
+
+    def owns(self, partition: int) -> bool:
+        """True se este worker é o dono da partição"""
+        return not self.enabled or partition in self._owned
+
+    def owned_partitions(self) -> Optional[List[int]]:
+        """Partições deste worker (None = todas, modo sem particionamento)"""
+        if not self.enabled:
+            return None
+        return sorted(self._owned)
+
+    def pin(self, partition: int):
+        """Impede que a partição seja liberada enquanto uma mensagem entra"""
+        self._pins[partition] = self._pins.get(partition, 0) + 1
+
+    def unpin(self, partition: int):
+        """Desfaz pin()"""
+        count = self._pins.get(partition, 0) - 1
+        if count > 0:
+            self._pins[partition] = count
+        else:
+            self._pins.pop(partition, None)
+
+    @staticmethod
+    def _weight(worker_id: str, partition: int) -> int:
+        """Peso do par (worker, partição) no rendezvous hashing"""
+        digest = hashlib.md5(f"{worker_id}:{partition}".encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big")
+
+    def _desired(self, workers: List[str]) -> Set[int]:
+        """Partições que devem ser deste worker (rendezvous hashing)"""
+        desired = set()
+        for partition in range(self.partitions):
+            owner = max(workers, key=lambda w: self._weight(w, partition))
+            if owner == self.worker_id:
+                desired.add(partition)
+        return desired
+
+    async def start(self, on_ready: Callable[[List[int]], None], is_busy: Callable[[int], bool],
+                    on_lost: Optional[Callable[[List[int]], Awaitable[None]]] = None):
+        """
+        Conecta, registra o worker e inicia o rebalanceamento periódico
+
+        Args:
+            on_ready: Chamado com partições que acabaram de ficar sob posse
+                      deste worker ou que receberam mensagens novas
+            is_busy: Diz se há mensagens da partição em andamento localmente
+            on_lost: Chamado com partições perdidas sem aviso (conexão caiu)
+                     para abandonar o trabalho local delas
+        """
+        if not self.enabled:
+            return
+
+        self._on_ready = on_ready
+        self._is_busy = is_busy
+        self._on_lost = on_lost
+
+        await self._connect()
+        await self._rebalance()
+        self._task = asyncio.create_task(self._loop())
+        logger.info(f"🧩 Particionamento ativo: worker {self.worker_id} com {len(self._owned)}/{self.partitions} partições")
+
+    async def _connect(self):
+        """Abre a conexão dedicada (locks + LISTEN)"""
+        self._conn = await asyncpg.connect(
+            host=DB_CONFIG["host"],
+            port=DB_CONFIG["port"],
+            database=DB_CONFIG["database"],
+            user=DB_CONFIG["user"],
+            password=DB_CONFIG["password"]
+        )
+        await self._conn.execute(SCHEMA_SQL)
+        await self._conn.add_listener(NOTIFY_CHANNEL, self._on_notify)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        """NOTIFY de mensagem nova em uma partição"""
+        try:
+            partition = int(payload)
+        except ValueError:
+            return
+
+        if partition in self._owned and self._on_ready:
+            self._on_ready([partition])
+
+    async def _heartbeat(self) -> List[str]:
+        """Atualiza o heartbeat e retorna os workers vivos"""
+        await self._conn.execute("""
+            INSERT INTO bot_workers (worker_id, last_seen)
+            VALUES ($1, CURRENT_TIMESTAMP)
+            ON CONFLICT (worker_id) DO UPDATE SET last_seen = CURRENT_TIMESTAMP
+        """, self.worker_id)
+
+        # Limpar workers mortos há muito tempo
+        await self._conn.execute("""
+            DELETE FROM bot_workers
+            WHERE last_seen < CURRENT_TIMESTAMP - make_interval(secs => $1)
+        """, self.worker_ttl * 10)
+
+        rows = await self._conn.fetch("""
+            SELECT worker_id FROM bot_workers
+            WHERE last_seen > CURRENT_TIMESTAMP - make_interval(secs => $1)
+            ORDER BY worker_id
+        """, self.worker_ttl)
+
+        workers = [row["worker_id"] for row in rows]
+        return workers or [self.worker_id]
+
+    async def _rebalance(self):
+        """Solta partições que não são mais deste worker e pega as novas"""
+        workers = await self._heartbeat()
+        if workers != self._live_workers:
+            logger.info(f"🧩 Workers vivos: {len(workers)} - rebalanceando partições")
+            self._live_workers = workers
+            self._rebalances += 1
+
+        desired = self._desired(workers)
+
+        # Soltar só partições sem trabalho em andamento (preserva a ordem por cliente)
+        for partition in sorted(self._owned - desired):
+            if self._pins.get(partition) or (self._is_busy and self._is_busy(partition)):
+                continue
+            await self._conn.execute("SELECT pg_advisory_unlock($1, $2)", LOCK_NAMESPACE, partition)
+            self._owned.discard(partition)
+            self._released += 1
+
+        newly_owned = []
+        for partition in sorted(desired - self._owned):
+            locked = await self._conn.fetchval(
+                "SELECT pg_try_advisory_lock($1, $2)", LOCK_NAMESPACE, partition
+            )
+            if locked:
+                self._owned.add(partition)
+                newly_owned.append(partition)
+                self._acquired += 1
+
+        if newly_owned and self._on_ready:
+            self._on_ready(newly_owned)
+
+    async def _loop(self):
+        """Heartbeat + rebalanceamento periódico, reconectando se preciso"""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                if self._conn is None or self._conn.is_closed():
+                    # Os advisory locks morreram junto com a conexão
+                    logger.warning("🧩 Conexão de particionamento perdida - reconectando")
+                    await self._drop_owned()
+                    await self._connect()
+                await self._rebalance()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Erro no rebalanceamento de partições: {e}")
+
+    async def _drop_owned(self):
+        """Esquece as partições cujos locks se perderam e abandona o trabalho local"""
+        lost = sorted(self._owned)
+        # Sem posse, mensagens novas dessas partições vão para a fila como 'pending'
+        self._owned.clear()
+        if not lost:
+            return
+
+        self._lost += len(lost)
+        if self._on_lost:
+            try:
+                await self._on_lost(lost)
+            except Exception as e:
+                logger.error(f"Erro ao abandonar o trabalho das partições {lost}: {e}")
+
+    async def stop(self):
+        """Para o rebalanceamento e solta todas as partições"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self._conn is not None and not self._conn.is_closed():
+            try:
+                await self._conn.execute("DELETE FROM bot_workers WHERE worker_id = $1", self.worker_id)
+            finally:
+                # Fechar a conexão libera todos os advisory locks
+                await self._conn.close()
+        self._owned.clear()
+
+    def stats(self) -> Dict[str, object]:
+        """Métricas de particionamento"""
+        return {
+            "enabled": self.enabled,
+            "worker_id": self.worker_id,
+            "partitions": self.partitions,
+            "owned": len(self._owned) if self.enabled else self.partitions,
+            "live_workers": len(self._live_workers),
+            "rebalances": self._rebalances,
+            "acquired": self._acquired,
+            "released": self._released,
+            "lost": self._lost
+        }
+
+
+# Instância global
+partition_manager = PartitionManager()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Benchmark de contenção: SELECT-then-INSERT x UPSERT de uma instrução
+
+Dispara N chamadas simultâneas para o MESMO telefone / cliente e compara:
+    - antes: SELECT e depois INSERT/UPDATE (como era o código)
+    - depois: customer_manager.get_or_create_customer e
+      SPDropMemoryTools.update_customer_preferences (INSERT ... ON CONFLICT)
+
+Mostra instruções SQL por chamada, erros, clientes/linhas duplicadas e tempo.
+Os registros de teste são apagados no final.
+
+Uso (com o Postgres do docker-compose no ar):
+    python teste_concorrencia_upsert.py [threads]
+"""
+import sys
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import customer_manager as customer_manager_module
+import tools.memory_tools as memory_tools_module
+from customer_manager import customer_manager
+from migrar_banco import run_migrations
+from tools.memory_tools import SPDropMemoryTools
+from db_pool import db_pool
+
+THREADS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+_lock = threading.Lock()
+_statements = 0
+
+
+class CountingCursor(RealDictCursor):
+    """RealDictCursor que conta as instruções enviadas ao banco"""
+
+    def execute(self, query, vars=None):
+        global _statements
+        with _lock:
+            _statements += 1
+        return super().execute(query, vars)
+
+
+# As duas implementações passam a usar o cursor que conta instruções
+customer_manager_module.RealDictCursor = CountingCursor
+memory_tools_module.RealDictCursor = CountingCursor
+
+
+def antigo_get_or_create_customer(phone):
+    """Versão anterior: SELECT e, se não achou, INSERT"""
+    conn = db_pool.getconn()
+    try:
+        with conn.cursor(cursor_factory=CountingCursor) as cur:
+            cur.execute("SELECT id, name, phone FROM customers WHERE phone = %s", (phone,))
+            customer = cur.fetchone()
+            if customer:
+                return customer['id']
+            cur.execute("""
+                INSERT INTO customers (name, phone) VALUES (%s, %s) RETURNING id, name
+            """, (f"Cliente {phone[-4:]}", phone))
+            conn.commit()
+            return cur.fetchone()['id']
+    except psycopg2.Error:
+        conn.rollback()
+        return None
+    finally:
+        conn.close()
+
+
+def antigo_update_customer_preferences(customer_id):
+    """Versão anterior: SELECT id e depois UPDATE ou INSERT"""
+    conn = db_pool.getconn()
+    try:
+        with conn.cursor(cursor_factory=CountingCursor) as cur:
+            cur.execute("SELECT id FROM user_preferences WHERE customer_id = %s", (customer_id,))
+            if cur.fetchone():
+                cur.execute("""
+                    UPDATE user_preferences
+                    SET conversation_count = conversation_count + 1, updated_at = CURRENT_TIMESTAMP
+                    WHERE customer_id = %s
+                    RETURNING id
+                """, (customer_id,))
+            else:
+                cur.execute("""
+                    INSERT INTO user_preferences (customer_id, interested_services, last_interaction, conversation_count)
+                    VALUES (%s, %s, CURRENT_TIMESTAMP, 1)
+                    RETURNING id
+                """, (customer_id, 'teste'))
+            conn.commit()
+            return cur.fetchone()
+    except psycopg2.Error:
+        conn.rollback()
+        return None
+    finally:
+        conn.close()
+
+
+def disparar(funcao, *args):
+    """Executa a função THREADS vezes ao mesmo tempo"""
+    global _statements
+    _statements = 0
+    barreira = threading.Barrier(THREADS)
+
+    def chamada():
+        barreira.wait()
+        return funcao(*args)
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        resultados = list(executor.map(lambda _: chamada(), range(THREADS)))
+    return resultados, time.perf_counter() - inicio, _statements
+
+
+def consultar(sql, params):
+    conn = db_pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def limpar(phones):
+    conn = db_pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id FROM customers WHERE phone = ANY(%s)", (phones,))
+            ids = [row[0] for row in cur.fetchall()]
+            cur.execute("DELETE FROM user_preferences WHERE customer_id = ANY(%s)", (ids,))
+            cur.execute("DELETE FROM customers WHERE id = ANY(%s)", (ids,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def relatorio(titulo, resultados, tempo, instrucoes, linhas):
+    erros = sum(1 for r in resultados if r is None)
+    print(f"  {titulo:<8} instruções/chamada={instrucoes / THREADS:.2f}  erros={erros}  "
+          f"linhas={linhas}  tempo={tempo * 1000:.0f}ms")
+
+
+def main():
+    print("=" * 70)
+    print(f"BENCHMARK DE CONTENÇÃO - {THREADS} chamadas simultâneas por cenário")
+    print("=" * 70)
+
+    # Garante as restrições de unicidade (migrações únicas do banco)
+    run_migrations()
+    memory_tools = SPDropMemoryTools()
+
+    sufixo = f"{random.randint(0, 99999999):08d}"
+    phone_antes, phone_depois = f"5500{sufixo}1", f"5500{sufixo}2"
+
+    try:
+        print("\n📇 get_or_create_customer (mesmo telefone)")
+        resultados, tempo, instrucoes = disparar(antigo_get_or_create_customer, phone_antes)
+        linhas = consultar("SELECT count(*) FROM customers WHERE phone = %s", (phone_antes,))
+        relatorio("antes", resultados, tempo, instrucoes, linhas)
+
+        resultados, tempo, instrucoes = disparar(customer_manager.get_or_create_customer, phone_depois)
+        linhas = consultar("SELECT count(*) FROM customers WHERE phone = %s", (phone_depois,))
+        relatorio("depois", resultados, tempo, instrucoes, linhas)
+        print(f"  IDs distintos (depois): {len(set(resultados))}")
+        customer_id = resultados[0]
+
+        print("\n⚙️  update_customer_preferences (mesmo cliente)")
+        customer_antes = customer_manager.get_or_create_customer(phone_antes)
+        resultados, tempo, instrucoes = disparar(antigo_update_customer_preferences, customer_antes)
+        linhas = consultar("SELECT count(*) FROM user_preferences WHERE customer_id = %s", (customer_antes,))
+        relatorio("antes", resultados, tempo, instrucoes, linhas)
+
+        resultados, tempo, instrucoes = disparar(
+            lambda: memory_tools.update_customer_preferences(customer_id, interested_services="teste")
+        )
+        resultados = [None if "error" in r else r for r in resultados]
+        linhas = consultar("SELECT count(*) FROM user_preferences WHERE customer_id = %s", (customer_id,))
+        relatorio("depois", resultados, tempo, instrucoes, linhas)
+        contagem = consultar("SELECT conversation_count FROM user_preferences WHERE customer_id = %s", (customer_id,))
+        print(f"  conversation_count (depois): {contagem} (esperado {THREADS})")
+    finally:
+        limpar([phone_antes, phone_depois])
+        db_pool.closeall()
+
+    print("\n✅ Registros de teste removidos")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Benchmark do preparo de imagens antes da análise com OpenAI Vision
+
+Para cada imagem de exemplo do repositório (prints e fotos do WhatsApp)
+compara o envio antigo (imagem original, detail "auto") com o preparado por
+image_preprocessor.prepare_image:
+
+    - bytes enviados no data URI (base64)
+    - dimensões e detail escolhido
+    - tokens de entrada estimados pela regra de tiles da OpenAI
+    - tempo local de preparo
+
+Com --api também chama a OpenAI nos dois modos e mostra latência e
+prompt_tokens reais (requer OPENAI_API_KEY; custa algumas chamadas).
+
+Uso:
+    python teste_imagens_visao.py [--api] [imagens...]
+"""
+import io
+import os
+import sys
+import glob
+import time
+import base64
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from image_preprocessor import Image, prepare_image, estimate_tokens
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+MIMETYPES = {".jpeg": "image/jpeg", ".jpg": "image/jpeg", ".png": "image/png", ".webp": "image/webp"}
+
+
+def imagens_de_exemplo():
+    arquivos = []
+    for extensao in MIMETYPES:
+        arquivos.extend(glob.glob(os.path.join(PASTA, f"*{extensao}")))
+    return sorted(arquivos)
+
+
+def figurinha_sintetica():
+    """Figurinha WebP 512x512 gerada em memória (deve ser dispensada)"""
+    saida = io.BytesIO()
+    Image.new("RGBA", (512, 512), (255, 200, 0, 128)).save(saida, format="WEBP")
+    return saida.getvalue()
+
+
+def base64_kb(dados):
+    return len(base64.b64encode(dados)) / 1024
+
+
+def chamar_api(servico, dados, mimetype, detail):
+    antes = servico._prompt_tokens
+    inicio = time.perf_counter()
+    servico.analyze_image(base64.b64encode(dados).decode("ascii"), mimetype, None, detail)
+    return (time.perf_counter() - inicio) * 1000, servico._prompt_tokens - antes
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if arg != "--api"]
+    usar_api = "--api" in sys.argv
+
+    if Image is None:
+        print("❌ Pillow não instalado (pip install Pillow) - sem preparo de imagem")
+        return
+
+    arquivos = args or imagens_de_exemplo()
+    servico = None
+    if usar_api:
+        from image_analysis_service import ImageAnalysisService
+        servico = ImageAnalysisService()
+
+    print("=" * 110)
+    print("BENCHMARK DE PREPARO DE IMAGENS PARA VISÃO")
+    print("=" * 110)
+    print(f"{'arquivo':<42} {'original':>18} {'preparada':>18} {'detail':>6} "
+          f"{'tokens':>13} {'preparo':>8}")
+
+    total_antes = total_depois = tokens_antes = tokens_depois = 0
+    for caminho in arquivos:
+        dados = open(caminho, "rb").read()
+        mimetype = MIMETYPES.get(os.path.splitext(caminho)[1].lower(), "image/jpeg")
+        largura, altura = Image.open(io.BytesIO(dados)).size
+
+        inicio = time.perf_counter()
+        preparada = prepare_image(dados, mimetype)
+        tempo_preparo = (time.perf_counter() - inicio) * 1000
+
+        antes_kb, depois_kb = base64_kb(dados), base64_kb(preparada.data)
+        t_antes = estimate_tokens(largura, altura, "auto")
+        t_depois = preparada.estimated_tokens
+        total_antes += antes_kb
+        total_depois += depois_kb
+        tokens_antes += t_antes
+        tokens_depois += t_depois
+
+        nome = os.path.basename(caminho)[:42]
+        print(f"{nome:<42} {antes_kb:>7.0f}KB {largura:>4}x{altura:<4} "
+              f"{depois_kb:>7.0f}KB {preparada.width:>4}x{preparada.height:<4} {preparada.detail:>6} "
+              f"{t_antes:>5} -> {t_depois:<5} {tempo_preparo:>6.0f}ms")
+
+        if servico:
+            latencia_antes, prompt_antes = chamar_api(servico, dados, mimetype, "auto")
+            latencia_depois, prompt_depois = chamar_api(servico, preparada.data, preparada.mimetype, preparada.detail)
+            print(f"{'  ↳ API':<42} latência {latencia_antes:.0f}ms -> {latencia_depois:.0f}ms, "
+                  f"prompt_tokens {prompt_antes} -> {prompt_depois}")
+
+    print("-" * 110)
+    if total_antes:
+        print(f"Payload base64: {total_antes:.0f}KB -> {total_depois:.0f}KB "
+              f"({(1 - total_depois / total_antes) * 100:.0f}% menor)")
+        print(f"Tokens de imagem estimados: {tokens_antes} -> {tokens_depois} "
+              f"({(1 - tokens_depois / tokens_antes) * 100:.0f}% menos)")
+
+    figurinha = prepare_image(figurinha_sintetica(), "image/webp")
+    print(f"Figurinha WebP 512x512: {'dispensada ✅' if figurinha.skip_reason == 'sticker' else 'NÃO dispensada ❌'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Teste das decisões do roteador de intenções (intent_router.classify)
+
+Roda o classify de verdade (FAQ do CSV + gatilhos de demo) em mensagens
+reais e confere a rota escolhida. Inclui os falsos positivos antigos do
+gatilho de demo por substring ("como funciona o pagamento?" recebia as
+credenciais da conta demo em vez de ir para o agente).
+
+Uso:
+    python teste_roteador_intencoes.py
+"""
+import sys
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from intent_router import IntentRouter
+
+# (mensagem, rota esperada)
+CASOS_DEMO = [
+    ("quero ver os produtos", "demo"),
+    ("Gostaria de ver os produtos drop", "demo"),
+    ("posso ver o catálogo?", "demo"),
+    ("queria conhecer a plataforma", "demo"),
+    ("me mostra os fornecedores", "demo"),
+    ("tem conta demo?", "demo"),
+    ("quero ver por dentro", "demo"),
+]
+
+CASOS_NAO_DEMO = [
+    "como funciona o pagamento?",
+    "como funciona o teste de 7 dias?",
+    "Como funciona o frete?",
+    "quero ver o preço dos planos",
+    "não quero ver produto",
+    "nem precisa mostrar a plataforma",
+    "quero ver",
+    "vou ver com meu marido e te falo",
+]
+
+CASOS_SAUDACAO = ["oi", "Oi Gabi, tudo bem?", "bom dia"]
+
+
+def main():
+    router = IntentRouter()
+    router.enabled = True
+    falhas = 0
+
+    def conferir(mensagem, ok, rota):
+        nonlocal falhas
+        descricao = f"{rota.intent} ({rota.detail})" if rota else "agente"
+        print(f"{'✅' if ok else '❌'} {mensagem!r:<45} -> {descricao}")
+        if not ok:
+            falhas += 1
+
+    print("=" * 80)
+    print("ROTEADOR DE INTENÇÕES")
+    print("=" * 80)
+
+    print("\n🎁 Pedidos de demo:")
+    for mensagem, esperado in CASOS_DEMO:
+        rota = router.classify(mensagem)
+        conferir(mensagem, rota is not None and rota.intent == esperado, rota)
+
+    print("\n🚫 Não são pedidos de demo (vão para o agente):")
+    for mensagem in CASOS_NAO_DEMO:
+        rota = router.classify(mensagem)
+        conferir(mensagem, rota is None, rota)
+
+    print("\n👋 Saudações:")
+    for mensagem in CASOS_SAUDACAO:
+        rota = router.classify(mensagem)
+        conferir(mensagem, rota is not None and rota.intent == "greeting", rota)
+
+    print("-" * 80)
+    total = len(CASOS_DEMO) + len(CASOS_NAO_DEMO) + len(CASOS_SAUDACAO)
+    print(f"{total - falhas}/{total} decisões corretas")
+    return 1 if falhas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Teste do envio em partes durante o streaming (main.stream_agent_response)
+
+Roda stream_agent_response com agentes falsos e confere que todas as partes
+da resposta são enfileiradas, na mesma divisão de split_message:
+    - agente que entrega o texto em pedaços (eventos RunContent)
+    - agente que só entrega o texto no evento final (RunCompleted) - antes
+      só a última parte era enviada
+
+Uso:
+    python teste_streaming_partes.py
+"""
+import sys
+import asyncio
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import main
+from message_splitter import split_message
+
+RESPOSTA = "Oi Paulo!\n\nA conta demo é esta.\n\nQuer testar 7 dias?"
+
+
+class Evento:
+    def __init__(self, event, content):
+        self.event = event
+        self.content = content
+
+
+class AgentePedacos:
+    """Entrega o texto em pedaços pequenos e um evento final sem texto"""
+
+    def run(self, message, session_id=None, stream=False):
+        for inicio in range(0, len(RESPOSTA), 7):
+            yield Evento("RunContent", RESPOSTA[inicio:inicio + 7])
+        yield Evento("RunCompleted", None)
+
+
+class AgenteSoFinal:
+    """Versão do agno que só entrega o texto no evento final"""
+
+    def run(self, message, session_id=None, stream=False):
+        yield Evento("RunCompleted", RESPOSTA)
+
+
+async def rodar(agente):
+    enviadas = []
+    original = main.outbound_dispatcher.send
+    main.outbound_dispatcher.send = lambda to, text, delay_after=None: enviadas.append(text)
+    try:
+        resposta, _ = await main.stream_agent_response("5511999999999", "oi", "teste_streaming", agente)
+    finally:
+        main.outbound_dispatcher.send = original
+    return resposta, enviadas
+
+
+async def executar():
+    esperado = split_message(RESPOSTA)
+    falhas = 0
+
+    print("=" * 70)
+    print("STREAMING - PARTES ENFILEIRADAS")
+    print("=" * 70)
+
+    for nome, agente in (("pedaços (RunContent)", AgentePedacos()), ("só evento final", AgenteSoFinal())):
+        resposta, enviadas = await rodar(agente)
+        ok = resposta == RESPOSTA and enviadas == esperado
+        print(f"{'✅' if ok else '❌'} {nome:<22} -> {enviadas}")
+        if not ok:
+            falhas += 1
+
+    print("-" * 70)
+    print(f"Esperado: {esperado}")
+    return 1 if falhas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(executar()))
@@ -1,22 +1,13 @@
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from agno.tools import Toolkit
+from db_pool import db_pool
 from typing import List, Dict, Any
-import os
 
 class ConversationScriptsTools(Toolkit):
     """Ferramenta de Scripts de Conversação para SPDrop - Base de conhecimento de atendimento"""
 
     def __init__(self):
-        # Database configuration
-        self.conn_params = {
-            "host": os.getenv("DB_HOST", "postgres"),
-            "port": int(os.getenv("DB_PORT", "5432")),
-            "database": os.getenv("DB_NAME", "spdrop_db"),
-            "user": os.getenv("DB_USER", "spdrop_user"),
-            "password": os.getenv("DB_PASSWORD", "spdrop_password")
-        }
-
         # Register all tools in the constructor
         tools = [
             self.buscar_por_perfil,
@@ -30,9 +21,9 @@ class ConversationScriptsTools(Toolkit):
         super().__init__(name="conversation_scripts", tools=tools)
 
     def _get_connection(self):
-        """Criar conexão com o banco de dados"""
+        """Obter conexão do pool compartilhado (close() devolve ao pool)"""
         try:
-            return psycopg2.connect(**self.conn_params)
+            return db_pool.getconn()
         except psycopg2.Error as e:
             return None
 
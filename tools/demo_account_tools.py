@@ -16,11 +16,12 @@ class DemoAccountTools(Toolkit):
         }
 
         # Gatilhos que indicam que cliente quer ver a plataforma
+        # (sem frases genéricas como "como funciona"/"quero ver": casam com
+        # perguntas sobre pagamento, frete, preço...)
         self.gatilhos_demo = [
             "ver produto", "ver catalogo", "ver catálogo", "ver fornecedor",
-            "ver plataforma", "como funciona", "conhecer plataforma",
-            "quero ver", "mostrar produto", "mostrar catalogo",
-            "mostrar fornecedor", "ver como é", "ver por dentro"
+            "ver plataforma", "conhecer plataforma", "mostrar produto",
+            "mostrar catalogo", "mostrar fornecedor", "ver por dentro"
         ]
 
         self.register(self.fornecer_conta_demo)
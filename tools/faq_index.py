@@ -0,0 +1,155 @@
+"""
+Índice de busca do FAQ (BM25 sobre índice invertido)
+
+Construído uma vez no carregamento das FAQs. Normaliza o texto em português
+(minúsculas, sem acentos, sem stopwords, com stemming leve) para que
+"Vocês enviam os produtos?" e "envio de produto" caiam nos mesmos termos.
+"""
+
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Stopwords em português (já sem acento). Palavras como "sem", "nao" e
+# "quanto" ficam de fora: mudam o sentido da pergunta.
+STOPWORDS = frozenset("""
+    a o e as os ao aos de da do das dos um uma uns umas em no na nos nas
+    para pra pro por pelo pela pelos pelas com que se me te lhe eu tu ele ela
+    eles elas voce voces vc vcs nos meu minha meus minhas seu sua seus suas
+    teu tua isso isto esse essa esses essas este esta estes estas aquele
+    aquela aquilo ja mas ou tambem bem muito muita mais menos entao ai la
+    aqui como qual quais oi ola ei bom dia boa tarde noite tudo
+    eh sao ser sou foi era tem tenho temos ter ta to esta estou estamos
+    posso pode podem poderia consigo consegue gostaria quero queria queremos
+    saber sobre gente algum alguma alguem
+""".split())
+
+# Sufixos removidos no stemming (mais longos primeiro). Inspirado no RSLP,
+# mas bem mais conservador: só precisa agrupar variações comuns.
+SUFFIXES = (
+    "amentos", "imentos", "amento", "imento", "mente",
+    "acoes", "icoes", "acao", "icao",
+    "ariam", "eriam", "iriam", "aram", "eram", "iram", "avam",
+    "ando", "endo", "indo", "ados", "idos", "adas", "idas",
+    "ado", "ido", "ada", "ida",
+    "ar", "er", "ir", "am", "em", "ou", "ei",
+    "os", "as", "es", "a", "o", "e", "s",
+)
+MIN_STEM = 3
+
+# Peso de cada campo da FAQ no índice
+FIELD_WEIGHTS = {
+    "pergunta": 3.0,
+    "resposta": 1.0,
+    "resposta_recomendada": 1.0,
+}
+
+
+def fold_accents(text: str) -> str:
+    """Minúsculas e sem acentos ("Catálogo" -> "catalogo")"""
+    normalized = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in normalized if not unicodedata.combining(c))
+
+
+def stem(token: str) -> str:
+    """Stemming leve em português ("produtos" -> "produt", "enviam" -> "envi")"""
+    if token.endswith("oes") or token.endswith("aes"):
+        token = token[:-3] + "ao"
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= MIN_STEM:
+            return token[:-len(suffix)]
+    return token
+
+
+def analyze(text: str) -> List[str]:
+    """Texto -> lista de termos normalizados (sem stopwords, com stemming)"""
+    return [
+        stem(token)
+        for token in TOKEN_RE.findall(fold_accents(text or ""))
+        if token not in STOPWORDS
+    ]
+
+
+class FAQIndex:
+    """Índice invertido com ranking BM25 para a lista de FAQs"""
+
+    def __init__(self, faqs: List[Dict[str, str]], k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.size = len(faqs)
+
+        # termo -> [(doc_id, frequência ponderada pelo campo)]
+        self.postings: Dict[str, List[Tuple[int, float]]] = defaultdict(list)
+        self.doc_lengths: List[float] = []
+        # Texto normalizado de cada FAQ para busca por substring
+        self.folded_docs: List[str] = []
+
+        for doc_id, faq in enumerate(faqs):
+            term_freqs = Counter()
+            for field, weight in FIELD_WEIGHTS.items():
+                for term in analyze(faq.get(field, "")):
+                    term_freqs[term] += weight
+
+            for term, freq in term_freqs.items():
+                self.postings[term].append((doc_id, freq))
+
+            self.doc_lengths.append(sum(term_freqs.values()))
+            self.folded_docs.append(
+                "\n".join(fold_accents(faq.get(field, "")) for field in FIELD_WEIGHTS)
+            )
+
+        self.avg_doc_length = (sum(self.doc_lengths) / self.size) if self.size else 0.0
+        self.idf = {term: self._idf(len(postings)) for term, postings in self.postings.items()}
+        self.postings = dict(self.postings)
+
+    def _idf(self, doc_freq: int) -> float:
+        """IDF do BM25 (sempre positivo)"""
+        return math.log(1 + (self.size - doc_freq + 0.5) / (doc_freq + 0.5))
+
+    def search(self, query: str, top_k: int = 3) -> List[Tuple[int, float, float]]:
+        """
+        Busca as FAQs mais relevantes para a pergunta
+
+        Args:
+            query: Pergunta do cliente
+            top_k: Quantidade máxima de resultados
+
+        Returns:
+            Lista de (índice da FAQ, score BM25, cobertura) em ordem de
+            relevância. Cobertura (0 a 1) é a fração do peso (IDF) dos termos
+            da pergunta encontrada na FAQ.
+        """
+        terms = set(analyze(query))
+        if not terms or not self.size:
+            return []
+
+        # Termos desconhecidos pesam como os mais raros possíveis
+        unknown_idf = self._idf(0)
+        total_idf = sum(self.idf.get(term, unknown_idf) for term in terms)
+
+        scores: Dict[int, float] = defaultdict(float)
+        matched_idf: Dict[int, float] = defaultdict(float)
+
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf[term]
+            for doc_id, freq in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / self.avg_doc_length)
+                scores[doc_id] += idf * freq * (self.k1 + 1) / (freq + norm)
+                matched_idf[doc_id] += idf
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [(doc_id, score, matched_idf[doc_id] / total_idf) for doc_id, score in ranked]
+
+    def contains(self, keyword: str) -> List[int]:
+        """Índices das FAQs que contêm a palavra-chave (sem diferenciar acentos)"""
+        folded = fold_accents(keyword).strip()
+        if not folded:
+            return []
+        return [doc_id for doc_id, text in enumerate(self.folded_docs) if folded in text]
@@ -0,0 +1,345 @@
+"""
+Busca semântica no FAQ (embeddings + produto escalar)
+
+As perguntas e respostas do FAQ são convertidas em embeddings uma única vez
+e salvas em disco (.npy). Nos próximos carregamentos a matriz é aberta com
+memory-map, sem recalcular nem copiar para a memória do processo. A chave
+do cache é o hash do modelo + textos: editar o CSV gera uma matriz nova.
+
+Cada busca calcula o embedding da pergunta do cliente (com cache LRU) e faz
+um único produto matriz-vetor contra todas as linhas.
+
+Backends de embedding (FAQ_EMBEDDING_BACKEND):
+    - local (padrão quando sentence-transformers está instalado): modelo
+      pequeno na CPU, no próprio processo (FAQ_EMBEDDING_MODEL, padrão
+      paraphrase-multilingual-MiniLM-L12-v2). A pergunta é embutida em
+      poucos ms e o produto matriz-vetor em <1ms - é o modo que cumpre o
+      p99 de poucos ms (ver "latency_p99_ms" em stats()).
+    - openai: API de embeddings (text-embedding-3-small). Uma pergunta fora
+      do cache LRU paga o round-trip da API - tipicamente 150-400ms, com
+      picos de segundos - por isso a chamada tem timeout curto
+      (FAQ_SEMANTIC_TIMEOUT, padrão 1.5s) e nenhuma retentativa: estourou
+      ou falhou, buscar_faq cai na busca léxica (BM25).
+
+Enquanto a matriz ainda não existe (primeiro uso sem cache em disco, modelo
+local carregando) ela é gerada em background e as buscas usam o BM25.
+
+numpy e o backend são opcionais: sem eles (ou, no backend openai, sem
+OPENAI_API_KEY) o índice fica indisponível e o FAQ continua usando a busca
+léxica (faq_index.py).
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - dependência opcional
+    np = None
+
+try:
+    from openai import OpenAI
+except ImportError:  # pragma: no cover - dependência opcional
+    OpenAI = None
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # pragma: no cover - dependência opcional
+    SentenceTransformer = None
+
+logger = logging.getLogger(__name__)
+
+# Campos do FAQ que viram linhas na matriz (o score da FAQ é o maior deles)
+EMBEDDED_FIELDS = ("pergunta", "resposta")
+
+# Timeout da geração da matriz (lotes grandes, fora do caminho da mensagem)
+BUILD_TIMEOUT = 60.0
+
+# Modelo padrão de cada backend
+DEFAULT_MODELS = {
+    "local": "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+    "openai": "text-embedding-3-small",
+}
+
+
+def embedding_backend() -> Optional[str]:
+    """Backend configurado e disponível ('local', 'openai') ou None"""
+    backend = os.getenv("FAQ_EMBEDDING_BACKEND", "auto").lower()
+    local_ok = SentenceTransformer is not None
+    openai_ok = OpenAI is not None and bool(os.getenv("OPENAI_API_KEY"))
+    if backend == "local":
+        return "local" if local_ok else None
+    if backend == "openai":
+        return "openai" if openai_ok else None
+    if local_ok:
+        return "local"
+    return "openai" if openai_ok else None
+
+
+class SemanticFAQIndex:
+    """Índice vetorial do FAQ com matriz de embeddings em memory-map"""
+
+    def __init__(self, faqs: List[Dict[str, str]], cache_dir: str = None,
+                 model: str = None, query_cache_size: int = 512,
+                 previous: "SemanticFAQIndex" = None):
+        self.faqs = faqs
+        self.backend = embedding_backend() or "openai"
+        self.model = model or os.getenv("FAQ_EMBEDDING_MODEL", DEFAULT_MODELS[self.backend])
+        self.cache_dir = cache_dir or os.getenv(
+            "FAQ_EMBEDDINGS_DIR",
+            os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "faq")
+        )
+        self.query_cache_size = query_cache_size
+        # Timeout do embedding da pergunta (caminho da mensagem) - sem retentativa
+        self.timeout = float(os.getenv("FAQ_SEMANTIC_TIMEOUT", "1.5"))
+
+        self._client = previous._client if previous else None
+        # Modelo local carregado (pesado): reaproveitado entre recargas do FAQ
+        self._local_model = previous._local_model if previous is not None and previous.model == self.model else None
+        self._matrix = None
+        self._row_faq = None
+        self._texts: List[str] = []
+        # Versão anterior do índice (recarga): embeddings de textos iguais são reaproveitados
+        self._previous = previous if previous is not None and previous.model == self.model else None
+        self._build_lock = threading.Lock()
+        self._build_thread: Optional[threading.Thread] = None
+        # Embeddings de perguntas não dependem do FAQ: o cache sobrevive à recarga
+        if self._previous is not None:
+            self._query_cache = self._previous._query_cache
+            self._query_cache_lock = self._previous._query_cache_lock
+        else:
+            self._query_cache: "OrderedDict[str, object]" = OrderedDict()
+            self._query_cache_lock = threading.Lock()
+
+        # Métricas
+        self._searches = 0
+        self._query_cache_hits = 0
+        self._query_errors = 0
+        self._not_ready = 0
+        self._search_time_total = 0.0
+        self._search_time_max = 0.0
+        # Latência total das últimas buscas (embedding da pergunta + produto)
+        self._latencies: deque = deque(maxlen=1000)
+
+    @staticmethod
+    def available() -> bool:
+        """True se numpy e algum backend de embedding estão disponíveis"""
+        return np is not None and embedding_backend() is not None
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), timeout=self.timeout, max_retries=0)
+        return self._client
+
+    def _get_local_model(self):
+        if self._local_model is None:
+            started = time.perf_counter()
+            self._local_model = SentenceTransformer(self.model, device="cpu")
+            logger.info(f"🧠 Modelo local de embeddings carregado em {time.perf_counter() - started:.1f}s ({self.model})")
+        return self._local_model
+
+    def _embed(self, texts: List[str], timeout: float = None):
+        """Embeddings normalizados (norma 1) - produto escalar = cosseno"""
+        if self.backend == "local":
+            vectors = self._get_local_model().encode(
+                texts, batch_size=64, normalize_embeddings=True, convert_to_numpy=True
+            )
+            return np.asarray(vectors, dtype=np.float32)
+
+        client = self._get_client()
+        if timeout is not None:
+            client = client.with_options(timeout=timeout, max_retries=2)
+        response = client.embeddings.create(model=self.model, input=texts)
+        vectors = np.array([item.embedding for item in response.data], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _embed_incremental(self, texts: List[str]):
+        """Embeddings dos textos, chamando a API só para os que são novos"""
+        known = {}
+        previous = self._previous
+        if previous is not None and previous._matrix is not None:
+            known = {text: row for row, text in enumerate(previous._texts)}
+
+        missing = [text for text in texts if text not in known]
+        new_vectors = self._embed(missing, timeout=BUILD_TIMEOUT) if missing else None
+        new_rows = {text: row for row, text in enumerate(missing)}
+
+        rows = []
+        for text in texts:
+            if text in new_rows:
+                rows.append(new_vectors[new_rows[text]])
+            else:
+                rows.append(np.asarray(previous._matrix[known[text]]))
+
+        if known:
+            logger.info(f"🧠 Embeddings do FAQ: {len(texts) - len(missing)} reaproveitados, {len(missing)} novos")
+        return np.stack(rows).astype(np.float32)
+
+    def _rows(self) -> Tuple[List[str], List[int]]:
+        """Textos a embutir e a FAQ de cada linha"""
+        texts, row_faq = [], []
+        for faq_id, faq in enumerate(self.faqs):
+            for field in EMBEDDED_FIELDS:
+                text = (faq.get(field) or "").strip()
+                if text:
+                    texts.append(text)
+                    row_faq.append(faq_id)
+        return texts, row_faq
+
+    def _cache_path(self, texts: List[str]) -> str:
+        digest = hashlib.sha256(self.model.encode("utf-8"))
+        for text in texts:
+            digest.update(b"\0" + text.encode("utf-8"))
+        return os.path.join(self.cache_dir, f"faq_embeddings_{digest.hexdigest()[:16]}.npy")
+
+    def build(self):
+        """Carrega a matriz do cache em disco ou gera os embeddings (uma vez)"""
+        if self._matrix is not None:
+            return
+
+        with self._build_lock:
+            if self._matrix is not None:
+                return
+
+            texts, row_faq = self._rows()
+            if not texts:
+                self._row_faq = np.zeros(0, dtype=np.int32)
+                self._matrix = np.zeros((0, 0), dtype=np.float32)
+                return
+
+            path = self._cache_path(texts)
+            if not os.path.exists(path):
+                started = time.perf_counter()
+                matrix = self._embed_incremental(texts)
+                os.makedirs(self.cache_dir, exist_ok=True)
+                # Gravar em arquivo temporário e renomear (atômico)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as file:
+                    np.save(file, matrix)
+                os.replace(tmp_path, path)
+                logger.info(
+                    f"🧠 Embeddings do FAQ gerados: {len(texts)} textos em "
+                    f"{(time.perf_counter() - started) * 1000:.0f}ms ({self.model})"
+                )
+
+            self._texts = texts
+            self._row_faq = np.array(row_faq, dtype=np.int32)
+            self._matrix = np.load(path, mmap_mode="r")
+            self._previous = None
+            logger.info(f"🧠 Índice semântico do FAQ carregado: {self._matrix.shape[0]} vetores")
+
+    def build_async(self):
+        """Gera a matriz em background (buscas usam o BM25 até ela existir)"""
+        if self._matrix is not None:
+            return
+        with self._query_cache_lock:
+            if self._build_thread is not None and self._build_thread.is_alive():
+                return
+            self._build_thread = threading.Thread(target=self._build_background, daemon=True)
+            self._build_thread.start()
+
+    def _build_background(self):
+        try:
+            self.build()
+        except Exception as e:
+            logger.warning(f"⚠️ Embeddings do FAQ não gerados: {e}")
+
+    def ready(self) -> bool:
+        """True se a matriz já está carregada (busca sem custo de build)"""
+        return self._matrix is not None
+
+    def _query_vector(self, query: str):
+        """Embedding da pergunta (cache LRU - perguntas se repetem muito)"""
+        key = " ".join(query.lower().split())
+        with self._query_cache_lock:
+            vector = self._query_cache.get(key)
+            if vector is not None:
+                self._query_cache.move_to_end(key)
+                self._query_cache_hits += 1
+                return vector
+
+        try:
+            vector = self._embed([key])[0]
+        except Exception:
+            self._query_errors += 1
+            raise
+        with self._query_cache_lock:
+            self._query_cache[key] = vector
+            if len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
+        return vector
+
+    def search(self, query: str, top_k: int = 3) -> Optional[List[Tuple[int, float]]]:
+        """
+        Busca as FAQs semanticamente mais próximas da pergunta
+
+        Args:
+            query: Pergunta do cliente
+            top_k: Quantidade máxima de resultados
+
+        Returns:
+            Lista de (índice da FAQ, similaridade de cosseno) em ordem de relevância,
+            ou None se a matriz ainda está sendo gerada (usar a busca léxica).
+            Erros/timeout do embedding da pergunta são propagados.
+        """
+        if not query or not query.strip():
+            return []
+
+        if self._matrix is None:
+            self._not_ready += 1
+            self.build_async()
+            return None
+        if not len(self._row_faq):
+            return []
+
+        query_started = time.perf_counter()
+        query_vector = self._query_vector(query)
+
+        started = time.perf_counter()
+        row_scores = self._matrix @ query_vector
+
+        # Score da FAQ = melhor linha dela (pergunta ou resposta)
+        faq_scores = np.full(len(self.faqs), -1.0, dtype=np.float32)
+        np.maximum.at(faq_scores, self._row_faq, row_scores)
+
+        k = min(top_k, len(faq_scores))
+        top = np.argpartition(-faq_scores, k - 1)[:k]
+        top = top[np.argsort(-faq_scores[top])]
+        results = [(int(faq_id), float(faq_scores[faq_id])) for faq_id in top]
+
+        elapsed = time.perf_counter() - started
+        self._searches += 1
+        self._search_time_total += elapsed
+        self._search_time_max = max(self._search_time_max, elapsed)
+        self._latencies.append(time.perf_counter() - query_started)
+        return results
+
+    def stats(self) -> Dict[str, object]:
+        """
+        Métricas da busca semântica
+
+        search_*: só o produto matriz-vetor; latency_p99_ms: busca inteira
+        (embedding da pergunta incluso) nas últimas 1000 buscas
+        """
+        latencies = sorted(self._latencies)
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else 0.0
+        return {
+            "backend": self.backend,
+            "model": self.model,
+            "vectors": 0 if self._matrix is None else int(self._matrix.shape[0]),
+            "searches": self._searches,
+            "query_cache_hits": self._query_cache_hits,
+            "query_errors": self._query_errors,
+            "not_ready": self._not_ready,
+            "timeout_s": self.timeout,
+            "search_avg_ms": round(self._search_time_total / self._searches * 1000, 3) if self._searches else 0.0,
+            "search_max_ms": round(self._search_time_max * 1000, 3),
+            "latency_p99_ms": round(p99 * 1000, 3)
+        }
@@ -1,8 +1,29 @@
 import csv
 import os
+import time
+import logging
+import threading
+from datetime import datetime
 from agno.tools import Toolkit
-from typing import List, Dict, Any
-from difflib import SequenceMatcher
+from typing import List, Dict, Any, Optional
+
+from tools.faq_index import FAQIndex
+from tools.faq_semantic import SemanticFAQIndex
+
+logger = logging.getLogger(__name__)
+
+class _FAQSnapshot:
+    """FAQs + índices de uma versão do CSV (imutável depois de construído)"""
+
+    __slots__ = ("faqs", "index", "semantic_index", "mtime")
+
+    def __init__(self, faqs: List[Dict[str, str]], index: FAQIndex,
+                 semantic_index: Optional[SemanticFAQIndex], mtime: Optional[int]):
+        self.faqs = faqs
+        self.index = index
+        self.semantic_index = semantic_index
+        self.mtime = mtime
+
 
 class SPDropFAQTools(Toolkit):
     """Ferramenta de FAQ para SPDrop - Base de conhecimento interna"""
@@ -14,7 +35,32 @@ class SPDropFAQTools(Toolkit):
             "docs da minha empresa",
             "suporte - transformar esse texto em uma planilha de pergunt....csv"
         )
-        self.faqs = self._load_faqs()
+
+        # Busca semântica opcional (FAQ_SEARCH_MODE=semantic); embeddings gerados no primeiro uso
+        self.search_mode = os.getenv("FAQ_SEARCH_MODE", "lexical").lower()
+        self.semantic_min_score = float(os.getenv("FAQ_SEMANTIC_MIN_SCORE", "0.45"))
+        self.semantic_enabled = self.search_mode == "semantic" and SemanticFAQIndex.available()
+        if self.search_mode == "semantic" and not self.semantic_enabled:
+            logger.warning(
+                "⚠️ FAQ_SEARCH_MODE=semantic sem numpy ou backend de embedding "
+                "(sentence-transformers ou openai + OPENAI_API_KEY) - usando busca léxica"
+            )
+
+        # Recarga automática quando o CSV muda (0 = desativada)
+        self.reload_interval = float(os.getenv("FAQ_RELOAD_INTERVAL", "30"))
+        self._reload_lock = threading.Lock()
+        self._reloads = 0
+        self._reload_errors = 0
+        self._last_reload_ms = 0.0
+        self._loaded_at = datetime.now()
+
+        # Índices construídos uma única vez por versão do CSV (evita normalizar
+        # todas as FAQs a cada busca). Cada busca lê self._snapshot uma vez só:
+        # a troca por uma versão nova é uma atribuição atômica.
+        self._snapshot = self._build_snapshot()
+
+        if self.reload_interval > 0:
+            threading.Thread(target=self._watch, name="faq-reload", daemon=True).start()
 
         # Register all tools in the constructor
         tools = [
@@ -25,6 +71,103 @@ class SPDropFAQTools(Toolkit):
 
         super().__init__(name="spdrop_faq", tools=tools)
 
+    @property
+    def faqs(self) -> List[Dict[str, str]]:
+        return self._snapshot.faqs
+
+    @property
+    def index(self) -> FAQIndex:
+        return self._snapshot.index
+
+    @property
+    def semantic_index(self) -> Optional[SemanticFAQIndex]:
+        return self._snapshot.semantic_index
+
+    def _file_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.faq_file_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _build_snapshot(self, previous: Optional[_FAQSnapshot] = None) -> _FAQSnapshot:
+        """Lê o CSV e constrói os índices de uma nova versão"""
+        mtime = self._file_mtime()
+        faqs = self._load_faqs()
+        semantic_index = None
+        if self.semantic_enabled:
+            # Reaproveita os embeddings dos textos que não mudaram
+            semantic_index = SemanticFAQIndex(
+                faqs, previous=previous.semantic_index if previous else None
+            )
+            # Primeira carga: gerar/abrir a matriz já, sem esperar a primeira busca
+            if previous is None:
+                semantic_index.build_async()
+        return _FAQSnapshot(faqs, FAQIndex(faqs), semantic_index, mtime)
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Recarrega o FAQ se o CSV mudou, trocando os índices de uma vez
+
+        Args:
+            force: Recarregar mesmo sem mudança no arquivo
+
+        Returns:
+            True se uma nova versão foi ativada
+        """
+        with self._reload_lock:
+            current = self._snapshot
+            if not force and self._file_mtime() == current.mtime:
+                return False
+
+            started = time.perf_counter()
+            snapshot = self._build_snapshot(previous=current)
+
+            # CSV sendo gravado/ilegível: manter a versão atual
+            if not snapshot.faqs and current.faqs:
+                self._reload_errors += 1
+                logger.warning("⚠️ FAQ recarregado veio vazio - mantendo a versão anterior")
+                return False
+
+            # Gerar embeddings antes da troca: buscas nunca esperam o rebuild
+            if snapshot.semantic_index is not None and current.semantic_index is not None:
+                try:
+                    snapshot.semantic_index.build()
+                except Exception as e:
+                    logger.warning(f"⚠️ Embeddings do FAQ não gerados na recarga: {e}")
+
+            self._snapshot = snapshot
+            self._reloads += 1
+            self._last_reload_ms = (time.perf_counter() - started) * 1000
+            self._loaded_at = datetime.now()
+
+        logger.info(f"🔄 FAQ recarregado: {len(snapshot.faqs)} perguntas em {self._last_reload_ms:.1f}ms")
+        return True
+
+    def _watch(self):
+        """Verifica periodicamente se o CSV mudou"""
+        while True:
+            time.sleep(self.reload_interval)
+            try:
+                self.reload()
+            except Exception as e:
+                self._reload_errors += 1
+                logger.error(f"Erro ao recarregar FAQ: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas do FAQ (versão carregada e recargas)"""
+        snapshot = self._snapshot
+        stats = {
+            "faqs": len(snapshot.faqs),
+            "search_mode": "semantic" if self.semantic_enabled else "lexical",
+            "loaded_at": self._loaded_at.isoformat(),
+            "reloads": self._reloads,
+            "reload_errors": self._reload_errors,
+            "last_reload_ms": round(self._last_reload_ms, 2)
+        }
+        if snapshot.semantic_index is not None:
+            stats["semantic"] = snapshot.semantic_index.stats()
+        return stats
+
     def _load_faqs(self) -> List[Dict[str, str]]:
         """Carrega todas as FAQs do arquivo CSV"""
         faqs = []
@@ -46,9 +189,30 @@ class SPDropFAQTools(Toolkit):
         except Exception as e:
             return []
 
-    def _similarity_score(self, text1: str, text2: str) -> float:
-        """Calcula similaridade entre dois textos (0 a 1)"""
-        return SequenceMatcher(None, text1.lower(), text2.lower()).ratio()
+    def best_match(self, question: str) -> Optional[Dict[str, Any]]:
+        """
+        Melhor FAQ na busca léxica (BM25), sem passar pelo agente
+
+        Args:
+            question: Pergunta do cliente
+
+        Returns:
+            Dict com faq, score, confidence (cobertura 0-1) e margin (score do
+            1º lugar / score do 2º; inf quando só uma FAQ casa), ou None
+        """
+        snapshot = self._snapshot
+        results = snapshot.index.search(question, top_k=2)
+        if not results:
+            return None
+
+        doc_id, score, confidence = results[0]
+        runner_up = results[1][1] if len(results) > 1 else 0.0
+        return {
+            "faq": snapshot.faqs[doc_id],
+            "score": score,
+            "confidence": confidence,
+            "margin": score / runner_up if runner_up > 0 else float("inf")
+        }
 
     def buscar_faq(self, pergunta_cliente: str) -> Dict[str, Any]:
         """
@@ -60,31 +224,55 @@ class SPDropFAQTools(Toolkit):
         Returns:
             Dict com pergunta, resposta e resposta recomendada
         """
-        if not self.faqs:
+        snapshot = self._snapshot
+        if not snapshot.faqs:
             return {
                 "encontrado": False,
                 "erro": "Base de FAQs não carregada"
             }
 
-        # Encontrar a pergunta mais similar
-        melhor_match = None
-        melhor_score = 0
+        # Lista de (índice da FAQ, score, confiança 0-1)
+        resultados = None
+        busca = "lexica"
 
-        for faq in self.faqs:
-            score = self._similarity_score(pergunta_cliente, faq['pergunta'])
-            if score > melhor_score:
-                melhor_score = score
-                melhor_match = faq
+        if snapshot.semantic_index is not None:
+            try:
+                semanticos = snapshot.semantic_index.search(pergunta_cliente, top_k=3)
+                # None = matriz ainda sendo gerada em background
+                if semanticos is not None:
+                    resultados = [(doc_id, score, score) for doc_id, score in semanticos]
+                    limiar = self.semantic_min_score
+                    busca = "semantica"
+            except Exception as e:
+                # Timeout curto (FAQ_SEMANTIC_TIMEOUT): a busca léxica responde na hora
+                logger.warning(f"⚠️ Busca semântica do FAQ falhou, usando busca léxica: {e}")
 
-        # Considerar match válido se similaridade > 0.3
-        if melhor_score > 0.3 and melhor_match:
+        if resultados is None:
+            # Ranking BM25 no índice invertido; confiança = cobertura da pergunta.
+            # Match válido se a FAQ cobre > 30% do peso da pergunta
+            resultados = snapshot.index.search(pergunta_cliente, top_k=3)
+            limiar = 0.3
+
+        if resultados and resultados[0][2] > limiar:
+            doc_id, score, confianca = resultados[0]
+            melhor_match = snapshot.faqs[doc_id]
             return {
                 "encontrado": True,
                 "pergunta_original": pergunta_cliente,
                 "pergunta_faq": melhor_match['pergunta'],
                 "resposta_recomendada": melhor_match['resposta_recomendada'],
                 "resposta_informal": melhor_match['resposta'],
-                "confianca": round(melhor_score * 100, 1)
+                "confianca": round(confianca * 100, 1),
+                "score": round(score, 3),
+                "busca": busca,
+                "alternativas": [
+                    {
+                        "pergunta_faq": snapshot.faqs[alt_id]['pergunta'],
+                        "confianca": round(alt_confianca * 100, 1),
+                        "score": round(alt_score, 3)
+                    }
+                    for alt_id, alt_score, alt_confianca in resultados[1:]
+                ]
             }
         else:
             return {
@@ -100,13 +288,14 @@ class SPDropFAQTools(Toolkit):
         Returns:
             Dict com lista de todas as perguntas
         """
-        if not self.faqs:
+        faqs = self.faqs
+        if not faqs:
             return {
                 "total": 0,
                 "perguntas": []
             }
 
-        perguntas = [faq['pergunta'] for faq in self.faqs]
+        perguntas = [faq['pergunta'] for faq in faqs]
 
         return {
             "total": len(perguntas),
@@ -123,26 +312,22 @@ class SPDropFAQTools(Toolkit):
         Returns:
             Dict com lista de FAQs encontradas
         """
-        if not self.faqs:
+        snapshot = self._snapshot
+        if not snapshot.faqs:
             return {
                 "encontrado": False,
                 "total": 0,
                 "resultados": []
             }
 
-        palavra_lower = palavra_chave.lower()
-        resultados = []
-
-        for faq in self.faqs:
-            # Buscar na pergunta e nas respostas
-            if (palavra_lower in faq['pergunta'].lower() or
-                palavra_lower in faq['resposta'].lower() or
-                palavra_lower in faq['resposta_recomendada'].lower()):
-
-                resultados.append({
-                    "pergunta": faq['pergunta'],
-                    "resposta_recomendada": faq['resposta_recomendada']
-                })
+        # Busca no texto já normalizado pelo índice (sem diferenciar acentos)
+        resultados = [
+            {
+                "pergunta": snapshot.faqs[doc_id]['pergunta'],
+                "resposta_recomendada": snapshot.faqs[doc_id]['resposta_recomendada']
+            }
+            for doc_id in snapshot.index.contains(palavra_chave)
+        ]
 
         if resultados:
             return {
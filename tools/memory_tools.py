@@ -1,22 +1,37 @@
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, Json
 from agno.tools import Toolkit
+from db_pool import db_pool
+from customer_cache import customer_cache, MISSING
+from customer_manager import customer_manager, CONTEXT_TEXT_LIMIT
 from typing import List, Dict, Any, Optional
+import json
 import uuid
+import logging
 from datetime import datetime
-import os
+
+logger = logging.getLogger(__name__)
+
+# Memórias importantes: um objeto JSONB por cliente ({chave: {value, updated_at}}).
+# Cada escrita é um único INSERT ... ON CONFLICT que mescla as chaves novas
+# (||) na linha travada - escritas concorrentes de chaves diferentes não se perdem.
+# Tabela e índices únicos vêm do init.sql (bancos antigos: migrar_banco.py).
+REQUIRED_RELATIONS = (
+    "customer_memories",
+    "uq_user_preferences_customer",
+    "uq_customer_context_customer",
+)
+
+UPSERT_MEMORIES_SQL = """
+    INSERT INTO customer_memories (customer_id, memories)
+    VALUES (%s, %s)
+    ON CONFLICT (customer_id) DO UPDATE
+    SET memories = customer_memories.memories || EXCLUDED.memories,
+        updated_at = CURRENT_TIMESTAMP
+"""
 
 class SPDropMemoryTools(Toolkit):
     def __init__(self):
-        # Database configuration
-        self.conn_params = {
-            "host": os.getenv("DB_HOST", "postgres"),
-            "port": int(os.getenv("DB_PORT", "5432")),
-            "database": os.getenv("DB_NAME", "spdrop_db"),
-            "user": os.getenv("DB_USER", "spdrop_user"),
-            "password": os.getenv("DB_PASSWORD", "spdrop_password")
-        }
-
         # Register all tools in the constructor
         tools = [
             self.create_session,
@@ -28,19 +43,81 @@ class SPDropMemoryTools(Toolkit):
             self.get_customer_by_phone,
             self.end_session,
             self.save_important_memory,
+            self.save_memories,
             self.get_important_memories
         ]
 
         super().__init__(name="spdrop_memory", tools=tools)
 
     def _get_connection(self):
-        """Criar conexão com o banco de dados"""
+        """Obter conexão do pool compartilhado (close() devolve ao pool)"""
         try:
-            conn = psycopg2.connect(**self.conn_params)
-            return conn
+            return db_pool.getconn()
         except psycopg2.Error as e:
             return None
 
+    def check_schema(self) -> List[str]:
+        """
+        Confere se a tabela customer_memories e os índices únicos dos upserts
+        existem (só leitura - as migrações rodam uma vez via migrar_banco.py)
+
+        Returns:
+            Relações que estão faltando (lista vazia = schema ok)
+        """
+        conn = self._get_connection()
+        if not conn:
+            raise psycopg2.OperationalError("Falha na conexão com o banco")
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT name FROM unnest(%s::text[]) AS name WHERE to_regclass(name) IS NULL",
+                    (list(REQUIRED_RELATIONS),)
+                )
+                missing = [row[0] for row in cur.fetchall()]
+            conn.rollback()
+        finally:
+            conn.close()
+
+        if missing:
+            logger.error(
+                f"❌ Schema de memórias desatualizado (faltando: {', '.join(missing)}) - "
+                f"rode: python migrar_banco.py"
+            )
+        return missing
+
+    def _upsert_memories(self, customer_id: int, memories: Dict[str, str]) -> Dict[str, Any]:
+        """Grava várias chaves de memória em uma única instrução atômica"""
+        conn = self._get_connection()
+        if not conn:
+            return {"error": "Falha na conexão com o banco"}
+
+        updated_at = datetime.now().isoformat()
+        payload = {
+            key: {'value': value, 'updated_at': updated_at}
+            for key, value in memories.items()
+        }
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute(UPSERT_MEMORIES_SQL, (customer_id, Json(payload)))
+                customer_cache.notify_invalidation(cur, customer_id, ("memories", "turn_context"))
+            conn.commit()
+            customer_cache.invalidate_customer(customer_id, ("memories",))
+            # Contexto da rodada em cache recebe as memórias novas (write-through):
+            # descartá-lo perderia as trocas ainda na fila do history_writer
+            customer_cache.update(
+                "turn_context", customer_id,
+                lambda context: {**context, "memories": {**(context.get("memories") or {}), **payload}},
+                customer_id
+            )
+            return {"success": True, "customer_id": customer_id, "saved_keys": list(payload)}
+        except psycopg2.Error as e:
+            conn.rollback()
+            return {"error": str(e)}
+        finally:
+            conn.close()
+
     def create_session(self, customer_id: int) -> Dict[str, Any]:
         """Cria uma nova sessão de conversa"""
         conn = self._get_connection()
@@ -78,8 +155,10 @@ class SPDropMemoryTools(Toolkit):
                     VALUES (%s, %s, %s, %s, 'standard')
                     RETURNING id, session_id, customer_id, timestamp
                 """, (session_id, customer_id, user_message, agent_response))
-                conn.commit()
                 record = cur.fetchone()
+                customer_cache.notify_invalidation(cur, customer_id, ("turn_context",))
+                conn.commit()
+                customer_cache.invalidate_customer(customer_id, ("turn_context",))
                 return dict(record) if record else {}
         except psycopg2.Error as e:
             conn.rollback()
@@ -87,15 +166,16 @@ class SPDropMemoryTools(Toolkit):
         finally:
             conn.close()
 
-    def get_conversation_history(self, customer_id: int, limit: int = 20) -> List[Dict[str, Any]]:
+    def get_conversation_history(self, customer_id: int, limit: int = 6) -> List[Dict[str, Any]]:
         """
-        RETRIEVE customer's conversation history. ALWAYS call this FIRST at the start of EVERY interaction.
+        RETRIEVE customer's conversation history. Call this ONLY when the message does NOT
+        include the [CONTEXTO DO CLIENTE] block - that block already has the recent history.
 
         This tells you: customer's name, what they asked before, their interests, if they chose a plan, if they're a subscriber.
 
         Args:
             customer_id: Customer's unique ID
-            limit: Number of recent messages (default: 20)
+            limit: Number of recent messages (default: 6)
 
         Returns:
             List of conversations with user_message, agent_response, timestamp. Empty list if no history.
@@ -114,7 +194,15 @@ class SPDropMemoryTools(Toolkit):
                     LIMIT %s
                 """, (customer_id, limit))
                 history = cur.fetchall()
-                return [dict(row) for row in history]
+                # Textos cortados como no bloco de contexto (controle de tokens)
+                return [
+                    {
+                        **row,
+                        "user_message": (row["user_message"] or "")[:CONTEXT_TEXT_LIMIT],
+                        "agent_response": (row["agent_response"] or "")[:CONTEXT_TEXT_LIMIT]
+                    }
+                    for row in history
+                ]
         except psycopg2.Error:
             return []
         finally:
@@ -128,33 +216,24 @@ class SPDropMemoryTools(Toolkit):
 
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                # Verificar se existe registro
-                cur.execute("SELECT id FROM user_preferences WHERE customer_id = %s", (customer_id,))
-                exists = cur.fetchone()
-
-                if exists:
-                    # Update
-                    cur.execute("""
-                        UPDATE user_preferences
-                        SET interested_services = COALESCE(%s, interested_services),
-                            preferred_time_slot = COALESCE(%s, preferred_time_slot),
-                            last_interaction = CURRENT_TIMESTAMP,
-                            conversation_count = conversation_count + 1,
-                            updated_at = CURRENT_TIMESTAMP
-                        WHERE customer_id = %s
-                        RETURNING id, customer_id, interested_services, preferred_time_slot, conversation_count
-                    """, (interested_services, preferred_time_slot, customer_id))
-                else:
-                    # Insert
-                    cur.execute("""
-                        INSERT INTO user_preferences
-                        (customer_id, interested_services, preferred_time_slot, last_interaction, conversation_count)
-                        VALUES (%s, %s, %s, CURRENT_TIMESTAMP, 1)
-                        RETURNING id, customer_id, interested_services, preferred_time_slot, conversation_count
-                    """, (customer_id, interested_services, preferred_time_slot))
+                cur.execute("""
+                    INSERT INTO user_preferences
+                    (customer_id, interested_services, preferred_time_slot, last_interaction, conversation_count)
+                    VALUES (%s, %s, %s, CURRENT_TIMESTAMP, 1)
+                    ON CONFLICT (customer_id) DO UPDATE
+                    SET interested_services = COALESCE(EXCLUDED.interested_services, user_preferences.interested_services),
+                        preferred_time_slot = COALESCE(EXCLUDED.preferred_time_slot, user_preferences.preferred_time_slot),
+                        last_interaction = CURRENT_TIMESTAMP,
+                        conversation_count = user_preferences.conversation_count + 1,
+                        updated_at = CURRENT_TIMESTAMP
+                    RETURNING id, customer_id, interested_services, preferred_time_slot, conversation_count
+                """, (customer_id, interested_services, preferred_time_slot))
+                record = cur.fetchone()
+                # get_customer_by_phone também traz interested_services e conversation_count
+                customer_cache.notify_invalidation(cur, customer_id, ("turn_context", "customer_by_phone"))
 
                 conn.commit()
-                record = cur.fetchone()
+                customer_cache.invalidate_customer(customer_id, ("turn_context", "customer_by_phone"))
                 return dict(record) if record else {}
         except psycopg2.Error as e:
             conn.rollback()
@@ -164,6 +243,10 @@ class SPDropMemoryTools(Toolkit):
 
     def get_customer_context(self, customer_id: int) -> Dict[str, Any]:
         """Retorna contexto completo do cliente"""
+        cached = customer_cache.get("customer_context", customer_id)
+        if cached is not MISSING:
+            return cached
+
         conn = self._get_connection()
         if not conn:
             return {}
@@ -175,7 +258,9 @@ class SPDropMemoryTools(Toolkit):
                     WHERE customer_id = %s
                 """, (customer_id,))
                 context = cur.fetchone()
-                return dict(context) if context else {}
+                context = dict(context) if context else {}
+                customer_cache.set("customer_context", customer_id, context, customer_id)
+                return context
         except psycopg2.Error:
             return {}
         finally:
@@ -190,34 +275,26 @@ class SPDropMemoryTools(Toolkit):
 
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                # Verificar se existe
-                cur.execute("SELECT id FROM customer_context WHERE customer_id = %s", (customer_id,))
-                exists = cur.fetchone()
-
-                if exists:
-                    # Update
-                    cur.execute("""
-                        UPDATE customer_context
-                        SET business_niche = COALESCE(%s, business_niche),
-                            experience_level = COALESCE(%s, experience_level),
-                            current_situation = COALESCE(%s, current_situation),
-                            financial_situation = COALESCE(%s, financial_situation),
-                            notes = COALESCE(%s, notes),
-                            updated_at = CURRENT_TIMESTAMP
-                        WHERE customer_id = %s
-                        RETURNING id, customer_id, business_niche, experience_level, current_situation, financial_situation, notes
-                    """, (business_niche, experience_level, current_situation, financial_situation, notes, customer_id))
-                else:
-                    # Insert
-                    cur.execute("""
-                        INSERT INTO customer_context
-                        (customer_id, business_niche, experience_level, current_situation, financial_situation, notes)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                        RETURNING id, customer_id, business_niche, experience_level, current_situation, financial_situation, notes
-                    """, (customer_id, business_niche, experience_level, current_situation, financial_situation, notes))
+                cur.execute("""
+                    INSERT INTO customer_context
+                    (customer_id, business_niche, experience_level, current_situation, financial_situation, notes)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (customer_id) DO UPDATE
+                    SET business_niche = COALESCE(EXCLUDED.business_niche, customer_context.business_niche),
+                        experience_level = COALESCE(EXCLUDED.experience_level, customer_context.experience_level),
+                        current_situation = COALESCE(EXCLUDED.current_situation, customer_context.current_situation),
+                        financial_situation = COALESCE(EXCLUDED.financial_situation, customer_context.financial_situation),
+                        notes = COALESCE(EXCLUDED.notes, customer_context.notes),
+                        updated_at = CURRENT_TIMESTAMP
+                    RETURNING id, customer_id, business_niche, experience_level, current_situation, financial_situation, notes
+                """, (customer_id, business_niche, experience_level, current_situation, financial_situation, notes))
+                record = cur.fetchone()
+                customer_cache.notify_invalidation(
+                    cur, customer_id, ("customer_context", "turn_context", "customer_by_phone")
+                )
 
                 conn.commit()
-                record = cur.fetchone()
+                customer_cache.invalidate_customer(customer_id, ("customer_context", "turn_context", "customer_by_phone"))
                 return dict(record) if record else {}
         except psycopg2.Error as e:
             conn.rollback()
@@ -227,6 +304,12 @@ class SPDropMemoryTools(Toolkit):
 
     def get_customer_by_phone(self, phone: str) -> Dict[str, Any]:
         """Busca cliente por telefone com todo seu contexto"""
+        # Mesma chave para 5511...@c.us e 5511... (é o formato gravado em customers)
+        phone = customer_manager.normalize_phone(phone)
+        cached = customer_cache.get("customer_by_phone", phone)
+        if cached is not MISSING:
+            return cached
+
         conn = self._get_connection()
         if not conn:
             return {}
@@ -241,7 +324,11 @@ class SPDropMemoryTools(Toolkit):
                     WHERE c.phone = %s
                 """, (phone,))
                 customer = cur.fetchone()
-                return dict(customer) if customer else {}
+                if not customer:
+                    return {}
+                customer = dict(customer)
+                customer_cache.set("customer_by_phone", phone, customer, customer["id"])
+                return customer
         except psycopg2.Error:
             return {}
         finally:
@@ -287,8 +374,6 @@ class SPDropMemoryTools(Toolkit):
         MEMORY_KEYS DISPONÍVEIS:
         'nome_completo', 'is_subscriber', 'plano_interesse', 'referred_by', 'objetivo', etc.
         """
-        import json
-
         # Extrair customer_id
         customer_id = kwargs.get('customer_id')
         if not customer_id:
@@ -310,70 +395,50 @@ class SPDropMemoryTools(Toolkit):
         if not memory_key or not memory_value:
             return {"error": "Não foi possível identificar memory_key e memory_value. Use: save_important_memory(customer_id=X, memory_key='key', memory_value='value')"}
 
-        conn = self._get_connection()
-        if not conn:
-            return {"error": "Falha na conexão com o banco"}
+        result = self._upsert_memories(customer_id, {memory_key: memory_value})
+        if "error" in result:
+            return result
 
-        try:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                # Buscar memórias existentes
-                cur.execute("SELECT notes FROM customer_context WHERE customer_id = %s", (customer_id,))
-                result = cur.fetchone()
+        return {
+            "success": True,
+            "memory_key": memory_key,
+            "memory_value": memory_value,
+            "customer_id": customer_id
+        }
 
-                # Carregar memórias existentes ou criar novo dict
-                if result and result['notes']:
-                    try:
-                        memories = json.loads(result['notes'])
-                    except:
-                        memories = {}
-                else:
-                    memories = {}
-
-                # Adicionar/atualizar a nova memória
-                memories[memory_key] = {
-                    'value': memory_value,
-                    'updated_at': datetime.now().isoformat()
-                }
-
-                # Salvar de volta
-                notes_json = json.dumps(memories, ensure_ascii=False)
-
-                # Verificar se já existe registro
-                cur.execute("SELECT id FROM customer_context WHERE customer_id = %s", (customer_id,))
-                exists = cur.fetchone()
-
-                if exists:
-                    cur.execute("""
-                        UPDATE customer_context
-                        SET notes = %s, updated_at = CURRENT_TIMESTAMP
-                        WHERE customer_id = %s
-                        RETURNING id, customer_id, notes
-                    """, (notes_json, customer_id))
-                else:
-                    cur.execute("""
-                        INSERT INTO customer_context (customer_id, notes)
-                        VALUES (%s, %s)
-                        RETURNING id, customer_id, notes
-                    """, (customer_id, notes_json))
+    def save_memories(self, customer_id: int, memories: Dict[str, str]) -> Dict[str, Any]:
+        """
+        Salva várias lembranças do cliente de uma vez (uma única escrita no banco).
 
-                conn.commit()
-                record = cur.fetchone()
-                return {
-                    "success": True,
-                    "memory_key": memory_key,
-                    "memory_value": memory_value,
-                    "customer_id": customer_id
-                }
-        except psycopg2.Error as e:
-            conn.rollback()
-            return {"error": str(e)}
-        finally:
-            conn.close()
+        Use no lugar de várias chamadas a save_important_memory quando o cliente
+        informar mais de um dado na mesma mensagem.
+
+        Args:
+            customer_id: ID do cliente
+            memories: Dicionário {memory_key: memory_value}
+
+        EXEMPLO:
+
+        save_memories(customer_id=17, memories={'nome_completo': 'Paulo', 'plano_interesse': 'semestral'})
+        """
+        if not customer_id:
+            return {"error": "customer_id é obrigatório"}
+
+        memories = {
+            str(key): str(value)
+            for key, value in (memories or {}).items()
+            if key and value not in (None, "")
+        }
+        if not memories:
+            return {"error": "Nenhuma memória informada. Use: save_memories(customer_id=X, memories={'key': 'value'})"}
+
+        return self._upsert_memories(customer_id, memories)
 
     def get_important_memories(self, customer_id: int) -> Dict[str, Any]:
         """
         RETRIEVE critical facts about the customer that should NEVER be forgotten.
-        Call this AFTER get_conversation_history to get: name, subscriber status, who referred them, chosen plan.
+        Call this ONLY when the message does NOT include the [CONTEXTO DO CLIENTE] block
+        (it already lists the memories): name, subscriber status, who referred them, chosen plan.
 
         Args:
             customer_id: Customer's unique ID
@@ -382,7 +447,9 @@ class SPDropMemoryTools(Toolkit):
             Dictionary with memories like: {'nome_completo': {'value': 'Paulo', 'updated_at': '...'}, 'is_subscriber': {...}}
             Empty dict if no memories saved.
         """
-        import json
+        cached = customer_cache.get("memories", customer_id)
+        if cached is not MISSING:
+            return cached
 
         conn = self._get_connection()
         if not conn:
@@ -391,19 +458,14 @@ class SPDropMemoryTools(Toolkit):
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute("""
-                    SELECT notes FROM customer_context
+                    SELECT memories FROM customer_memories
                     WHERE customer_id = %s
                 """, (customer_id,))
                 result = cur.fetchone()
+                memories = result['memories'] if result else {}
 
-                if result and result['notes']:
-                    try:
-                        memories = json.loads(result['notes'])
-                        return memories
-                    except:
-                        return {}
-                else:
-                    return {}
+                customer_cache.set("memories", customer_id, memories, customer_id)
+                return memories
         except psycopg2.Error:
             return {}
         finally:
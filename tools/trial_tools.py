@@ -1,23 +1,15 @@
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from agno.tools import Toolkit
+from db_pool import db_pool
+from customer_cache import customer_cache
 from typing import List, Dict, Any
 from datetime import datetime, timedelta
-import os
 
 class TrialManagementTools(Toolkit):
     """Ferramentas para gerenciar testes grátis de 7 dias"""
 
     def __init__(self):
-        # Database configuration
-        self.conn_params = {
-            "host": os.getenv("DB_HOST", "postgres"),
-            "port": int(os.getenv("DB_PORT", "5432")),
-            "database": os.getenv("DB_NAME", "spdrop_db"),
-            "user": os.getenv("DB_USER", "spdrop_user"),
-            "password": os.getenv("DB_PASSWORD", "spdrop_password")
-        }
-
         # Register all tools in the constructor
         tools = [
             self.create_trial_user,
@@ -31,10 +23,9 @@ class TrialManagementTools(Toolkit):
         super().__init__(name="trial_management", tools=tools)
 
     def _get_connection(self):
-        """Criar conexão com o banco de dados"""
+        """Obter conexão do pool compartilhado (close() devolve ao pool)"""
         try:
-            conn = psycopg2.connect(**self.conn_params)
-            return conn
+            return db_pool.getconn()
         except psycopg2.Error as e:
             return None
 
@@ -101,6 +92,19 @@ class TrialManagementTools(Toolkit):
 
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                # Um teste ativo por cliente (a tool fica disponível em todas as etapas)
+                cur.execute("""
+                    SELECT trial_end_date FROM trial_users
+                    WHERE customer_id = %s AND status = 'active' AND trial_end_date > CURRENT_TIMESTAMP
+                    ORDER BY created_at DESC LIMIT 1
+                """, (customer_id,))
+                active = cur.fetchone()
+                if active:
+                    return {
+                        "error": "Cliente já tem um teste 7 dias ativo - não crie outro.",
+                        "trial_end_date": active['trial_end_date'].isoformat()
+                    }
+
                 # Calcular data de término (7 dias)
                 trial_end = datetime.now() + timedelta(days=7)
 
@@ -111,9 +115,11 @@ class TrialManagementTools(Toolkit):
                     VALUES (%s, %s, %s, %s, %s, %s, %s, 'active')
                     RETURNING id, full_name, email, trial_start_date, trial_end_date, status
                 """, (customer_id, full_name, cpf, phone, email, trial_end, notes))
+                trial = cur.fetchone()
+                customer_cache.notify_invalidation(cur, customer_id, ("turn_context",))
 
                 conn.commit()
-                trial = cur.fetchone()
+                customer_cache.invalidate_customer(customer_id, ("turn_context",))
 
                 return {
                     "success": True,
@@ -258,13 +264,16 @@ class TrialManagementTools(Toolkit):
                         notes = COALESCE(%s, notes),
                         updated_at = CURRENT_TIMESTAMP
                     WHERE id = %s
-                    RETURNING id, full_name, status, updated_at
+                    RETURNING id, customer_id, full_name, status, updated_at
                 """, (status, notes, trial_id))
 
-                conn.commit()
                 trial = cur.fetchone()
+                if trial:
+                    customer_cache.notify_invalidation(cur, trial['customer_id'], ("turn_context",))
+                conn.commit()
 
                 if trial:
+                    customer_cache.invalidate_customer(trial['customer_id'], ("turn_context",))
                     return {
                         "success": True,
                         "message": f"Status atualizado para '{status}'",
@@ -302,13 +311,16 @@ class TrialManagementTools(Toolkit):
                         conversion_date = CURRENT_TIMESTAMP,
                         updated_at = CURRENT_TIMESTAMP
                     WHERE id = %s
-                    RETURNING id, full_name, converted_to_plan, conversion_date
+                    RETURNING id, customer_id, full_name, converted_to_plan, conversion_date
                 """, (plan_name, trial_id))
 
-                conn.commit()
                 trial = cur.fetchone()
+                if trial:
+                    customer_cache.notify_invalidation(cur, trial['customer_id'], ("turn_context",))
+                conn.commit()
 
                 if trial:
+                    customer_cache.invalidate_customer(trial['customer_id'], ("turn_context",))
                     return {
                         "success": True,
                         "message": f"🎉 {trial['full_name']} converteu para {plan_name}!",
@@ -1,14 +1,24 @@
 import os
+import time
 import base64
-import tempfile
+import random
+import asyncio
 import logging
-from groq import Groq
+from typing import Any, Dict
+from groq import Groq, AsyncGroq, APIConnectionError, APITimeoutError, APIStatusError
 from dotenv import load_dotenv
 
+from media_cache import media_cache
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+TRANSCRIPTION_MODEL = "whisper-large-v3-turbo"
+TRANSCRIPTION_LANGUAGE = "pt"
+FAILED_TRANSCRIPTION = "[Não foi possível transcrever o áudio]"
+
+
 class TranscriptionService:
     """Serviço de transcrição de áudio usando Groq Whisper Large v3"""
 
@@ -18,13 +28,42 @@ class TranscriptionService:
         if not api_key:
             raise ValueError("GROQ_API_KEY não encontrada no .env")
 
-        self.client = Groq(api_key=api_key)
+        self.timeout = float(os.getenv("TRANSCRIPTION_TIMEOUT", "30"))
+        self.max_attempts = int(os.getenv("TRANSCRIPTION_MAX_ATTEMPTS", "3"))
+        self.retry_base = float(os.getenv("TRANSCRIPTION_RETRY_BASE", "0.5"))
+        self.concurrency = int(os.getenv("TRANSCRIPTION_CONCURRENCY", "4"))
+
+        self.client = Groq(api_key=api_key, timeout=self.timeout)
+        # Novas tentativas ficam com transcribe_audio_async (com métricas)
+        self.async_client = AsyncGroq(api_key=api_key, timeout=self.timeout, max_retries=0)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        # Métricas (tempo acumulado por etapa, em segundos)
+        self._transcriptions = 0
+        self._failures = 0
+        self._retries = 0
+        self._stage_totals = {"decode": 0.0, "cache": 0.0, "queue": 0.0, "api": 0.0, "total": 0.0}
+
         logger.info("✅ TranscriptionService inicializado com Groq Whisper")
 
+    def _decode(self, audio_base64: str, mimetype: str):
+        """Decodifica o base64 uma única vez e monta o arquivo em memória para o upload"""
+        audio_bytes = base64.b64decode(audio_base64)
+        extension = self._get_extension_from_mimetype(mimetype)
+        return (f"audio{extension}", audio_bytes)
+
+    @staticmethod
+    def _text(transcription) -> str:
+        # Groq retorna texto direto quando response_format="text"
+        return transcription.strip() if isinstance(transcription, str) else transcription.text.strip()
+
     def transcribe_audio(self, audio_base64: str, mimetype: str = "audio/ogg") -> str:
         """
         Transcreve áudio base64 para texto usando Groq Whisper Large v3 Turbo
 
+        Versão síncrona (scripts e ferramentas); o webhook usa
+        transcribe_audio_async.
+
         Args:
             audio_base64: Áudio em formato base64
             mimetype: Tipo do arquivo (audio/ogg, audio/mpeg, etc.)
@@ -35,46 +74,121 @@ class TranscriptionService:
         try:
             logger.info(f"🎤 Iniciando transcrição de áudio ({mimetype})...")
 
-            # Converter base64 para bytes
-            audio_bytes = base64.b64decode(audio_base64)
-            logger.info(f"📊 Áudio decodificado: {len(audio_bytes)} bytes")
-
-            # Determinar extensão do arquivo baseado no mimetype
-            extension = self._get_extension_from_mimetype(mimetype)
-
-            # Salvar temporariamente (Groq precisa de arquivo)
-            with tempfile.NamedTemporaryFile(suffix=extension, delete=False) as temp_file:
-                temp_file.write(audio_bytes)
-                temp_file_path = temp_file.name
-                logger.info(f"💾 Áudio salvo temporariamente: {temp_file_path}")
-
-            try:
-                # Transcrever usando Groq Whisper Large v3 Turbo
-                with open(temp_file_path, "rb") as audio_file:
-                    transcription = self.client.audio.transcriptions.create(
-                        file=(f"audio{extension}", audio_file.read()),
-                        model="whisper-large-v3-turbo",
-                        language="pt",  # Português
-                        response_format="text"
-                    )
-
-                # Groq retorna texto direto quando response_format="text"
-                transcribed_text = transcription.strip() if isinstance(transcription, str) else transcription.text.strip()
+            audio_file = self._decode(audio_base64, mimetype)
+            logger.info(f"📊 Áudio decodificado: {len(audio_file[1])} bytes")
 
-                logger.info(f"✅ Transcrição concluída: '{transcribed_text[:100]}...'")
-                return transcribed_text
+            transcription = self.client.audio.transcriptions.create(
+                file=audio_file,
+                model=TRANSCRIPTION_MODEL,
+                language=TRANSCRIPTION_LANGUAGE,  # Português
+                response_format="text"
+            )
 
-            finally:
-                # Limpar arquivo temporário
-                try:
-                    os.unlink(temp_file_path)
-                    logger.info(f"🗑️ Arquivo temporário removido: {temp_file_path}")
-                except Exception as e:
-                    logger.warning(f"Aviso: Não foi possível remover arquivo temporário: {e}")
+            transcribed_text = self._text(transcription)
+            logger.info(f"✅ Transcrição concluída: '{transcribed_text[:100]}...'")
+            return transcribed_text
 
         except Exception as e:
             logger.error(f"❌ Erro ao transcrever áudio: {str(e)}", exc_info=True)
-            return "[Não foi possível transcrever o áudio]"
+            return FAILED_TRANSCRIPTION
+
+    async def transcribe_audio_async(self, audio_base64: str = None, mimetype: str = "audio/ogg",
+                                     audio_bytes: bytes = None) -> str:
+        """
+        Transcreve áudio base64 sem bloquear o event loop
+
+        - decodifica o base64 uma vez, direto para memória (sem arquivo temporário)
+        - no máximo TRANSCRIPTION_CONCURRENCY chamadas simultâneas à Groq
+        - timeout TRANSCRIPTION_TIMEOUT por chamada e novas tentativas com
+          backoff em erro de rede, timeout, 429 e 5xx
+        - o mesmo áudio (SHA-256 dos bytes) é respondido pelo media_cache
+        - registra o tempo de cada etapa (decode, cache, fila, API)
+
+        Args:
+            audio_base64: Áudio em formato base64
+            mimetype: Tipo do arquivo (audio/ogg, audio/mpeg, etc.)
+            audio_bytes: Áudio já decodificado (dispensa audio_base64)
+
+        Returns:
+            Texto transcrito do áudio
+        """
+        started = time.monotonic()
+        stages = {"decode": 0.0, "cache": 0.0, "queue": 0.0, "api": 0.0}
+
+        try:
+            if audio_bytes is not None:
+                audio_file = (f"audio{self._get_extension_from_mimetype(mimetype)}", audio_bytes)
+            else:
+                audio_file = self._decode(audio_base64, mimetype)
+        except (ValueError, TypeError) as e:
+            logger.error(f"❌ Áudio inválido ({mimetype}): {e}")
+            self._failures += 1
+            return FAILED_TRANSCRIPTION
+        stages["decode"] = time.monotonic() - started
+
+        # Áudio repetido (encaminhado por vários leads): sem chamada externa
+        cache_started = time.monotonic()
+        cache_key = media_cache.key("audio", audio_file[1], TRANSCRIPTION_MODEL, TRANSCRIPTION_LANGUAGE)
+        cached = await media_cache.get("audio", cache_key)
+        stages["cache"] = time.monotonic() - cache_started
+        if cached is not None:
+            logger.info(f"⚡ Transcrição em cache ({len(audio_file[1])} bytes, {stages['cache'] * 1000:.0f}ms)")
+            return cached
+
+        transcribed_text = None
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            retryable = True
+            queued = time.monotonic()
+            async with self._semaphore:
+                stages["queue"] += time.monotonic() - queued
+                call_started = time.monotonic()
+                try:
+                    transcription = await self.async_client.audio.transcriptions.create(
+                        file=audio_file,
+                        model=TRANSCRIPTION_MODEL,
+                        language=TRANSCRIPTION_LANGUAGE,  # Português
+                        response_format="text"
+                    )
+                    transcribed_text = self._text(transcription)
+                except (APIConnectionError, APITimeoutError) as e:
+                    error = f"{type(e).__name__}: {e}"
+                except APIStatusError as e:
+                    error = f"HTTP {e.status_code}"
+                    retryable = e.status_code >= 500 or e.status_code == 429
+                except Exception as e:
+                    # Resposta inesperada: não adianta repetir
+                    error = f"{type(e).__name__}: {e}"
+                    retryable = False
+                finally:
+                    stages["api"] += time.monotonic() - call_started
+
+            if transcribed_text is not None:
+                break
+
+            if not retryable or attempt == self.max_attempts:
+                self._failures += 1
+                logger.error(f"❌ Erro ao transcrever áudio após {attempt} tentativa(s): {error}")
+                return FAILED_TRANSCRIPTION
+
+            self._retries += 1
+            backoff = self.retry_base * (2 ** (attempt - 1)) * (0.5 + random.random())
+            logger.warning(f"🔁 Transcrição falhou ({error}) - nova tentativa em {backoff:.1f}s")
+            await asyncio.sleep(backoff)
+
+        await media_cache.set("audio", cache_key, transcribed_text, len(audio_file[1]))
+
+        stages["total"] = time.monotonic() - started
+        self._transcriptions += 1
+        for stage, elapsed in stages.items():
+            self._stage_totals[stage] += elapsed
+
+        logger.info(
+            f"✅ Transcrição concluída ({len(audio_file[1])} bytes): "
+            + " ".join(f"{stage}={elapsed * 1000:.0f}ms" for stage, elapsed in stages.items())
+            + f" - '{transcribed_text[:100]}...'"
+        )
+        return transcribed_text
 
     def _get_extension_from_mimetype(self, mimetype: str) -> str:
         """
@@ -95,7 +209,22 @@ class TranscriptionService:
             "audio/opus": ".opus"
         }
 
-        return mime_to_ext.get(mimetype.lower(), ".ogg")  # Default: .ogg
+        # WhatsApp manda "audio/ogg; codecs=opus"
+        return mime_to_ext.get(mimetype.split(";")[0].strip().lower(), ".ogg")  # Default: .ogg
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas de transcrição (tempo médio por etapa)"""
+        done = self._transcriptions
+        return {
+            "transcriptions": done,
+            "failures": self._failures,
+            "retries": self._retries,
+            "concurrency": self.concurrency,
+            **{
+                f"{stage}_avg_ms": round(total / done * 1000, 1) if done else 0.0
+                for stage, total in self._stage_totals.items()
+            }
+        }
 
 # Instância global
 transcription_service = TranscriptionService()
@@ -84,6 +84,7 @@ function initializeClient() {
 
         // Preparar payload base
         let payload = {
+            id: message.id._serialized,  // usado pelo bot para deduplicar
             from: message.from,
             body: message.body,
             timestamp: message.timestamp,
@@ -137,6 +138,12 @@ function initializeClient() {
             }
         }
 
+        // Figurinha: não baixa a mídia - o bot só registra que ela chegou
+        if (message.type === 'sticker') {
+            console.log('🙂 Figurinha recebida');
+            payload.body = '[Figurinha recebida]';  // Placeholder
+        }
+
         // Enviar para webhook do bot Python
         try {
             const fetch = (await import('node-fetch')).default;
@@ -302,13 +309,58 @@ app.get('/qr', async (req, res) => {
     }
 });
 
+// Idempotência dos envios: chave -> { promise, at }
+// O bot repete uma parte com a mesma idempotency_key quando a resposta se perde
+// (timeout); uma chave já enviada (ou em envio) não é enviada de novo.
+// Fica em memória: um restart do serviço esquece as chaves.
+const SEND_DEDUP_TTL_MS = Number(process.env.SEND_DEDUP_TTL_MS) || 60 * 60 * 1000;
+const sentKeys = new Map();
+
+function pruneSentKeys() {
+    // Map mantém a ordem de inserção: as mais antigas vêm primeiro
+    const cutoff = Date.now() - SEND_DEDUP_TTL_MS;
+    for (const [key, entry] of sentKeys) {
+        if (entry.at >= cutoff) {
+            break;
+        }
+        sentKeys.delete(key);
+    }
+}
+
+// Envia uma vez por chave; resolve true se a chave já tinha sido enviada
+async function sendOnce(chatId, message, key) {
+    if (!key) {
+        await client.sendMessage(chatId, message);
+        return false;
+    }
+
+    pruneSentKeys();
+    const known = sentKeys.get(key);
+    if (known) {
+        await known.promise;
+        return true;
+    }
+
+    const promise = client.sendMessage(chatId, message);
+    sentKeys.set(key, { promise, at: Date.now() });
+    try {
+        await promise;
+    } catch (error) {
+        // Não saiu: a próxima tentativa com a mesma chave envia de novo
+        sentKeys.delete(key);
+        throw error;
+    }
+    return false;
+}
+
 // Enviar mensagem de texto
+// Corpo: { number, message, idempotency_key? }
 app.post('/send', async (req, res) => {
     if (!isReady) {
         return res.status(503).json({ error: 'WhatsApp não está conectado' });
     }
 
-    const { number, message } = req.body;
+    const { number, message, idempotency_key: idempotencyKey } = req.body;
 
     if (!number || !message) {
         return res.status(400).json({ error: 'Número e mensagem são obrigatórios' });
@@ -335,12 +387,13 @@ app.post('/send', async (req, res) => {
         }
 
         // Enviar mensagem usando o ID verificado
-        await client.sendMessage(chatId, message);
+        const duplicate = await sendOnce(chatId, message, idempotencyKey);
 
         res.json({
             status: 'success',
-            message: 'Mensagem enviada com sucesso',
-            to: number
+            message: duplicate ? 'Mensagem já enviada anteriormente' : 'Mensagem enviada com sucesso',
+            to: number,
+            duplicate
         });
     } catch (error) {
         console.error('Erro ao enviar mensagem:', error);
@@ -351,6 +404,93 @@ app.post('/send', async (req, res) => {
     }
 });
 
+// Enviar várias mensagens ao mesmo número em uma requisição
+// Corpo: { number, messages: [{ message, delay_ms, idempotency_key? }] } - delay_ms é a pausa depois da parte
+// Para na primeira falha e responde quantas partes foram enviadas (sent) e o
+// resultado de cada uma (results: 'sent' ou 'duplicate' - já enviada antes)
+app.post('/send-batch', async (req, res) => {
+    if (!isReady) {
+        return res.status(503).json({ error: 'WhatsApp não está conectado' });
+    }
+
+    const { number, messages } = req.body;
+
+    if (!number || !Array.isArray(messages) || messages.length === 0) {
+        return res.status(400).json({ error: 'Número e lista de mensagens são obrigatórios' });
+    }
+
+    if (messages.some((item) => !item || !item.message)) {
+        return res.status(400).json({ error: 'Todas as mensagens precisam de texto' });
+    }
+
+    let chatId;
+    try {
+        // Resolve o número uma única vez para o lote inteiro
+        if (number.includes('@c.us') || number.includes('@lid')) {
+            chatId = number;
+        } else {
+            const numberId = await client.getNumberId(number);
+
+            if (!numberId) {
+                return res.status(404).json({
+                    error: 'Número não encontrado',
+                    details: 'Este número não está registrado no WhatsApp'
+                });
+            }
+
+            chatId = numberId._serialized;
+        }
+    } catch (error) {
+        console.error('Erro ao verificar número:', error);
+        return res.status(500).json({
+            error: 'Erro ao verificar número',
+            details: error.message
+        });
+    }
+
+    let sent = 0;
+    let duplicates = 0;
+    const results = [];
+    try {
+        for (const [index, item] of messages.entries()) {
+            const duplicate = await sendOnce(chatId, item.message, item.idempotency_key);
+            sent++;
+            results.push({ idempotency_key: item.idempotency_key || null, status: duplicate ? 'duplicate' : 'sent' });
+            if (duplicate) {
+                duplicates++;
+                // Parte já entregue por uma tentativa anterior: sem pausa
+                continue;
+            }
+
+            const delay = Number(item.delay_ms) || 0;
+            if (delay > 0 && index < messages.length - 1) {
+                await new Promise((resolve) => setTimeout(resolve, delay));
+            }
+        }
+
+        res.json({
+            status: 'success',
+            sent,
+            duplicates,
+            total: messages.length,
+            results,
+            to: number
+        });
+    } catch (error) {
+        console.error(`Erro ao enviar lote (${sent}/${messages.length} enviadas):`, error);
+        // 200 com envio parcial: o cliente repete só as partes que faltam
+        res.json({
+            status: 'partial',
+            sent,
+            duplicates,
+            total: messages.length,
+            results,
+            to: number,
+            error: error.message
+        });
+    }
+});
+
 // Status da conexão
 app.get('/status', async (req, res) => {
     if (!isReady) {
@@ -1,6 +1,7 @@
 import httpx
 import os
-from typing import Optional, Dict, Any
+import time
+from typing import Optional, Dict, Any, List
 import logging
 from dotenv import load_dotenv
 
@@ -8,37 +9,105 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# HTTP/2 é opcional: precisa do pacote h2 (pip install httpx[http2])
+try:
+    import h2  # noqa: F401
+    H2_AVAILABLE = True
+except ImportError:
+    H2_AVAILABLE = False
+
+
+def http_limits() -> httpx.Limits:
+    """
+    Limites do pool de conexões com o whatsapp-service
+
+    Usados pelo bot (main.py) e pela API administrativa (api/qrcode.py), para
+    que os dois reaproveitem conexões keep-alive em vez de abrir uma por
+    requisição.
+    """
+    return httpx.Limits(
+        max_connections=int(os.getenv("WHATSAPP_HTTP_MAX_CONNECTIONS", "20")),
+        max_keepalive_connections=int(os.getenv("WHATSAPP_HTTP_MAX_KEEPALIVE", "10")),
+        keepalive_expiry=float(os.getenv("WHATSAPP_HTTP_KEEPALIVE_EXPIRY", "60"))
+    )
+
+
 class WhatsAppClient:
     """Cliente para interagir com WhatsApp Web.js API"""
 
     def __init__(self):
         self.base_url = os.getenv("WHATSAPP_API_URL", "http://localhost:3000")
-        self.client = httpx.AsyncClient(timeout=30.0)
+        self.timeout = float(os.getenv("WHATSAPP_HTTP_TIMEOUT", "30"))
+        self.limits = http_limits()
+        self.http2 = os.getenv("WHATSAPP_HTTP2", "false").lower() == "true" and H2_AVAILABLE
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=self.timeout,
+            limits=self.limits,
+            http2=self.http2
+        )
+
+        # Métricas
+        self._requests = 0
+        self._errors = 0
+        self._in_flight = 0
+        self._request_time_total = 0.0
+        self._batches = 0
+        self._batched_parts = 0
+
+    async def request(self, method: str, path: str, timeout: float = None, **kwargs) -> httpx.Response:
+        """
+        Requisição ao whatsapp-service pelo pool compartilhado
 
-    async def send_text(self, to: str, text: str) -> Dict[str, Any]:
+        Args:
+            method: Método HTTP
+            path: Caminho (ex: '/status')
+            timeout: Timeout desta requisição (padrão WHATSAPP_HTTP_TIMEOUT)
+
+        Returns:
+            Resposta HTTP (sem raise_for_status)
+        """
+        started = time.monotonic()
+        self._in_flight += 1
+        try:
+            return await self.client.request(
+                method, path, timeout=timeout if timeout is not None else self.timeout, **kwargs
+            )
+        except httpx.HTTPError:
+            self._errors += 1
+            raise
+        finally:
+            self._in_flight -= 1
+            self._requests += 1
+            self._request_time_total += time.monotonic() - started
+
+    async def send_text(self, to: str, text: str, idempotency_key: str = None) -> Dict[str, Any]:
         """
         Envia mensagem de texto via WhatsApp
 
         Args:
             to: Número do destinatário (formato: 5511999999999)
             text: Texto da mensagem
+            idempotency_key: Chave da mensagem - o serviço não reenvia uma
+                             chave que já saiu (seguro repetir após timeout)
 
         Returns:
-            Resposta da API
+            Resposta da API ({"duplicate": true} se a chave já tinha sido enviada)
         """
         try:
             # Garantir formato correto do número
             phone = to.replace("@c.us", "").replace("@s.whatsapp.net", "")
 
-            url = f"{self.base_url}/send"
             payload = {
                 "number": phone,
                 "message": text
             }
+            if idempotency_key:
+                payload["idempotency_key"] = idempotency_key
 
             logger.info(f"Enviando mensagem para {phone}: {text[:50]}...")
 
-            response = await self.client.post(url, json=payload)
+            response = await self.request("POST", "/send", json=payload)
             response.raise_for_status()
 
             result = response.json()
@@ -53,6 +122,54 @@ class WhatsAppClient:
             logger.error(f"Erro ao enviar mensagem: {str(e)}", exc_info=True)
             raise
 
+    async def send_batch(self, to: str, parts: List[str], delays: List[float] = None,
+                         keys: List[str] = None) -> Dict[str, Any]:
+        """
+        Envia várias mensagens ao mesmo destinatário em uma requisição
+
+        O whatsapp-service resolve o número uma vez e envia as partes em ordem,
+        aguardando delays[i] segundos depois da parte i (a pausa depois da
+        última fica com quem chamou).
+
+        Args:
+            to: Número do destinatário (formato: 5511999999999)
+            parts: Textos das mensagens, em ordem
+            delays: Pausa depois de cada parte (padrão: sem pausa)
+            keys: Chave de idempotência de cada parte (partes já enviadas
+                  com a mesma chave não são reenviadas)
+
+        Returns:
+            Resposta da API: {"sent": n, "total": n, "duplicates": n, "results": [...],
+            "error": ...} - se sent < total, as partes a partir de `sent` não foram enviadas
+        """
+        phone = to.replace("@c.us", "").replace("@s.whatsapp.net", "")
+        delays = delays or [0.0] * len(parts)
+        keys = keys or [None] * len(parts)
+        messages = []
+        for text, delay, key in zip(parts, delays, keys):
+            message = {"message": text, "delay_ms": int(delay * 1000)}
+            if key:
+                message["idempotency_key"] = key
+            messages.append(message)
+        payload = {"number": phone, "messages": messages}
+
+        logger.info(f"Enviando {len(parts)} mensagens em lote para {phone}")
+
+        try:
+            # As pausas acontecem dentro da requisição
+            response = await self.request(
+                "POST", "/send-batch", json=payload, timeout=self.timeout + sum(delays[:-1])
+            )
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            logger.error(f"Erro HTTP ao enviar lote: {e.response.status_code} - {e.response.text}")
+            raise
+
+        result = response.json()
+        self._batches += 1
+        self._batched_parts += result.get("sent", 0)
+        return result
+
     async def get_status(self) -> Dict[str, Any]:
         """
         Verifica status da conexão WhatsApp
@@ -61,8 +178,7 @@ class WhatsAppClient:
             Status da conexão
         """
         try:
-            url = f"{self.base_url}/status"
-            response = await self.client.get(url)
+            response = await self.request("GET", "/status")
             response.raise_for_status()
 
             return response.json()
@@ -79,8 +195,7 @@ class WhatsAppClient:
             Dados com QR Code
         """
         try:
-            url = f"{self.base_url}/qr"
-            response = await self.client.get(url)
+            response = await self.request("GET", "/qr")
             response.raise_for_status()
 
             return response.json()
@@ -97,8 +212,7 @@ class WhatsAppClient:
             Status do serviço
         """
         try:
-            url = f"{self.base_url}/health"
-            response = await self.client.get(url)
+            response = await self.request("GET", "/health")
             response.raise_for_status()
 
             return response.json()
@@ -115,8 +229,7 @@ class WhatsAppClient:
             Resultado do logout
         """
         try:
-            url = f"{self.base_url}/logout"
-            response = await self.client.post(url)
+            response = await self.request("POST", "/logout")
             response.raise_for_status()
 
             return response.json()
@@ -125,6 +238,23 @@ class WhatsAppClient:
             logger.error(f"Erro ao fazer logout: {str(e)}")
             raise
 
+    def stats(self) -> Dict[str, Any]:
+        """Métricas do pool HTTP com o whatsapp-service"""
+        pool = getattr(getattr(self.client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        return {
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive": self.limits.max_keepalive_connections,
+            "open_connections": len(connections) if connections is not None else None,
+            "in_flight": self._in_flight,
+            "requests": self._requests,
+            "errors": self._errors,
+            "request_avg_ms": round(self._request_time_total / self._requests * 1000, 1) if self._requests else 0.0,
+            "batches": self._batches,
+            "batched_parts": self._batched_parts
+        }
+
     async def close(self):
         """Fecha o client HTTP"""
         await self.client.aclose()